@@ -2,8 +2,9 @@
 from .messaging_pyx import Context, Poller, SubSocket, PubSocket  # pylint: disable=no-name-in-module, import-error
 from .messaging_pyx import MultiplePublishersError, MessagingError  # pylint: disable=no-name-in-module, import-error
 import capnp
+import struct
 
-from typing import Optional, List, Union
+from typing import Optional, List, Union, Tuple
 
 from cereal import log
 from cereal.services import service_list
@@ -21,6 +22,59 @@ except ImportError:
 
 context = Context()
 
+# Event header layout, resolved from the schema so the peek stays in sync with log.capnp
+def _event_layout():
+  node = log.Event.schema.node.struct
+  union_names = {}
+  mono_time_offset, valid_offset, valid_default = None, None, True
+  for f in node.fields:
+    if f.discriminantValue != 0xffff:
+      union_names[f.discriminantValue] = f.name
+    elif f.name == 'logMonoTime':
+      mono_time_offset = f.slot.offset * 8  # UInt64 offset is in words
+    elif f.name == 'valid':
+      valid_offset = f.slot.offset  # Bool offset is in bits
+      valid_default = f.slot.defaultValue.bool
+  return mono_time_offset, valid_offset, valid_default, node.discriminantOffset * 2, union_names
+
+EVENT_MONO_TIME_OFFSET, EVENT_VALID_OFFSET, EVENT_VALID_DEFAULT, EVENT_WHICH_OFFSET, EVENT_UNION_NAMES = _event_layout()
+_u32 = struct.Struct('<I')
+_u64 = struct.Struct('<Q')
+_u16 = struct.Struct('<H')
+
+def peek_event(dat: bytes) -> Optional[Tuple[str, int, bool]]:
+  """Read which(), logMonoTime and valid from a serialized Event without decoding it.
+  Returns None for messages that can't be peeked (multiple segments, far pointers), those need a full decode."""
+  if len(dat) < 16 or _u32.unpack_from(dat, 0)[0] != 0:
+    return None
+
+  ptr = _u64.unpack_from(dat, 8)[0]
+  if ptr & 3 != 0:  # not a struct pointer
+    return None
+
+  offset = (ptr >> 2) & 0x3fffffff
+  if offset & 0x20000000:  # signed 30 bit
+    offset -= 0x40000000
+  data_start = 16 + offset * 8
+  data_end = data_start + ((ptr >> 32) & 0xffff) * 8
+  if data_start < 16 or data_end > len(dat) or data_end < data_start + EVENT_WHICH_OFFSET + 2:
+    return None
+
+  which = EVENT_UNION_NAMES.get(_u16.unpack_from(dat, data_start + EVENT_WHICH_OFFSET)[0])
+  if which is None:
+    return None
+
+  log_mono_time = 0
+  if data_start + EVENT_MONO_TIME_OFFSET + 8 <= data_end:
+    log_mono_time = _u64.unpack_from(dat, data_start + EVENT_MONO_TIME_OFFSET)[0]
+
+  valid = EVENT_VALID_DEFAULT
+  valid_byte = data_start + EVENT_VALID_OFFSET // 8
+  if valid_byte < data_end:
+    valid = bool((dat[valid_byte] >> (EVENT_VALID_OFFSET % 8)) & 1) != EVENT_VALID_DEFAULT  # stored xor default
+
+  return which, log_mono_time, valid
+
 def new_message(service: Optional[str] = None, size: Optional[int] = None) -> capnp.lib.capnp._DynamicStructBuilder:
   dat = log.Event.new_message()
   dat.logMonoTime = int(sec_since_boot() * 1e9)
@@ -32,6 +86,79 @@ def new_message(service: Optional[str] = None, size: Optional[int] = None) -> ca
       dat.init(service, size)
   return dat
 
+POINTER_TYPES = {'text', 'data', 'list', 'struct', 'interface', 'anyPointer'}
+
+class ReusableMessage():
+  """Keeps one Event builder per service and refills it every frame instead of building a new message.
+  Scalar fields are overwritten in place, but every write of a text, data, list or struct field takes new space
+  in the arena and leaves the old value behind, which is also serialized. set() only writes those when they
+  changed, and once the message grows past max_growth times its size after the last rebuild, the struct is copied
+  into a new builder, which leaves the dead space behind. Structs assigned every frame, like controlsState's
+  lateral control state, grow the message by their size each frame, so a low max_growth keeps messages small."""
+  def __init__(self, service: str, size: Optional[int] = None, max_growth: float = 1.25):
+    self.service = service
+    self.size = size
+    self.max_growth = max_growth
+    self.rebuilds = 0
+    self._new()
+
+    schema_fields = self.data.schema.fields
+    self.fields = {name: f for name, f in schema_fields.items() if f.proto.which() == 'slot'}
+    self.pointer_fields = {name for name, f in self.fields.items() if f.proto.slot.type.which() in POINTER_TYPES}
+    # lists of scalars keep their elements in the list, so a list of the same length can be overwritten in place
+    self.scalar_list_fields = {name for name in self.pointer_fields if self.fields[name].proto.slot.type.which() == 'list' and
+                               self.fields[name].proto.slot.type.list.elementType.which() not in POINTER_TYPES}
+    # fields whose last value can be kept as an immutable copy, structs are always written
+    self.comparable_fields = self.scalar_list_fields | {name for name in self.pointer_fields
+                                                        if self.fields[name].proto.slot.type.which() in ('text', 'data')}
+
+  def _new(self, prev: Optional[capnp.lib.capnp._DynamicStructBuilder] = None) -> None:
+    if prev is None:
+      self.msg = new_message(self.service, self.size)
+      self.written: dict = {}  # copy of the last value set() wrote to each comparable field
+    else:
+      # the copy only takes the live values, so it's compact and the written values stay valid
+      self.msg = new_message()
+      setattr(self.msg, self.service, prev)
+    self.data = getattr(self.msg, self.service)
+    self.base_size = 0
+    self.rebuild = False
+
+  def start(self, valid: bool = True) -> capnp.lib.capnp._DynamicStructBuilder:
+    """Returns the service struct to fill, fields not set again keep last frame's values"""
+    if self.rebuild:
+      self.rebuilds += 1
+      self._new(self.data)
+    self.msg.logMonoTime = int(sec_since_boot() * 1e9)
+    self.msg.valid = valid
+    return self.data
+
+  def set(self, values) -> None:
+    """Batched assignment of top level fields from a dict or a sequence of (name, value)"""
+    data, written = self.data, self.written
+    for name, value in (values.items() if isinstance(values, dict) else values):
+      if name in self.comparable_fields:
+        # keep a copy, the caller can change its list in place after handing it over
+        copy = tuple(value) if name in self.scalar_list_fields else value
+        prev = written.get(name)
+        written[name] = copy
+        if prev is not None and prev == copy:
+          continue
+        if prev is not None and name in self.scalar_list_fields and len(prev) == len(copy):
+          lst = getattr(data, name)
+          for i, v in enumerate(copy):
+            lst[i] = v
+          continue
+      setattr(data, name, value)
+
+  def to_bytes(self) -> bytes:
+    dat = self.msg.to_bytes()
+    self.msg.clear_write_flag()
+    if self.base_size == 0:
+      self.base_size = len(dat)
+    self.rebuild = len(dat) > self.base_size * self.max_growth
+    return dat
+
 def pub_sock(endpoint: str) -> PubSocket:
   sock = PubSocket()
   sock.connect(context, endpoint)
@@ -126,8 +253,10 @@ def recv_one_retry(sock: SubSocket) -> capnp.lib.capnp._DynamicStructReader:
 
 class SubMaster():
   def __init__(self, services: List[str], poll: Optional[List[str]] = None,
-               ignore_alive: Optional[List[str]] = None, addr:str ="127.0.0.1"):
+               ignore_alive: Optional[List[str]] = None, addr:str ="127.0.0.1", lazy: bool = False):
     self.frame = -1
+    self.lazy = lazy  # keep raw bytes and only decode a service when it's accessed
+    self.raw = {}
     self.updated = {s: False for s in services}
     self.rcv_time = {s: 0. for s in services}
     self.rcv_frame = {s: 0 for s in services}
@@ -163,9 +292,17 @@ class SubMaster():
       self.valid[s] = data.valid
 
   def __getitem__(self, s: str) -> capnp.lib.capnp._DynamicStructReader:
+    if s in self.raw:
+      self.data[s] = getattr(log.Event.from_bytes(self.raw.pop(s)), s)
     return self.data[s]
 
   def update(self, timeout: int = 1000) -> None:
+    if self.lazy:
+      dats = [sock.receive(non_blocking=True) for sock in self.poller.poll(timeout)]
+      dats += [self.sock[s].receive(non_blocking=True) for s in self.non_polled_services]
+      self.update_raw(sec_since_boot(), dats)
+      return
+
     msgs = []
     for sock in self.poller.poll(timeout):
       msgs.append(recv_one_or_none(sock))
@@ -176,20 +313,51 @@ class SubMaster():
     self.update_msgs(sec_since_boot(), msgs)
 
   def update_msgs(self, cur_time: float, msgs: List[capnp.lib.capnp._DynamicStructReader]) -> None:
-    self.frame += 1
-    self.updated = dict.fromkeys(self.updated, False)
+    self._new_frame()
     for msg in msgs:
       if msg is None:
         continue
 
       s = msg.which()
-      self.updated[s] = True
-      self.rcv_time[s] = cur_time
-      self.rcv_frame[s] = self.frame
+      self.raw.pop(s, None)
       self.data[s] = getattr(msg, s)
-      self.logMonoTime[s] = msg.logMonoTime
-      self.valid[s] = msg.valid
+      self._set_received(s, cur_time, msg.logMonoTime, msg.valid)
+
+    self._update_alive(cur_time)
+
+  def update_raw(self, cur_time: float, dats: List[Optional[bytes]]) -> None:
+    """Same as update_msgs, but takes serialized events. Decoding is deferred until the service is accessed."""
+    self._new_frame()
+    for dat in dats:
+      if dat is None:
+        continue
+
+      header = peek_event(dat)
+      if header is None:
+        msg = log.Event.from_bytes(dat)
+        s = msg.which()
+        self.raw.pop(s, None)
+        self.data[s] = getattr(msg, s)
+        self._set_received(s, cur_time, msg.logMonoTime, msg.valid)
+      else:
+        s, log_mono_time, valid = header
+        self.raw[s] = dat
+        self._set_received(s, cur_time, log_mono_time, valid)
+
+    self._update_alive(cur_time)
+
+  def _new_frame(self) -> None:
+    self.frame += 1
+    self.updated = dict.fromkeys(self.updated, False)
+
+  def _set_received(self, s: str, cur_time: float, log_mono_time: int, valid: bool) -> None:
+    self.updated[s] = True
+    self.rcv_time[s] = cur_time
+    self.rcv_frame[s] = self.frame
+    self.logMonoTime[s] = log_mono_time
+    self.valid[s] = valid
 
+  def _update_alive(self, cur_time: float) -> None:
     for s in self.data:
       # arbitrary small number to avoid float comparison. If freq is 0, we can skip the check
       if self.freq[s] > 1e-5:
@@ -219,7 +387,7 @@ class PubMaster():
     for s in services:
       self.sock[s] = pub_sock(s)
 
-  def send(self, s: str, dat: Union[bytes, capnp.lib.capnp._DynamicStructBuilder]) -> None:
+  def send(self, s: str, dat: Union[bytes, capnp.lib.capnp._DynamicStructBuilder, ReusableMessage]) -> None:
     if not isinstance(dat, bytes):
       dat = dat.to_bytes()
     self.sock[s].send(dat)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+import random
+import unittest
+
+import cereal.messaging as messaging
+from cereal import log
+
+SERVICES = ['carState', 'controlsState', 'deviceState']
+
+
+def make_event(service, log_mono_time, valid):
+  msg = messaging.new_message(service)
+  msg.logMonoTime = log_mono_time
+  msg.valid = valid
+  if service == 'carState':
+    msg.carState.vEgo = log_mono_time / 1e9
+  elif service == 'controlsState':
+    msg.controlsState.alertText1 = 'frame %d' % log_mono_time
+  else:
+    msg.deviceState.freeSpacePercent = 42.
+  return msg.to_bytes()
+
+
+class TestPeekEvent(unittest.TestCase):
+  def test_matches_full_decode(self):
+    for service in SERVICES + ['can', 'sendcan']:
+      for log_mono_time, valid in [(0, True), (1, False), (2**63 + 12345, True), (123456789, False)]:
+        msg = messaging.new_message(service, 3) if service in ('can', 'sendcan') else messaging.new_message(service)
+        msg.logMonoTime = log_mono_time
+        msg.valid = valid
+        dat = msg.to_bytes()
+
+        decoded = log.Event.from_bytes(dat)
+        self.assertEqual(messaging.peek_event(dat), (decoded.which(), decoded.logMonoTime, decoded.valid))
+
+  def test_unpeekable(self):
+    self.assertIsNone(messaging.peek_event(b''))
+    self.assertIsNone(messaging.peek_event(b'\x00' * 8))
+    # more than one segment
+    self.assertIsNone(messaging.peek_event(b'\x01' + b'\x00' * 31))
+
+
+class TestLazySubMaster(unittest.TestCase):
+  def check_same(self, eager, lazy):
+    for s in SERVICES:
+      self.assertEqual(eager.updated[s], lazy.updated[s])
+      self.assertEqual(eager.alive[s], lazy.alive[s])
+      self.assertEqual(eager.valid[s], lazy.valid[s])
+      self.assertEqual(eager.logMonoTime[s], lazy.logMonoTime[s])
+      self.assertEqual(eager.rcv_frame[s], lazy.rcv_frame[s])
+    self.assertEqual(eager.all_alive_and_valid(), lazy.all_alive_and_valid())
+
+  def test_same_as_eager(self):
+    random.seed(0)
+    eager = messaging.SubMaster(SERVICES, addr=None)
+    lazy = messaging.SubMaster(SERVICES, addr=None, lazy=True)
+
+    t = 0.
+    for frame in range(300):
+      t += random.choice([0.01, 0.01, 0.5])
+      dats = [make_event(s, frame * 10**7, random.random() > 0.2) for s in SERVICES if random.random() > 0.3]
+      eager.update_msgs(t, [log.Event.from_bytes(dat) for dat in dats])
+      lazy.update_raw(t, dats)
+
+      # header fields are known before anything is decoded
+      for dat in dats:
+        self.assertIn(log.Event.from_bytes(dat).which(), lazy.raw)
+      self.check_same(eager, lazy)
+
+      # only some services are read each frame, the rest stay undecoded
+      for s in SERVICES:
+        if random.random() > 0.5:
+          self.assertEqual(eager[s].to_dict(), lazy[s].to_dict())
+          self.assertNotIn(s, lazy.raw)
+
+    for s in SERVICES:
+      self.assertEqual(eager[s].to_dict(), lazy[s].to_dict())
+
+  def test_not_received(self):
+    lazy = messaging.SubMaster(SERVICES, addr=None, lazy=True)
+    lazy.update_raw(100., [None, make_event('carState', 5, False)])
+    self.assertTrue(lazy.updated['carState'])
+    self.assertFalse(lazy.valid['carState'])
+    self.assertFalse(lazy.updated['deviceState'])
+    self.assertFalse(lazy.alive['deviceState'])
+    self.assertEqual(lazy['deviceState'].freeSpacePercent, 0.)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+import unittest
+
+import cereal.messaging as messaging
+from cereal import log
+
+
+def decode(dat):
+  return log.Event.from_bytes(dat).controlsState
+
+
+class TestReusableMessage(unittest.TestCase):
+  def test_unchanged_pointer_fields_not_rewritten(self):
+    msg = messaging.ReusableMessage('controlsState')
+    sizes = []
+    for i in range(5):
+      msg.start()
+      msg.set({'alertText1': 'alert', 'vCruise': float(i)})
+      dat = msg.to_bytes()
+      sizes.append(len(dat))
+      self.assertEqual(decode(dat).alertText1, 'alert')
+      self.assertEqual(decode(dat).vCruise, float(i))
+    # the text is written once, so the message doesn't grow
+    self.assertEqual(len(set(sizes)), 1)
+
+  def test_scalar_list_in_place(self):
+    msg = messaging.ReusableMessage('controlsState')
+    sizes = []
+    for i in range(5):
+      msg.start()
+      msg.set([('canMonoTimes', [i, i + 1, i + 2])])
+      dat = msg.to_bytes()
+      sizes.append(len(dat))
+      self.assertEqual(list(decode(dat).canMonoTimes), [i, i + 1, i + 2])
+    self.assertEqual(len(set(sizes)), 1)
+
+    # a new length takes new space
+    msg.start()
+    msg.set([('canMonoTimes', [1, 2, 3, 4])])
+    self.assertEqual(list(decode(msg.to_bytes()).canMonoTimes), [1, 2, 3, 4])
+
+  def test_list_changed_by_caller(self):
+    msg = messaging.ReusableMessage('controlsState')
+    can_mono_times = [1, 2, 3]
+    msg.start()
+    msg.set([('canMonoTimes', can_mono_times)])
+    msg.to_bytes()
+
+    # the same list, changed in place since the last frame
+    can_mono_times[0] = 4
+    msg.start()
+    msg.set([('canMonoTimes', can_mono_times)])
+    self.assertEqual(list(decode(msg.to_bytes()).canMonoTimes), [4, 2, 3])
+
+    can_mono_times.append(5)
+    msg.start()
+    msg.set([('canMonoTimes', can_mono_times)])
+    self.assertEqual(list(decode(msg.to_bytes()).canMonoTimes), [4, 2, 3, 5])
+
+  def test_rebuild(self):
+    msg = messaging.ReusableMessage('controlsState', max_growth=1.25)
+    for i in range(50):
+      msg.start()
+      msg.set({'alertText1': 'alert %d' % i, 'enabled': True})
+      dat = msg.to_bytes()
+      # each changed text takes 16 bytes, at most one write past the limit before the rebuild
+      self.assertLessEqual(len(dat), msg.base_size * 1.25 + 16)
+      self.assertEqual(decode(dat).alertText1, 'alert %d' % i)
+      self.assertTrue(decode(dat).enabled)
+    self.assertGreater(msg.rebuilds, 0)
+
+    # fields that aren't set again keep their value across a rebuild
+    msg.start()
+    msg.set({'vCruise': 1.})
+    rebuilds = msg.rebuilds
+    i, dat = 0, msg.to_bytes()
+    while msg.rebuilds == rebuilds:
+      prev = dat
+      msg.start()
+      msg.set({'alertText1': 'rebuild %d' % i})
+      dat = msg.to_bytes()
+      i += 1
+    self.assertEqual(decode(dat).vCruise, 1.)
+    self.assertEqual(decode(dat).alertText1, 'rebuild %d' % (i - 1))
+    # the dead space is left behind
+    self.assertLess(len(dat), len(prev))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -2,14 +2,85 @@ from common.travis_checker import travis
 from selfdrive.swaglog import cloudlog
 from common.realtime import sec_since_boot
 from common.op_params import opParams
+import numpy as np
 import threading
+import atexit
+import struct
+import mmap
+import queue
+import json
 import os
 
 op_params = opParams()
 
+# Columnar format: MAGIC, uint32 schema length, json schema [[key, column type], ...], then appended chunks.
+# A chunk is a uint32 row count followed by each column: 'f8' is row count float64s,
+# 'list' is row count uint32 lengths followed by all list items as float64s.
+COLUMNAR_MAGIC = b'OPDC\x01'
+COLUMN_TYPES = ('f8', 'list')
+_u32 = struct.Struct('<I')
+
+
+def _read_chunk(dat, i, schema):
+  """Returns the end offset and the columns of the chunk at i, or None if the chunk is cut short, e.g. by a power cut.
+     Columns are (values, lengths) with lengths None for 'f8' columns"""
+  if i + _u32.size > len(dat):
+    return None
+  rows = _u32.unpack_from(dat, i)[0]
+  i += _u32.size
+  columns = []
+  for _, column_type in schema:
+    lengths = None
+    if column_type == 'list':
+      if i + rows * 4 > len(dat):
+        return None
+      lengths = np.frombuffer(dat, dtype='<u4', count=rows, offset=i)
+      i += rows * 4
+    count = rows if lengths is None else int(lengths.sum())
+    if i + count * 8 > len(dat):
+      return None
+    columns.append((np.frombuffer(dat, dtype='<f8', count=count, offset=i), lengths))
+    i += count * 8
+  return i, columns
+
+
+def _read_schema(dat):
+  """Returns the schema and the offset of the first chunk"""
+  if dat[:len(COLUMNAR_MAGIC)] != COLUMNAR_MAGIC:
+    raise ValueError('Not a columnar DataCollector file')
+  i = len(COLUMNAR_MAGIC)
+  schema_len = _u32.unpack_from(dat, i)[0]
+  i += _u32.size
+  return json.loads(dat[i:i + schema_len]), i + schema_len
+
+
+def read_columnar(file_path):
+  """
+    Reads a columnar DataCollector file into a dict of key: np.array ('f8') or list of np.arrays ('list')
+    A chunk cut short at the end of the file is skipped
+  """
+  with open(file_path, 'rb') as f:
+    dat = f.read()
+  try:
+    schema, i = _read_schema(dat)
+  except ValueError:
+    raise ValueError('Not a columnar DataCollector file: {}'.format(file_path))
+
+  chunks = {key: [] for key, _ in schema}
+  while (chunk := _read_chunk(dat, i, schema)) is not None:
+    i, columns = chunk
+    for (key, _), (values, lengths) in zip(schema, columns):
+      if lengths is None:
+        chunks[key].append(values)
+      elif len(lengths):
+        chunks[key].extend(np.split(values, np.cumsum(lengths)[:-1]))
+
+  return {key: (np.concatenate(chunks[key]) if chunks[key] else np.array([])) if column_type == 'f8' else chunks[key]
+          for key, column_type in schema}
+
 
 class DataCollector:
-  def __init__(self, file_path, keys, write_frequency=60, write_threshold=2, log_data=True):
+  def __init__(self, file_path, keys, write_frequency=60, write_threshold=2, log_data=True, column_types=None, max_queued_writes=4):
     """
     This class provides an easy way to set up your own custom data collector to gather custom data.
     Parameters:
@@ -18,25 +89,68 @@ class DataCollector:
                     Your data list needs to be in this order.
       write_frequency (int/float): The rate at which to write data in seconds.
       write_threshold (int): The length of the data list we need to collect before considering writing.
+      column_types (list): Optional type of each key, 'f8' for numbers (None is written as NaN) or 'list' for lists of numbers.
+                           If specified, data is written in a binary columnar format that can be read back with read_columnar.
+                           Otherwise each sample is written as a line of text.
+      max_queued_writes (int): How many pending writes the background writer holds before dropping data.
     Example:
       data_collector = DataCollector('/data/openpilot/custom_data', ['v_ego', 'a_ego', 'custom_dict'], write_frequency=120)
+      data_collector = DataCollector('/data/openpilot/custom_data', ['v_ego', 'speeds'], column_types=['f8', 'list'])
     """
 
     self.log_data = log_data
     self.file_path = file_path
     self.keys = keys
+    self.column_types = column_types
     self.write_frequency = write_frequency
     self.write_threshold = write_threshold
     self.data = []
     self.last_write_time = sec_since_boot()
-    self.thread_running = False
+    self.write_queue = queue.Queue(maxsize=max_queued_writes)
+    self.writer_thread = None
+    self.closed = False
+    if column_types is not None:
+      if len(column_types) != len(keys) or not all(t in COLUMN_TYPES for t in column_types):
+        raise Exception("column_types needs one of {} for each key".format(COLUMN_TYPES))
     self._initialize()
+    if self.log_data:
+      atexit.register(self.close)
 
-  def _initialize(self):  # add keys to top of data file
-    if not os.path.exists(self.file_path) and not travis:
+  def _initialize(self):  # add keys or schema to top of data file
+    if travis:
+      return
+
+    if self.column_types is not None:
+      if not self.log_data:  # leave existing data alone, it might be in another format
+        return
+      header = self._columnar_header()
+      if os.path.exists(self.file_path):
+        with open(self.file_path, 'rb') as f:
+          if f.read(len(header)) == header:
+            self._truncate_torn_chunk()
+            return
+        os.rename(self.file_path, '{}.{}'.format(self.file_path, int(os.path.getmtime(self.file_path))))  # different format, keep old data
+      with open(self.file_path, 'wb') as f:
+        f.write(header)
+    elif not os.path.exists(self.file_path):
       with open(self.file_path, "w") as f:
         f.write('{}\n'.format(self.keys))
 
+  def _truncate_torn_chunk(self):  # so new chunks aren't appended after a partial one that readers stop at
+    with open(self.file_path, 'r+b') as f:
+      with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as dat:
+        schema, i = _read_schema(dat)
+        while (chunk := _read_chunk(dat, i, schema)) is not None:
+          i = chunk[0]
+        size = len(dat)
+      if i < size:
+        cloudlog.warning('DataCollector: dropping {} bytes of a partially written chunk from {}'.format(size - i, self.file_path))
+        f.truncate(i)
+
+  def _columnar_header(self):
+    schema = json.dumps(list(zip(self.keys, self.column_types))).encode()
+    return COLUMNAR_MAGIC + _u32.pack(len(schema)) + schema
+
   def update(self, sample):
     """
     Appends your sample to a central self.data variable that gets written to your specified file path every n seconds.
@@ -64,33 +178,72 @@ class DataCollector:
 
   def _check_if_can_write(self):
     """
-    You shouldn't ever need to call this. It checks if we should write, then calls a thread to do so
-    with a copy of the current gathered data. Then it clears the self.data variable so that new data
-    can be added and it won't be duplicated in the next write.
-    If the thread is still writing by the time of the next write, which shouldn't ever happen unless
-    you set a low write frequency, it will skip creating another write thread. If this occurs,
-    something is wrong with writing.
+    You shouldn't ever need to call this. It checks if we should write, then hands the current gathered data
+    to the background writer thread. Then it clears the self.data variable so that new data can be added and
+    it won't be duplicated in the next write.
+    If the writer has fallen behind by max_queued_writes writes, which shouldn't ever happen unless you set a
+    low write frequency, the data is dropped. If this occurs, something is wrong with writing.
     """
 
     if (sec_since_boot() - self.last_write_time) >= self.write_frequency and len(self.data) >= self.write_threshold and not travis:
-      if not self.thread_running:
-        write_thread = threading.Thread(target=self._write, args=(self.data,))
-        write_thread.daemon = True
-        write_thread.start()
-        # self.write(self.data)  # non threaded approach
-        self._reset(reset_type='all')
-      elif self.write_frequency > 30:
-        cloudlog.warning('DataCollector write thread is taking a while to write data.')
-
-  def _write(self, current_data):
+      self._start_writer()
+      try:
+        self.write_queue.put_nowait(self.data)
+      except queue.Full:
+        cloudlog.warning('DataCollector writer is falling behind, dropping {} samples.'.format(len(self.data)))
+      self._reset(reset_type='all')
+
+  def close(self, timeout=10.):
+    """
+    Hands the data gathered since the last write to the writer and waits for it to finish writing everything queued.
+    Called at exit, data added after closing isn't written.
     """
-    Only write data that has been added so far in background. self.data is still being appended to in
+
+    if self.closed or travis:
+      return
+    self.closed = True
+    self.log_data = False
+    if len(self.data):
+      self._start_writer()
+      self.write_queue.put(self.data)
+      self._reset(reset_type='all')
+    if self.writer_thread is not None:
+      self.write_queue.put(None)  # stops the writer once the queue is written
+      self.writer_thread.join(timeout)
+
+  def _start_writer(self):
+    if self.writer_thread is None:
+      self.writer_thread = threading.Thread(target=self._writer, daemon=True)
+      self.writer_thread.start()
+
+  def _writer(self):
+    """
+    Writes queued data in the background until closed. self.data is still being appended to in
     foreground so in the next write event, new data will be written. This eliminates lag causing openpilot
     critical processes to pause while a lot of data is being written.
     """
 
-    self.thread_running = True
-    with open(self.file_path, "a") as f:
-      f.write('{}\n'.format('\n'.join(map(str, current_data))))  # json takes twice as long to write
-    self._reset(reset_type='time')
-    self.thread_running = False
+    while True:
+      current_data = self.write_queue.get()
+      if current_data is None:
+        return
+      try:
+        if self.column_types is not None:
+          with open(self.file_path, "ab") as f:
+            f.write(self._encode_chunk(current_data))
+        else:
+          with open(self.file_path, "a") as f:
+            f.write('{}\n'.format('\n'.join(map(str, current_data))))  # json takes twice as long to write
+      except Exception:  # keep writing later data, a dead writer would silently fill the queue
+        cloudlog.exception('DataCollector failed to write {} samples to {}, dropping them'.format(len(current_data), self.file_path))
+
+  def _encode_chunk(self, current_data):
+    chunk = [_u32.pack(len(current_data))]
+    for i, column_type in enumerate(self.column_types):
+      if column_type == 'f8':
+        chunk.append(np.array([sample[i] for sample in current_data], dtype='<f8').tobytes())
+      else:
+        lists = [sample[i] for sample in current_data]
+        chunk.append(np.array([len(l) for l in lists], dtype='<u4').tobytes())
+        chunk.append(np.array([v for l in lists for v in l], dtype='<f8').tobytes())
+    return b''.join(chunk)
@@ -1,4 +1,5 @@
 import os
+import pickle
 import shutil
 import tempfile
 from atomicwrites import AtomicWriter
@@ -14,6 +15,32 @@ def mkdirs_exists_ok(path):
       raise
 
 
+def mkdirs_private(path):
+  """Creates path with 0700 if needed, returns True if it's a directory owned by us that nobody else can write to"""
+  try:
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.stat(path)
+  except OSError:
+    return False
+  return st.st_uid == os.getuid() and not st.st_mode & 0o022
+
+
+def atomic_pickle_dump(obj, path):
+  """Pickles obj to a temporary file next to path and moves it in place. Returns False if it couldn't be
+     written, for caches that are best effort, e.g. on a read-only filesystem"""
+  try:
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=".tmp", delete=False) as f:
+      try:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+      except BaseException:
+        os.unlink(f.name)
+        raise
+    os.replace(f.name, path)
+  except OSError:
+    return False
+  return True
+
+
 def rm_not_exists_ok(path):
   try:
     os.remove(path)
@@ -1,6 +1,12 @@
 #!/usr/bin/env python3
 import os
 import json
+import mmap
+import fcntl
+import ctypes
+import struct
+import threading
+from collections import defaultdict
 from common.colors import COLORS
 from common.travis_checker import BASEDIR
 from atomicwrites import atomic_write
@@ -20,6 +26,8 @@ BASEDIR = os.path.dirname(BASEDIR)
 PARAMS_DIR = os.path.join(BASEDIR, 'community', 'params')
 IMPORTED_PATH = os.path.join(PARAMS_DIR, '.imported')
 OLD_PARAMS_FILE = os.path.join(BASEDIR, 'op_params.json')
+SNAPSHOT_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else PARAMS_DIR  # tmpfs is rebuilt from param files every boot
+SNAPSHOT_NAME = 'op_params_snapshot'
 
 
 class Param:
@@ -79,6 +87,183 @@ def _import_params():
       pass
 
 
+class _SharedSnapshot:
+  """
+    A memory-mapped copy of all params shared by every process. Writers (put, or the watcher seeing a file
+    edited outside of opParams) republish the whole snapshot under a file lock, readers map it read-only and
+    only decode it when the generation counter changed. The generation is odd while a write is in progress.
+  """
+  VERSION = 1
+  HEADER = struct.Struct('<IIQ')  # version, payload length, generation
+  MIN_SIZE = 1 << 16
+
+  def __init__(self):
+    self.path = os.path.join(SNAPSHOT_DIR, SNAPSHOT_NAME)
+    self.map = None
+    self.generation = 0
+
+  def _map(self):
+    try:
+      with open(self.path, 'rb') as f:
+        self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      return True
+    except (OSError, ValueError):  # not published yet or empty
+      self.map = None
+      return False
+
+  def read(self, force=False):
+    """Returns the params dict if a new generation was published since the last read, else None"""
+    if self.map is None and not self._map():
+      return None
+
+    version, length, generation = self.HEADER.unpack_from(self.map, 0)
+    if version != self.VERSION or generation & 1 or (generation == self.generation and not force):
+      return None
+    if self.HEADER.size + length > len(self.map):  # writer grew the file
+      return self.read(force) if self._map() else None
+
+    payload = self.map[self.HEADER.size:self.HEADER.size + length]
+    if self.HEADER.unpack_from(self.map, 0)[2] != generation:  # changed while copying
+      return None
+    try:
+      params = json.loads(payload)
+    except ValueError:
+      return None
+    self.generation = generation
+    return params
+
+  def is_stale(self):
+    """True if a param file was written after the snapshot, e.g. edited while no opParams was running"""
+    try:
+      published = os.stat(self.path).st_mtime_ns
+      files = [f for f in os.listdir(PARAMS_DIR) if f != SNAPSHOT_NAME]
+      return any(os.stat(os.path.join(PARAMS_DIR, f)).st_mtime_ns > published for f in [''] + files)  # '' is the dir itself
+    except OSError:
+      return True
+
+  def publish(self, params=None, update=None):
+    """Replaces the snapshot with params, or applies the update dict to the current snapshot"""
+    fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+      os.fchmod(fd, 0o666)
+      fcntl.flock(fd, fcntl.LOCK_EX)
+      size = os.fstat(fd).st_size
+      generation = 0
+      if size >= self.HEADER.size:
+        with mmap.mmap(fd, 0) as m:
+          version, length, generation = self.HEADER.unpack_from(m, 0)
+          if params is None and version == self.VERSION:
+            try:
+              params = json.loads(m[self.HEADER.size:self.HEADER.size + length])
+            except ValueError:
+              pass
+      if params is None:  # nothing to update yet, the next opParams to load will publish
+        return
+      params = {**params, **(update or {})}
+
+      payload = json.dumps(params).encode()
+      needed = max(self.MIN_SIZE, self.HEADER.size + len(payload))
+      if size < needed:
+        os.ftruncate(fd, 1 << (needed - 1).bit_length())
+      generation += generation & 1  # recover from a writer that died mid-write
+      with mmap.mmap(fd, 0) as m:
+        self.HEADER.pack_into(m, 0, self.VERSION, 0, generation + 1)
+        m[self.HEADER.size:self.HEADER.size + len(payload)] = payload
+        self.HEADER.pack_into(m, 0, self.VERSION, len(payload), generation + 2)
+      os.utime(fd)  # writes through the map don't reliably update mtime, is_stale compares it to the param files
+    finally:
+      os.close(fd)  # also releases the lock
+
+
+class _ParamsWatcher:
+  """Watches PARAMS_DIR with inotify to catch edited param files and call subscribers, one per process"""
+  IN_CLOSE_WRITE = 0x8
+  IN_MOVED_TO = 0x80
+  IN_DELETE = 0x200
+  EVENT = struct.Struct('iIII')  # wd, mask, cookie, len
+
+  def __init__(self, shared):
+    self.shared = shared
+    self.values = {}
+    self.callbacks = defaultdict(list)
+    self.running = False
+    self.lock = threading.Lock()
+    self.fd = -1
+
+  def start(self):
+    try:
+      libc = ctypes.CDLL(None, use_errno=True)
+      fd = libc.inotify_init1(os.O_CLOEXEC)
+      if fd < 0:
+        return False
+      if libc.inotify_add_watch(fd, PARAMS_DIR.encode(), self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_DELETE) < 0:
+        os.close(fd)
+        return False
+    except (AttributeError, OSError):  # no inotify on this platform, opParams falls back to reading files
+      return False
+
+    self.fd = fd
+    self.running = True
+    threading.Thread(target=self._watch_thread, daemon=True).start()
+    return True
+
+  def subscribe(self, key, callback):
+    with self.lock:
+      self.callbacks[key].append(callback)
+
+  def _update(self, key):
+    try:
+      value, success = _read_param(key)
+    except OSError:  # deleted
+      return
+    if not success:  # opParams.get handles bad files on the next forced read
+      return
+
+    if key in self.values and self.values[key] == value:
+      return
+    self.values[key] = value
+    current = self.shared.read(force=True)
+    if current is not None and key in current and current[key] != value:  # edited outside of opParams.put
+      self.shared.publish(update={key: value})
+
+    with self.lock:
+      callbacks = list(self.callbacks.get(key, []))
+    for callback in callbacks:
+      callback(key, value)
+
+  def _watch_thread(self):
+    try:
+      while True:
+        buf = os.read(self.fd, 4096)
+        i = 0
+        while i < len(buf):
+          _, mask, _, name_len = self.EVENT.unpack_from(buf, i)
+          name = buf[i + self.EVENT.size:i + self.EVENT.size + name_len].rstrip(b'\0')
+          i += self.EVENT.size + name_len
+          try:  # a bad file or a failing callback shouldn't stop the watcher
+            key = name.decode()
+            if key and not key.startswith('.') and not mask & self.IN_DELETE:
+              self._update(key)
+          except Exception as e:
+            error('Failed to update param {}: {!r}'.format(name, e))
+    except Exception as e:
+      error('Param watcher stopped, falling back to reading param files: {!r}'.format(e))
+    finally:
+      self.running = False  # get() goes back to timed reads
+
+
+_watcher = None
+_watcher_pid = None
+
+
+def _get_watcher():  # one watcher per process, a forked child has to start its own thread
+  global _watcher, _watcher_pid
+  if _watcher is None or _watcher_pid != os.getpid():
+    _watcher, _watcher_pid = _ParamsWatcher(_SharedSnapshot()), os.getpid()
+    _watcher.start()
+  return _watcher
+
+
 class opParams:
   def __init__(self):
     """
@@ -145,9 +330,18 @@ class opParams:
     self.fork_params['username'] = Param(None, [type(None), str, bool], 'Your identifier provided with any crash logs sent to Sentry.\nHelps the developer reach out to you if anything goes wrong')
     self.fork_params['op_edit_live_mode'] = Param(False, bool, 'This parameter controls which mode opEdit starts in', hidden=True)
 
-    self.params = self._load_params(can_import=True)
+    self._shared = _SharedSnapshot()
+    self._watcher = _get_watcher()  # if running, params edited outside of opParams are republished to the shared snapshot
+    shared_params = None if self._shared.is_stale() else self._shared.read()
+    if shared_params is not None:  # another process already loaded and checked all param files
+      self.params = {k: v for k, v in shared_params.items() if k in self.fork_params}
+    else:
+      self.params = self._load_params(can_import=True)
     self._add_default_params()  # adds missing params and resets values with invalid types to self.params
     self._delete_and_reset()  # removes old params
+    if self.params != shared_params:
+      self._shared.publish(self.params)
+      self._shared.read()
 
   def get(self, key=None, *, force_update=False):  # key=None returns dict of all params
     if key is None:
@@ -156,7 +350,9 @@ class opParams:
     param_info = self.fork_params[key]
     rate = param_info.read_frequency  # will be None if param is static, so check below
 
-    if (not param_info.static and sec_since_boot() - self.fork_params[key].last_read >= rate) or force_update:
+    if not param_info.static and not force_update:
+      self._update_from_shared()
+    if (not param_info.static and not self._watcher.running and sec_since_boot() - self.fork_params[key].last_read >= rate) or force_update:
       value, success = _read_param(key)
       self.fork_params[key].last_read = sec_since_boot()
       if not success:  # in case of read error, use default and overwrite param
@@ -169,12 +365,25 @@ class opParams:
     print(warning('User\'s value type is not valid! Returning default'))  # somehow... it should always be valid
     return param_info.default_value  # return default value because user's value of key is not in allowed_types to avoid crashing openpilot
 
+  def subscribe(self, key, callback):
+    """Calls callback(key, value) from a background thread whenever the param file of key changes"""
+    self._check_key_exists(key, 'subscribe to')
+    if not self._watcher.running:
+      warning('inotify is unavailable, callbacks for {} will never be called'.format(key))
+    self._watcher.subscribe(key, callback)
+
   def put(self, key, value):
     self._check_key_exists(key, 'put')
     if not self.fork_params[key].is_valid(value):
       raise Exception('opParams: Tried to put a value of invalid type!')
     self.params.update({key: value})
     _write_param(key, value)
+    self._shared.publish(update={key: value})
+
+  def _update_from_shared(self):  # only decodes when a new generation was published
+    shared_params = self._shared.read()
+    if shared_params is not None:
+      self.params.update({k: v for k, v in shared_params.items() if k in self.fork_params and not self.fork_params[k].static})
 
   def _load_params(self, can_import=False):
     if not os.path.exists(PARAMS_DIR):
@@ -196,6 +405,7 @@ class opParams:
   def _get_all_params(self, to_update=False):
     if to_update:
       self.params = self._load_params()
+      self._shared.publish(self.params)
     return {k: self.params[k] for k, p in self.fork_params.items() if k in self.params and not p.hidden}
 
   def _check_key_exists(self, key, met):
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from common import data_collector
+from common.data_collector import DataCollector, read_columnar
+
+KEYS = ['v_ego', 'speeds']
+COLUMN_TYPES = ['f8', 'list']
+
+
+class TestDataCollector(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.path = os.path.join(self.tmp, 'df_data')
+    patch = mock.patch.object(data_collector, 'travis', False)
+    patch.start()
+    self.addCleanup(patch.stop)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def collect(self, samples, **kwargs):
+    collector = DataCollector(self.path, KEYS, write_frequency=0, write_threshold=2, column_types=COLUMN_TYPES, **kwargs)
+    for sample in samples:
+      collector.update(sample)
+    collector.close()
+    return collector
+
+  def test_columnar_round_trip(self):
+    samples = [[1.5, [1., 2.]], [None, []], [3, [4.5]], [-2., [5., 6., 7.]], [0., []]]
+    self.collect(samples)
+    data = read_columnar(self.path)
+
+    np.testing.assert_array_equal(data['v_ego'], [1.5, np.nan, 3., -2., 0.])
+    self.assertEqual(data['v_ego'].dtype, np.float64)
+    self.assertEqual([list(l) for l in data['speeds']], [s[1] for s in samples])
+
+    # reopening appends after the existing chunks
+    self.collect([[7., [8.]], [9., [10., 11.]]])
+    data = read_columnar(self.path)
+    np.testing.assert_array_equal(data['v_ego'], [1.5, np.nan, 3., -2., 0., 7., 9.])
+    self.assertEqual([list(l) for l in data['speeds']][-2:], [[8.], [10., 11.]])
+
+  def test_text_format(self):
+    collector = DataCollector(self.path, KEYS, write_frequency=0, write_threshold=1)
+    collector.update([1., [2.]])
+    collector.close()
+    with open(self.path) as f:
+      self.assertEqual(f.read(), "{}\n[1.0, [2.0]]\n".format(KEYS))
+
+  def test_torn_tail(self):
+    self.collect([[1., [2.]], [3., [4., 5.]]])
+    size = os.path.getsize(self.path)
+    chunk = DataCollector(self.path, KEYS, column_types=COLUMN_TYPES, log_data=False)._encode_chunk([[6., [7.]], [8., []]])
+    with open(self.path, 'ab') as f:  # power cut halfway through writing a chunk
+      f.write(chunk[:len(chunk) // 2])
+
+    self.assertEqual(list(read_columnar(self.path)['v_ego']), [1., 3.])
+
+    self.collect([[9., [10.]], [11., []]])
+    self.assertEqual(os.path.getsize(self.path), size + len(chunk))
+    data = read_columnar(self.path)
+    self.assertEqual(list(data['v_ego']), [1., 3., 9., 11.])
+    self.assertEqual([list(l) for l in data['speeds']], [[2.], [4., 5.], [10.], []])
+
+  def test_not_logging_leaves_file(self):
+    with open(self.path, 'wb') as f:
+      f.write(b'other format')
+    DataCollector(self.path, KEYS, column_types=COLUMN_TYPES, log_data=False).close()
+    self.assertEqual(os.listdir(self.tmp), ['df_data'])
+
+  def test_flush_on_close(self):
+    # below the write frequency nothing has been handed to the writer yet
+    collector = DataCollector(self.path, KEYS, write_frequency=3600, column_types=COLUMN_TYPES)
+    for i in range(10):
+      collector.update([float(i), [float(i)] * i])
+    self.assertEqual(len(read_columnar(self.path)['v_ego']), 0)
+
+    collector.close()
+    self.assertFalse(collector.writer_thread.is_alive())
+    self.assertEqual(list(read_columnar(self.path)['v_ego']), list(map(float, range(10))))
+
+  def test_flush_at_exit(self):
+    script = ("from common import data_collector\n"
+              "data_collector.travis = False\n"
+              "c = data_collector.DataCollector({!r}, {!r}, write_frequency=3600, column_types={!r})\n"
+              "c.update([1., [2.]])\n").format(self.path, KEYS, COLUMN_TYPES)
+    subprocess.check_call([sys.executable, '-c', script])
+    self.assertEqual(list(read_columnar(self.path)['v_ego']), [1.])
+
+
+if __name__ == "__main__":
+  unittest.main()
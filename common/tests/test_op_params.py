@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from common import op_params
+from common.op_params import opParams
+
+
+class TestOpParams(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    params_dir = os.path.join(self.tmp, 'params')
+    os.makedirs(params_dir)
+    patches = [mock.patch.object(op_params, 'PARAMS_DIR', params_dir),
+               mock.patch.object(op_params, 'SNAPSHOT_DIR', self.tmp),
+               mock.patch.object(op_params, 'OLD_PARAMS_FILE', os.path.join(self.tmp, 'op_params.json')),
+               mock.patch.object(op_params, '_watcher', None)]
+    for p in patches:
+      p.start()
+      self.addCleanup(p.stop)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def test_put_seen_by_other_process(self):
+    op = opParams()
+    self.assertEqual(op.get('camera_offset'), 0.06)
+
+    def put():
+      opParams().put('camera_offset', 0.12)
+    proc = multiprocessing.get_context('fork').Process(target=put)
+    proc.start()
+    proc.join(10)
+    self.assertEqual(proc.exitcode, 0)
+
+    # comes from the shared snapshot, not the param file
+    with mock.patch.object(op_params, '_read_param', side_effect=AssertionError):
+      self.assertEqual(op.get('camera_offset'), 0.12)
+
+  def test_reader_skips_write_in_progress(self):
+    op = opParams()
+    op.put('camera_offset', 0.1)
+    op.get('camera_offset')
+    shared = op_params._SharedSnapshot()
+
+    # a writer stopped halfway: odd generation, payload already replaced
+    with open(shared.path, 'r+b') as f:
+      version, length, generation = op_params._SharedSnapshot.HEADER.unpack_from(f.read(op_params._SharedSnapshot.HEADER.size))
+    shared.publish(update={'camera_offset': 0.2})
+    with open(shared.path, 'r+b') as f:
+      f.write(op_params._SharedSnapshot.HEADER.pack(version, length, generation + 3))
+    with mock.patch.object(op_params, '_read_param', side_effect=AssertionError):
+      self.assertEqual(op.get('camera_offset'), 0.1)
+
+    # the next writer recovers the generation and readers pick it up
+    shared.publish(update={'camera_offset': 0.3})
+    with mock.patch.object(op_params, '_read_param', side_effect=AssertionError):
+      self.assertEqual(op.get('camera_offset'), 0.3)
+
+  def test_reader_retries_changed_generation(self):
+    opParams().put('camera_offset', 0.1)
+
+    # the generation moves on while the payload is copied
+    header = op_params._SharedSnapshot.HEADER
+    reads = []
+
+    class Header():
+      size = header.size
+
+      @staticmethod
+      def unpack_from(buf, offset):
+        version, length, generation = header.unpack_from(buf, offset)
+        reads.append(generation)
+        return version, length, generation + 2 * (len(reads) - 1)
+
+    reader = op_params._SharedSnapshot()
+    with mock.patch.object(op_params._SharedSnapshot, 'HEADER', Header):
+      self.assertIsNone(reader.read())
+    self.assertEqual(reader.generation, 0)
+    self.assertEqual(reader.read()['camera_offset'], 0.1)
+
+  def test_subscribe(self):
+    op = opParams()
+    self.assertTrue(op._watcher.running)
+    seen = []
+    called = threading.Event()
+    op.subscribe('camera_offset', lambda key, value: (seen.append((key, value)), called.set()))
+
+    op_params._write_param('camera_offset', 0.25)  # edited outside of opParams, e.g. opEdit in another process
+    self.assertTrue(called.wait(5))
+    self.assertEqual(seen, [('camera_offset', 0.25)])
+    # the watcher republishes it for the other processes
+    self.assertEqual(op_params._SharedSnapshot().read()['camera_offset'], 0.25)
+
+  def test_falls_back_to_file_reads(self):
+    with mock.patch.object(op_params._ParamsWatcher, 'start', return_value=False):
+      op = opParams()
+    self.assertFalse(op._watcher.running)
+    op.get('camera_offset')
+
+    op_params._write_param('camera_offset', 0.3)
+    op.fork_params['camera_offset'].last_read = -1  # the read interval passed
+    self.assertEqual(op.get('camera_offset'), 0.3)
+
+
+if __name__ == "__main__":
+  unittest.main()
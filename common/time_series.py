@@ -0,0 +1,47 @@
+from array import array
+
+
+class TimeSeries():
+  # fixed capacity ring of timestamped samples, stored as parallel float arrays to avoid per-sample allocations
+  def __init__(self, fields, retention, capacity):
+    self.retention = retention  # samples older than this many seconds before the newest are evicted
+    self.capacity = capacity
+    self.fields = {name: i for i, name in enumerate(fields)}
+    self.times = array('d', [0.] * capacity)
+    self.values = [array('d', [0.] * capacity) for _ in fields]
+    self.reset()
+
+  def reset(self):
+    self.head = 0  # index of the oldest sample
+    self.size = 0
+
+  def __len__(self):
+    return self.size
+
+  def append(self, t, *values):
+    while self.size and t - self.times[self.head] > self.retention:
+      self._evict()
+    if self.size == self.capacity:  # full, overwrite the oldest
+      self._evict()
+
+    idx = (self.head + self.size) % self.capacity
+    self.times[idx] = t
+    for column, v in zip(self.values, values):
+      column[idx] = v
+    self.size += 1
+
+  def _evict(self):
+    self.head = (self.head + 1) % self.capacity
+    self.size -= 1
+
+  def first_time(self):
+    return self.times[self.head]
+
+  def last_time(self):
+    return self.times[(self.head + self.size - 1) % self.capacity]
+
+  def first(self, field):
+    return self.values[self.fields[field]][self.head]
+
+  def last(self, field):
+    return self.values[self.fields[field]][(self.head + self.size - 1) % self.capacity]
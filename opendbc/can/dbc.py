@@ -2,9 +2,14 @@ import re
 import os
 import struct
 import sys
+import pickle
+import hashlib
 import numbers
+import tempfile
 from collections import namedtuple, defaultdict
 
+import numpy as np
+
 def int_or_float(s):
   # return number, trying to maintain int format
   if s.isdigit():
@@ -17,14 +22,86 @@ DBCSignal = namedtuple(
   "DBCSignal", ["name", "start_bit", "size", "is_little_endian", "is_signed",
                 "factor", "offset", "tmin", "tmax", "units"])
 
+# Precomputed per-signal decode constants, shift is relative to the 64 bit little or big endian word
+DecodeEntry = namedtuple(
+  "DecodeEntry", ["name", "is_little_endian", "shift", "mask", "sign_bit", "factor", "offset"])
+MASK_64 = (1 << 64) - 1
+
+
+# Parsed dbc files are cached keyed on the file hash, bump the version when the parsed layout changes.
+# The cache is pickled, so it lives next to the code in a directory only we can write to, and survives reboots
+DBC_CACHE_VERSION = 1
+DBC_CACHE_DIR = os.getenv("DBC_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "dbc_cache"))
+
+
+def _private_cache_dir(path):
+  """Creates path if needed, True if it's a directory owned by us that nobody else can write to"""
+  # opendbc is a subtree and doesn't import from openpilot, this mirrors common.file_helpers.mkdirs_private
+  try:
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.stat(path)
+  except OSError:
+    return False
+  return st.st_uid == os.getuid() and not st.st_mode & 0o022
+
 
 class dbc():
-  def __init__(self, fn):
+  def __init__(self, fn, use_cache=True):
     self.name, _ = os.path.splitext(os.path.basename(fn))
-    with open(fn, encoding="ascii") as f:
-      self.txt = f.readlines()
+    with open(fn, "rb") as f:
+      raw = f.read()
+    self.txt = raw.decode("ascii").splitlines(keepends=True)
     self._warned_addresses = set()
+    self._decode_tables = {}
+
+    # lookup to bit reverse each byte
+    self.bits_index = [(i & ~0b111) + ((-i - 1) & 0b111) for i in range(64)]
+
+    cache_fn = os.path.join(DBC_CACHE_DIR, "%s_%s.pkl" % (self.name, hashlib.sha1(raw).hexdigest()))
+    if not (use_cache and self._load_cache(cache_fn)):
+      self._parse()
+      if use_cache:
+        self._write_cache(cache_fn)
+
+    self.msg_name_to_address = {}
+    for address, m in self.msgs.items():
+      name = m[0][0]
+      self.msg_name_to_address[name] = address
+
+  def _load_cache(self, cache_fn):
+    if not _private_cache_dir(DBC_CACHE_DIR):
+      return False
+
+    try:
+      with open(cache_fn, "rb") as f:
+        version, self.msgs, def_vals = pickle.load(f)
+    except Exception:
+      return False
+
+    if version != DBC_CACHE_VERSION:
+      return False
+
+    self.def_vals = defaultdict(list, def_vals)
+    return True
+
+  def _write_cache(self, cache_fn):
+    if not _private_cache_dir(DBC_CACHE_DIR):
+      return
+
+    try:
+      with tempfile.NamedTemporaryFile(dir=DBC_CACHE_DIR, delete=False) as f:
+        pickle.dump((DBC_CACHE_VERSION, self.msgs, dict(self.def_vals)), f, protocol=pickle.HIGHEST_PROTOCOL)
+      os.replace(f.name, cache_fn)
 
+      # every edit of the dbc gets a new hash, drop the entries for its older versions
+      stale = re.compile(re.escape(self.name) + r"_[0-9a-f]{40}\.pkl$")
+      for entry in os.listdir(DBC_CACHE_DIR):
+        if stale.match(entry) and entry != os.path.basename(cache_fn):
+          os.remove(os.path.join(DBC_CACHE_DIR, entry))
+    except OSError:
+      pass  # cache is best effort, e.g. read-only filesystem
+
+  def _parse(self):
     # regexps from https://github.com/ebroecker/canmatrix/blob/master/canmatrix/importdbc.py
     bo_regexp = re.compile(r"^BO\_ (\w+) (\w+) *: (\w+) (\w+)")
     sg_regexp = re.compile(r"^SG\_ (\w+) : (\d+)\|(\d+)@(\d+)([\+|\-]) \(([0-9.+\-eE]+),([0-9.+\-eE]+)\) \[([0-9.+\-eE]+)\|([0-9.+\-eE]+)\] \"(.*)\" (.*)")
@@ -41,9 +118,6 @@ class dbc():
     # A dictionary which maps message ids to a list of tuples (signal name, definition value pairs)
     self.def_vals = defaultdict(list)
 
-    # lookup to bit reverse each byte
-    self.bits_index = [(i & ~0b111) + ((-i - 1) & 0b111) for i in range(64)]
-
     for l in self.txt:
       l = l.strip()
 
@@ -111,11 +185,6 @@ class dbc():
     for msg in self.msgs.values():
       msg[1].sort(key=lambda x: x.start_bit)
 
-    self.msg_name_to_address = {}
-    for address, m in self.msgs.items():
-      name = m[0][0]
-      self.msg_name_to_address[name] = address
-
   def lookup_msg_id(self, msg_id):
     if not isinstance(msg_id, numbers.Number):
       msg_id = self.msg_name_to_address[msg_id]
@@ -173,6 +242,26 @@ class dbc():
     result = struct.pack('>Q', result)
     return result[:size]
 
+  def get_decode_table(self, msg_id):
+    """List of DecodeEntry for a message, signals that don't fit in 64 bits are left out."""
+    table = self._decode_tables.get(msg_id)
+    if table is None:
+      table = []
+      for s in self.msgs[msg_id][1]:
+        if s.is_little_endian:
+          shift = s.start_bit
+        else:
+          b1 = (s.start_bit // 8) * 8 + (-s.start_bit - 1) % 8
+          shift = 64 - (b1 + s.size)
+
+        if shift < 0:
+          continue
+
+        sign_bit = (1 << (s.size - 1)) if s.is_signed else 0
+        table.append(DecodeEntry(s.name, s.is_little_endian, shift, (1 << s.size) - 1, sign_bit, s.factor, s.offset))
+      self._decode_tables[msg_id] = table
+    return table
+
   def decode(self, x, arr=None, debug=False):
     """Decode a CAN message using the dbc.
 
@@ -209,48 +298,90 @@ class dbc():
 
     st = x[2].ljust(8, b'\x00')
     le, be = None, None
+    arr_index = None if arr is None else {sig: i for i, sig in enumerate(arr)}
 
-    for s in msg[1]:
-      if arr is not None and s[0] not in arr:
+    for s in self.get_decode_table(x[0]):
+      if arr_index is not None and s.name not in arr_index:
         continue
 
-      start_bit = s[1]
-      signal_size = s[2]
-      little_endian = s[3]
-      signed = s[4]
-      factor = s[5]
-      offset = s[6]
-
-      if little_endian:
+      if s.is_little_endian:
         if le is None:
           le = struct.unpack("<Q", st)[0]
         tmp = le
-        shift_amount = start_bit
       else:
         if be is None:
           be = struct.unpack(">Q", st)[0]
         tmp = be
-        b1 = (start_bit // 8) * 8 + (-start_bit - 1) % 8
-        shift_amount = 64 - (b1 + signal_size)
-
-      if shift_amount < 0:
-        continue
-
-      tmp = (tmp >> shift_amount) & ((1 << signal_size) - 1)
-      if signed and (tmp >> (signal_size - 1)):
-        tmp -= (1 << signal_size)
 
-      tmp = tmp * factor + offset
+      tmp = (tmp >> s.shift) & s.mask
+      if tmp & s.sign_bit:
+        tmp -= s.mask + 1
 
-      # if debug:
-      #   print("%40s  %2d %2d  %7.2f %s" % (s[0], s[1], s[2], tmp, s[-1]))
+      tmp = tmp * s.factor + s.offset
 
-      if arr is None:
-        out[s[0]] = tmp
+      if arr_index is None:
+        out[s.name] = tmp
       else:
-        out[arr.index(s[0])] = tmp
+        out[arr_index[s.name]] = tmp
     return name, out
 
+  def decode_batch(self, msgs, arr=None):
+    """Decode many CAN messages at once into NumPy columns.
+
+       Inputs:
+        msgs: An iterable with elements (address, time, data), like the input of decode.
+        arr: Optional list of signals which should be decoded and returned.
+
+       Returns:
+        A dict mapping message name to a dict of columns. Each message has a 't' column
+        with the bus times and a float64 column per decoded signal, in receive order.
+        Messages with unknown addresses are skipped.
+    """
+    grouped = defaultdict(lambda: ([], []))
+    for address, t, dat in msgs:
+      times, data = grouped[address]
+      times.append(t)
+      data.append(dat)
+
+    arr_set = None if arr is None else set(arr)
+    out = {}
+    for address, (times, data) in grouped.items():
+      msg = self.msgs.get(address)
+      if msg is None:
+        if address not in self._warned_addresses:
+          print("WARNING: Unknown message address {}".format(address))
+          self._warned_addresses.add(address)
+        continue
+
+      raw = b"".join(d[:8].ljust(8, b'\x00') for d in data)
+      le, be = None, None
+
+      columns = {'t': np.array(times)}
+      for s in self.get_decode_table(address):
+        if arr_set is not None and s.name not in arr_set:
+          continue
+
+        if s.is_little_endian:
+          if le is None:
+            le = np.frombuffer(raw, dtype='<u8')
+          words = le
+        else:
+          if be is None:
+            be = np.frombuffer(raw, dtype='>u8').astype(np.uint64)
+          words = be
+
+        vals = (words >> np.uint64(s.shift)) & np.uint64(s.mask)
+        if s.sign_bit:
+          if s.mask == MASK_64:
+            vals = vals.view(np.int64)  # already two's complement, mask + 1 doesn't fit in 64 bits
+          else:
+            vals = vals.astype(np.int64)
+            vals[vals >= s.sign_bit] -= s.mask + 1
+        columns[s.name] = vals.astype(np.float64) * s.factor + s.offset
+
+      out[msg[0][0]] = columns
+    return out
+
   def get_signals(self, msg):
     msg = self.lookup_msg_id(msg)
     return [sgs.name for sgs in self.msgs[msg][1]]
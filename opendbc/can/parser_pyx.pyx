@@ -7,29 +7,79 @@ from libcpp.unordered_set cimport unordered_set
 from libc.stdint cimport uint32_t, uint64_t, uint16_t
 from libcpp.map cimport map
 from libcpp cimport bool
+from cython.operator cimport dereference as deref
 
 from .common cimport CANParser as cpp_CANParser
-from .common cimport SignalParseOptions, MessageParseOptions, dbc_lookup, SignalValue, DBC
+from .common cimport SignalParseOptions, MessageParseOptions, dbc_lookup, SignalValue, DBC, Msg, DEFAULT
 
 import os
 import numbers
+import numpy as np
 from collections import defaultdict
 
 cdef int CAN_INVALID_CNT = 5
 
+
+cdef class SignalView:
+  """Read-only dict of a message's signals, backed by a slot buffer of the CANParser. copy.copy returns a plain dict"""
+  cdef dict slots
+  cdef double[::1] buf
+
+  def __cinit__(self, dict slots, double[::1] buf):
+    self.slots = slots
+    self.buf = buf
+
+  def __getitem__(self, name):
+    return self.buf[self.slots[name]]
+
+  def get(self, name, default=None):
+    slot = self.slots.get(name)
+    return default if slot is None else self.buf[slot]
+
+  def __contains__(self, name):
+    return name in self.slots
+
+  def __iter__(self):
+    return iter(self.slots)
+
+  def __len__(self):
+    return len(self.slots)
+
+  def keys(self):
+    return self.slots.keys()
+
+  def values(self):
+    return [self.buf[slot] for slot in self.slots.values()]
+
+  def items(self):
+    return [(name, self.buf[slot]) for name, slot in self.slots.items()]
+
+  def __copy__(self):
+    return dict(self.items())
+
+  def __repr__(self):
+    return repr(dict(self.items()))
+
+
 cdef class CANParser:
   cdef:
     cpp_CANParser *can
     const DBC *dbc
     map[string, uint32_t] msg_name_to_address
     map[uint32_t, string] address_to_msg_name
+    map[uint32_t, map[string, int]] slot_map
+    double[::1] vals_buf
+    double[::1] ts_buf
     vector[SignalValue] can_values
     bool test_mode_enabled
 
   cdef readonly:
     string dbc_name
-    dict vl
+    dict vl  # compatibility facade: message name or address -> SignalView of values
     dict ts
+    object values  # NumPy view of all signal values, indexed by signal_index()
+    object timestamps
+    dict slots  # (message name, signal name) -> slot
     bool can_valid
     int can_invalid_cnt
 
@@ -46,18 +96,19 @@ cdef class CANParser:
 
     self.can_invalid_cnt = CAN_INVALID_CNT
 
-    cdef int i
+    cdef int i, j
+    cdef const Msg *tracked_msg
     cdef int num_msgs = self.dbc[0].num_msgs
+    address_to_name = {}
+    address_to_msg_idx = {}
     for i in range(num_msgs):
       msg = self.dbc[0].msgs[i]
       name = msg.name.decode('utf8')
 
       self.msg_name_to_address[name] = msg.address
       self.address_to_msg_name[msg.address] = name
-      self.vl[msg.address] = {}
-      self.vl[name] = {}
-      self.ts[msg.address] = {}
-      self.ts[name] = {}
+      address_to_name[msg.address] = name
+      address_to_msg_idx[msg.address] = i
 
     # Convert message names into addresses
     for i in range(len(signals)):
@@ -74,6 +125,37 @@ cdef class CANParser:
         c = (self.msg_name_to_address[name], c[1])
         checks[i] = c
 
+    message_options = dict((address, 0) for _, address, _ in signals)
+    message_options.update(dict(checks))
+
+    # Resolve every signal to a slot in the value and timestamp buffers once. The parser also returns the
+    # checksum and counter signals of every message it tracks, so they get a slot after the requested signals
+    parsed_signals = [(sig_address, sig_name) for sig_name, sig_address, _ in signals]
+    for address in message_options:
+      tracked_msg = &self.dbc[0].msgs[<int>address_to_msg_idx[address]]
+      for j in range(tracked_msg.num_sigs):
+        if tracked_msg.sigs[j].type != DEFAULT:
+          parsed_signals.append((address, tracked_msg.sigs[j].name.decode('utf8')))
+
+    msg_slots = defaultdict(dict)
+    self.slots = {}
+    for sig_address, sig_name in parsed_signals:
+      name = address_to_name[sig_address]
+      if (name, sig_name) not in self.slots:
+        slot = len(self.slots)
+        self.slots[(name, sig_name)] = slot
+        msg_slots[sig_address][sig_name] = slot
+        self.slot_map[sig_address][sig_name.encode('utf8')] = slot
+
+    self.values = np.zeros(len(self.slots), dtype=np.float64)
+    self.timestamps = np.zeros(len(self.slots), dtype=np.float64)
+    self.vals_buf = self.values
+    self.ts_buf = self.timestamps
+
+    for address, name in address_to_name.items():
+      self.vl[address] = self.vl[name] = SignalView(msg_slots[address], self.vals_buf)
+      self.ts[address] = self.ts[name] = SignalView(msg_slots[address], self.ts_buf)
+
     cdef vector[SignalParseOptions] signal_options_v
     cdef SignalParseOptions spo
     for sig_name, sig_address, sig_default in signals:
@@ -82,9 +164,6 @@ cdef class CANParser:
       spo.default_value = sig_default
       signal_options_v.push_back(spo)
 
-    message_options = dict((address, 0) for _, address, _ in signals)
-    message_options.update(dict(checks))
-
     cdef vector[MessageParseOptions] message_options_v
     cdef MessageParseOptions mpo
     for msg_address, freq in message_options.items():
@@ -95,9 +174,17 @@ cdef class CANParser:
     self.can = new cpp_CANParser(bus, dbc_name, message_options_v, signal_options_v)
     self.update_vl()
 
+  def signal_index(self, msg, sig_name):
+    """Slot of a signal in values and timestamps, msg can be the message name or address"""
+    if isinstance(msg, numbers.Number):
+      msg = self.address_to_msg_name[msg].decode('utf8')
+    return self.slots[(msg, sig_name)]
+
   cdef unordered_set[uint32_t] update_vl(self):
-    cdef string sig_name
+    cdef int slot
     cdef unordered_set[uint32_t] updated_val
+    cdef map[uint32_t, map[string, int]].iterator msg_it
+    cdef map[string, int].iterator sig_it
 
     can_values = self.can.query_latest()
     valid = self.can.can_valid
@@ -110,15 +197,16 @@ cdef class CANParser:
 
 
     for cv in can_values:
-      # Cast char * directly to unicode
-      name = <unicode>self.address_to_msg_name[cv.address].c_str()
-      cv_name = <unicode>cv.name
-
-      self.vl[cv.address][cv_name] = cv.value
-      self.ts[cv.address][cv_name] = cv.ts
-
-      self.vl[name][cv_name] = cv.value
-      self.ts[name][cv_name] = cv.ts
+      # every signal the parser returns got a slot in __init__, but operator[] would silently insert slot 0
+      msg_it = self.slot_map.find(cv.address)
+      if msg_it == self.slot_map.end():
+        continue
+      sig_it = deref(msg_it).second.find(string(cv.name))
+      if sig_it == deref(msg_it).second.end():
+        continue
+      slot = deref(sig_it).second
+      self.vals_buf[slot] = cv.value
+      self.ts_buf[slot] = cv.ts
 
       updated_val.insert(cv.address)
 
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from opendbc import DBC_PATH
+from opendbc.can import dbc as dbc_module
+
+DBC = "toyota_prius_2017_pt_generated"
+
+
+class TestDbcCache(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.cache_dir = os.path.join(self.tmp, "cache")
+    patch = mock.patch.object(dbc_module, "DBC_CACHE_DIR", self.cache_dir)
+    patch.start()
+    self.addCleanup(patch.stop)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def test_cached_matches_parsed(self):
+    fn = os.path.join(DBC_PATH, DBC + ".dbc")
+    parsed = dbc_module.dbc(fn, use_cache=False)
+    dbc_module.dbc(fn)
+    with mock.patch.object(dbc_module.dbc, "_parse", side_effect=AssertionError):
+      cached = dbc_module.dbc(fn)
+    self.assertEqual(cached.msgs, parsed.msgs)
+    self.assertEqual(cached.def_vals, parsed.def_vals)
+
+  def test_edit_replaces_entry(self):
+    fn = os.path.join(self.tmp, DBC + ".dbc")
+    shutil.copy(os.path.join(DBC_PATH, DBC + ".dbc"), fn)
+    dbc_module.dbc(fn)
+    with open(fn, "a") as f:
+      f.write("\n")
+    dbc_module.dbc(fn)
+    self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+  def test_rejects_shared_dir(self):
+    os.makedirs(self.cache_dir)
+    os.chmod(self.cache_dir, 0o777)
+    dbc_module.dbc(os.path.join(DBC_PATH, DBC + ".dbc"))
+    self.assertEqual(os.listdir(self.cache_dir), [])
+
+
+if __name__ == "__main__":
+  unittest.main()
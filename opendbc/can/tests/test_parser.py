@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+import unittest
+
+from opendbc.can.parser import CANParser
+from opendbc.can.packer import CANPacker
+from selfdrive.boardd.boardd import can_list_to_can_capnp
+
+DBC = "toyota_prius_2017_pt_generated"
+
+
+class TestCanParser(unittest.TestCase):
+  def test_checksum_signals(self):
+    # STEER_TORQUE_SENSOR has a CHECKSUM, which the parser returns along with the requested signals
+    signals = [
+      ("STEER_ANGLE", "STEER_ANGLE_SENSOR", 0),
+      ("STEER_TORQUE_EPS", "STEER_TORQUE_SENSOR", 0),
+      ("STEER_TORQUE_DRIVER", "STEER_TORQUE_SENSOR", 0),
+    ]
+    parser = CANParser(DBC, signals, [], 0)
+    packer = CANPacker(DBC)
+
+    parser.update_strings([can_list_to_can_capnp([packer.make_can_msg("STEER_ANGLE_SENSOR", 0, {"STEER_ANGLE": -42})])])
+    self.assertEqual(parser.vl["STEER_ANGLE_SENSOR"]["STEER_ANGLE"], -42)
+
+    for i in range(10):
+      values = {"STEER_TORQUE_EPS": -i * 0.54, "STEER_TORQUE_DRIVER": i + 100}
+      msg = packer.make_can_msg("STEER_TORQUE_SENSOR", 0, values)
+      parser.update_strings([can_list_to_can_capnp([msg])])
+
+      for sig, value in values.items():
+        self.assertAlmostEqual(parser.vl["STEER_TORQUE_SENSOR"][sig], value, places=5)
+      self.assertEqual(parser.vl["STEER_TORQUE_SENSOR"]["CHECKSUM"], msg[2][-1])
+      # the first requested signal is in another message and must not be overwritten
+      self.assertEqual(parser.vl["STEER_ANGLE_SENSOR"]["STEER_ANGLE"], -42)
+      self.assertEqual(parser.values[parser.signal_index("STEER_ANGLE_SENSOR", "STEER_ANGLE")], -42)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,105 +1,234 @@
 #!/usr/bin/env python3
+import asyncio
 import base64
-import hashlib
 import io
 import json
 import os
-import queue
 import random
 import select
 import socket
+import ssl
 import threading
 import time
-from collections import namedtuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from typing import Any
 
-import requests
 from jsonrpc import JSONRPCResponseManager, dispatcher
 from websocket import ABNF, WebSocketTimeoutException, create_connection
 
 import cereal.messaging as messaging
+from cereal import log
 from cereal.services import service_list
 from common.api import Api
 from common.basedir import PERSIST
 from common.params import Params
 from common.realtime import sec_since_boot
+from selfdrive.athena.upload_queue import UploadQueue, get_queue_path
 from selfdrive.hardware import HARDWARE
 from selfdrive.loggerd.config import ROOT
+from selfdrive.loggerd.upload_engine import UploadEngine
+from selfdrive.loggerd.uploader import network_upload_rate
 from selfdrive.swaglog import cloudlog
 
 ATHENA_HOST = os.getenv('ATHENA_HOST', 'wss://athena.comma.ai')
 HANDLER_THREADS = int(os.getenv('HANDLER_THREADS', "4"))
 LOCAL_PORT_WHITELIST = set([8022])
+NETWORK_RECHECK = 60.  # seconds between network checks while uploading isn't allowed
+NetworkType = log.DeviceState.NetworkType
 
 dispatcher["echo"] = lambda s: s
-payload_queue: Any = queue.Queue()
-response_queue: Any = queue.Queue()
-upload_queue: Any = queue.Queue()
-cancelled_uploads: Any = set()
-UploadItem = namedtuple('UploadItem', ['path', 'url', 'headers', 'created_at', 'id'])
+upload_queue: Any = None  # opened in main, so importing athenad doesn't create a database
+upload_engine = UploadEngine()
+upload_executor = ThreadPoolExecutor(max_workers=1)  # shared between connections, so only one upload runs at a time
+upload_wakeup: Any = None  # set while an upload handler is waiting for work, safe to call from any thread
+
+
+class WebSocketConnection():
+  """
+    websocket-client connection driven by the event loop. Receives wait for the socket to be readable instead of
+    polling with a timeout, sends go through one thread so a slow link doesn't stall the loop
+  """
+  def __init__(self, ws):
+    self.ws = ws
+    self.send_executor = ThreadPoolExecutor(max_workers=1)
+
+  async def recv(self):
+    sock = self.ws.sock
+    # TLS can hold decrypted data the socket won't signal
+    if not (isinstance(sock, ssl.SSLSocket) and sock.pending()):
+      loop = asyncio.get_running_loop()
+      readable = loop.create_future()
+      loop.add_reader(sock.fileno(), lambda: readable.done() or readable.set_result(None))
+      try:
+        await readable
+      finally:
+        loop.remove_reader(sock.fileno())
+    # the socket timeout only applies to the rest of a frame that started arriving
+    return self.ws.recv_data(control_frame=True)
+
+  async def send(self, data):
+    await asyncio.get_running_loop().run_in_executor(self.send_executor, self.ws.send, data)
+
+  def close(self):
+    self.send_executor.shutdown(wait=False)
+
+
+class SubscriptionCache():
+  """Sockets for getMessage, kept open between calls so repeated requests for a service reuse one subscription"""
+  def __init__(self, max_services=8):
+    self.max_services = max_services
+    self.lock = threading.Lock()
+    self.socks: Any = OrderedDict()  # service -> (sock, lock)
+
+  def recv(self, service, timeout):
+    with self.lock:
+      if service not in self.socks:
+        self.socks[service] = (messaging.sub_sock(service, conflate=True), threading.Lock())
+        if len(self.socks) > self.max_services:
+          self.socks.popitem(last=False)
+      self.socks.move_to_end(service)
+      sock, sock_lock = self.socks[service]
+
+    with sock_lock:
+      # drop what was published before the call, like a new subscription would
+      sock.receive(non_blocking=True)
+      sock.setTimeout(timeout)
+      dat = sock.receive()
+    return log.Event.from_bytes(dat) if dat is not None else None
+
+
+subscriptions = SubscriptionCache()
 
 
 def handle_long_poll(ws):
-  end_event = threading.Event()
-
-  threads = [
-    threading.Thread(target=ws_recv, args=(ws, end_event)),
-    threading.Thread(target=ws_send, args=(ws, end_event)),
-    threading.Thread(target=upload_handler, args=(end_event,))
-  ] + [
-    threading.Thread(target=jsonrpc_handler, args=(end_event,))
-    for x in range(HANDLER_THREADS)
-  ]
-
-  for thread in threads:
-    thread.start()
+  conn = WebSocketConnection(ws)
+  try:
+    asyncio.run(handle_connection(conn))
+  finally:
+    conn.close()
+
+
+async def handle_connection(conn):
+  """
+    Serves one athena connection until it closes. conn needs async recv() returning (opcode, data) and
+    async send(data). At most HANDLER_THREADS RPCs run at once, the rest wait their turn while the connection
+    keeps being read, so pings are still answered
+  """
+  loop = asyncio.get_running_loop()
+  end_event = asyncio.Event()
+  proxy_end_event = threading.Event()
+  dispatcher["startLocalProxy"] = partial(startLocalProxy, proxy_end_event)
+
+  executor = ThreadPoolExecutor(max_workers=HANDLER_THREADS)
+  tasks = {loop.create_task(upload_handler(end_event))}
+  end_wait = loop.create_task(end_event.wait())
   try:
     while not end_event.is_set():
-      time.sleep(0.1)
-  except (KeyboardInterrupt, SystemExit):
-    end_event.set()
-    raise
+      recv = loop.create_task(conn.recv())
+      await asyncio.wait({recv, end_wait}, return_when=asyncio.FIRST_COMPLETED)
+      if not recv.done():
+        recv.cancel()
+        break
+
+      try:
+        opcode, data = recv.result()
+      except WebSocketTimeoutException:
+        continue
+      except Exception:
+        cloudlog.exception("athenad.ws_recv.exception")
+        break
+
+      if opcode in (ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY):
+        if opcode == ABNF.OPCODE_TEXT:
+          data = data.decode("utf-8")
+        task = loop.create_task(jsonrpc_handler(conn, data, executor, end_event))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+      elif opcode == ABNF.OPCODE_PING:
+        Params().put("LastAthenaPingTime", str(int(sec_since_boot() * 1e9)))
   finally:
-    for thread in threads:
-      thread.join()
+    end_event.set()
+    proxy_end_event.set()
+    end_wait.cancel()
+    for task in list(tasks):
+      task.cancel()
+    executor.shutdown(wait=False)
 
 
-def jsonrpc_handler(end_event):
-  dispatcher["startLocalProxy"] = partial(startLocalProxy, end_event)
-  while not end_event.is_set():
-    try:
-      data = payload_queue.get(timeout=1)
-      response = JSONRPCResponseManager.handle(data, dispatcher)
-      response_queue.put_nowait(response)
-    except queue.Empty:
-      pass
-    except Exception as e:
-      cloudlog.exception("athena jsonrpc handler failed")
-      response_queue.put_nowait(json.dumps({"error": str(e)}))
+async def jsonrpc_handler(conn, data, executor, end_event):
+  try:
+    response = (await asyncio.get_running_loop().run_in_executor(executor, JSONRPCResponseManager.handle, data, dispatcher)).json
+  except Exception as e:
+    cloudlog.exception("athena jsonrpc handler failed")
+    response = json.dumps({"error": str(e)})
 
+  try:
+    await conn.send(response)
+  except Exception:
+    cloudlog.exception("athenad.ws_send.exception")
+    end_event.set()
 
-def upload_handler(end_event):
-  while not end_event.is_set():
-    try:
-      item = upload_queue.get(timeout=1)
-      if item.id in cancelled_uploads:
-        cancelled_uploads.remove(item.id)
+
+async def upload_handler(end_event):
+  global upload_wakeup
+  loop = asyncio.get_running_loop()
+  # the queue's sqlite calls can wait on the disk, they run in the default executor to keep the loop free
+  in_executor = partial(loop.run_in_executor, None)
+  wakeup = asyncio.Event()
+  upload_wakeup = partial(loop.call_soon_threadsafe, wakeup.set)
+  try:
+    while not end_event.is_set():
+      wakeup.clear()
+      item = await in_executor(upload_queue.next)
+      if item is None:
+        # sleep until a new upload or the next retry is due
+        try:
+          await asyncio.wait_for(wakeup.wait(), await in_executor(upload_queue.next_attempt_in))
+        except asyncio.TimeoutError:
+          pass
+        continue
+
+      if not os.path.exists(item.path):
+        cloudlog.event("athena.upload_handler.file_missing", path=item.path)
+        await in_executor(upload_queue.done, item.id)
         continue
-      _do_upload(item)
-    except queue.Empty:
-      pass
-    except Exception:
-      cloudlog.exception("athena.upload_handler.exception")
+
+      # an upload this process makes doesn't go through uploaderd's bandwidth limit, so it applies the same network policy
+      if not await loop.run_in_executor(upload_executor, _set_upload_rate):
+        try:
+          await asyncio.wait_for(wakeup.wait(), NETWORK_RECHECK)
+        except asyncio.TimeoutError:
+          pass
+        continue
+
+      upload_queue.start(item.id)
+      try:
+        response = await loop.run_in_executor(upload_executor, _do_upload, item,
+                                              partial(upload_queue.set_progress, item.id))
+        success = response.status_code in (200, 201)
+      except Exception:
+        cloudlog.exception("athena.upload_handler.exception")
+        success = False
+
+      if success:
+        await in_executor(upload_queue.done, item.id)
+      elif await in_executor(upload_queue.failed, item.id):
+        await in_executor(upload_engine.discard, item.path, item.url)
+  finally:
+    upload_wakeup = None
 
 
-def _do_upload(upload_item):
-  with open(upload_item.path, "rb") as f:
-    size = os.fstat(f.fileno()).st_size
-    return requests.put(upload_item.url,
-                        data=f,
-                        headers={**upload_item.headers, 'Content-Length': str(size)},
-                        timeout=10)
+def _set_upload_rate():
+  allowed, rate = network_upload_rate(HARDWARE.get_network_type() == NetworkType.wifi)
+  if allowed:
+    upload_engine.set_rate(rate)
+  return allowed
+
+
+def _do_upload(upload_item, on_progress=None):
+  return upload_engine.upload(upload_item.path, upload_item.url, upload_item.headers, on_progress)
 
 
 # security: user should be able to request any message from their car
@@ -108,8 +237,7 @@ def getMessage(service=None, timeout=1000):
   if service is None or service not in service_list:
     raise Exception("invalid service")
 
-  socket = messaging.sub_sock(service, timeout=timeout)
-  ret = messaging.recv_one(socket)
+  ret = subscriptions.recv(service, timeout)
 
   if ret is None:
     raise TimeoutError
@@ -125,8 +253,7 @@ def listDataDirectory():
 
 @dispatcher.add_method
 def reboot():
-  sock = messaging.sub_sock("deviceState", timeout=1000)
-  ret = messaging.recv_one(sock)
+  ret = subscriptions.recv("deviceState", 1000)
   if ret is None or ret.deviceState.started:
     raise Exception("Reboot unavailable")
 
@@ -147,27 +274,27 @@ def uploadFileToUrl(fn, url, headers):
   if not os.path.exists(path):
     return 404
 
-  item = UploadItem(path=path, url=url, headers=headers, created_at=int(time.time() * 1000), id=None)
-  upload_id = hashlib.sha1(str(item).encode()).hexdigest()
-  item = item._replace(id=upload_id)
-
-  upload_queue.put_nowait(item)
+  # the same path and blob again refreshes the queued job, instead of uploading twice
+  item = upload_queue.add(path, url, headers)
+  wakeup = upload_wakeup
+  if wakeup is not None:
+    wakeup()
 
   return {"enqueued": 1, "item": item._asdict()}
 
 
 @dispatcher.add_method
-def listUploadQueue():
-  return [item._asdict() for item in list(upload_queue.queue)]
+def listUploadQueue(offset=0, limit=-1):
+  return upload_queue.list(offset, limit)
 
 
 @dispatcher.add_method
 def cancelUpload(upload_id):
-  upload_ids = set(item.id for item in list(upload_queue.queue))
-  if upload_id not in upload_ids:
+  item = upload_queue.cancel(upload_id)
+  if item is None:
     return 404
+  upload_engine.discard(item.path, item.url)
 
-  cancelled_uploads.add(upload_id)
   return {"success": 1}
 
 
@@ -283,40 +410,14 @@ def ws_proxy_send(ws, local_sock, signal_sock, end_event):
   signal_sock.close()
 
 
-def ws_recv(ws, end_event):
-  while not end_event.is_set():
-    try:
-      opcode, data = ws.recv_data(control_frame=True)
-      if opcode in (ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY):
-        if opcode == ABNF.OPCODE_TEXT:
-          data = data.decode("utf-8")
-        payload_queue.put_nowait(data)
-      elif opcode == ABNF.OPCODE_PING:
-        Params().put("LastAthenaPingTime", str(int(sec_since_boot() * 1e9)))
-    except WebSocketTimeoutException:
-      pass
-    except Exception:
-      cloudlog.exception("athenad.ws_recv.exception")
-      end_event.set()
-
-
-def ws_send(ws, end_event):
-  while not end_event.is_set():
-    try:
-      response = response_queue.get(timeout=1)
-      ws.send(response.json)
-    except queue.Empty:
-      pass
-    except Exception:
-      cloudlog.exception("athenad.ws_send.exception")
-      end_event.set()
-
-
 def backoff(retries):
   return random.randrange(0, min(128, int(2 ** retries)))
 
 
 def main():
+  global upload_queue
+  upload_queue = UploadQueue(os.getenv("UPLOAD_QUEUE_PATH", get_queue_path(ROOT)))
+
   params = Params()
   dongle_id = params.get("DongleId").decode('utf-8')
   ws_uri = ATHENA_HOST + "/ws/v2/" + dongle_id
@@ -0,0 +1,28 @@
+import asyncio
+
+from websocket import ABNF
+
+
+class MockWebsocket():
+  """Stand-in for the athena server end of the websocket, with the recv/send interface handle_connection uses"""
+  def __init__(self):
+    self.incoming: asyncio.Queue = asyncio.Queue()
+    self.outgoing: asyncio.Queue = asyncio.Queue()
+
+  def request(self, data):
+    self.incoming.put_nowait((ABNF.OPCODE_TEXT, data.encode('utf-8')))
+
+  def ping(self):
+    self.incoming.put_nowait((ABNF.OPCODE_PING, b''))
+
+  def disconnect(self):
+    self.incoming.put_nowait(ConnectionResetError("disconnected"))
+
+  async def recv(self):
+    item = await self.incoming.get()
+    if isinstance(item, Exception):
+      raise item
+    return item
+
+  async def send(self, data):
+    self.outgoing.put_nowait(data)
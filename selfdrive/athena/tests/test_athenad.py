@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import cereal.messaging as messaging
+from selfdrive.athena import athenad, upload_queue
+from selfdrive.athena.athenad import dispatcher
+from selfdrive.athena.upload_queue import UploadQueue
+from selfdrive.athena.tests.helpers import MockWebsocket
+
+
+def rpc(method, params=None, id=0):
+  return json.dumps({"jsonrpc": "2.0", "method": method, "params": params or {}, "id": id})
+
+
+class FakeSock():
+  def __init__(self, dat):
+    self.dat = dat
+
+  def receive(self, non_blocking=False):
+    return self.dat
+
+  def setTimeout(self, timeout):
+    pass
+
+
+class TestAthenadConnection(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    patches = [mock.patch.object(athenad, "ROOT", self.tmp),
+               mock.patch.object(athenad, "upload_queue", UploadQueue(os.path.join(self.tmp, "queue.db")))]
+    for p in patches:
+      p.start()
+      self.addCleanup(p.stop)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def run_connection(self, test):
+    async def run():
+      ws = MockWebsocket()
+      conn = asyncio.get_running_loop().create_task(athenad.handle_connection(ws))
+      try:
+        return await asyncio.wait_for(test(ws), timeout=5)
+      finally:
+        ws.disconnect()
+        await asyncio.wait_for(conn, timeout=5)
+    return asyncio.run(run())
+
+  def test_echo(self):
+    async def test(ws):
+      ws.request(rpc("echo", {"s": "bob"}))
+      return json.loads(await ws.outgoing.get())
+    self.assertEqual(self.run_connection(test)["result"], "bob")
+
+  def test_disconnect_ends_connection(self):
+    async def test(ws):
+      ws.disconnect()
+    self.run_connection(test)
+
+  def test_rpc_concurrency(self):
+    lock = threading.Lock()
+    running = [0, 0]  # now, most at once
+
+    def slow():
+      with lock:
+        running[0] += 1
+        running[1] = max(running[1], running[0])
+      time.sleep(0.1)
+      with lock:
+        running[0] -= 1
+      return 1
+
+    async def test(ws):
+      for i in range(3 * athenad.HANDLER_THREADS):
+        ws.request(rpc("slow", id=i))
+      return sorted([json.loads(await ws.outgoing.get())["id"] for _ in range(3 * athenad.HANDLER_THREADS)])
+
+    with mock.patch.dict(dispatcher, {"slow": slow}):
+      ids = self.run_connection(test)
+    self.assertEqual(ids, list(range(3 * athenad.HANDLER_THREADS)))
+    self.assertEqual(running[1], athenad.HANDLER_THREADS)
+
+  def test_getMessage_reuses_subscription(self):
+    msg = messaging.new_message('deviceState')
+    msg.deviceState.freeSpacePercent = 42.
+    sock = FakeSock(msg.to_bytes())
+
+    async def test(ws):
+      for i in range(3):
+        ws.request(rpc("getMessage", {"service": "deviceState", "timeout": 100}, id=i))
+      return [json.loads(await ws.outgoing.get())["result"] for _ in range(3)]
+
+    with mock.patch.object(athenad, "subscriptions", athenad.SubscriptionCache()), \
+         mock.patch.object(athenad.messaging, "sub_sock", return_value=sock) as sub_sock:
+      results = self.run_connection(test)
+    self.assertEqual(sub_sock.call_count, 1)
+    for result in results:
+      self.assertAlmostEqual(result["deviceState"]["freeSpacePercent"], 42.)
+
+  def test_upload_dedup_and_retry(self):
+    open(os.path.join(self.tmp, "qlog.bz2"), "wb").close()
+    statuses = [500, 201]
+    uploaded = []
+    enqueued = threading.Event()
+
+    def upload(path, url, headers, on_progress=None):
+      enqueued.wait(5)
+      uploaded.append(url)
+      return mock.Mock(status_code=statuses.pop(0))
+
+    async def test(ws):
+      # one at a time, RPCs run concurrently so the latest request would be undefined otherwise
+      ids = set()
+      for i in range(3):
+        ws.request(rpc("uploadFileToUrl", {"fn": "qlog.bz2", "url": "https://blob/qlog.bz2?sig=%d" % i, "headers": {}}, id=i))
+        ids.add(json.loads(await ws.outgoing.get())["result"]["item"]["id"])
+      enqueued.set()
+      while len(athenad.upload_queue):
+        await asyncio.sleep(0.01)
+      return ids
+
+    with mock.patch.object(athenad.upload_engine, "upload", upload), \
+         mock.patch.object(athenad, "HARDWARE"), \
+         mock.patch.object(athenad, "network_upload_rate", return_value=(True, None)), \
+         mock.patch.object(upload_queue, "RETRY_DELAY", 0.):
+      ids = self.run_connection(test)
+    self.assertEqual(len(ids), 1)
+    # the retry uses the url of the latest request
+    self.assertEqual(len(uploaded), 2)
+    self.assertEqual(uploaded[-1], "https://blob/qlog.bz2?sig=2")
+
+  def test_upload_progress_from_workers(self):
+    open(os.path.join(self.tmp, "qlog.bz2"), "wb").close()
+    listed = threading.Event()
+    cancelled = threading.Event()
+    uploaded = threading.Event()
+    queue = athenad.upload_queue
+    queue_threads = set()
+    next_job = queue.next
+
+    def next():
+      queue_threads.add(threading.current_thread())
+      return next_job()
+
+    def upload(path, url, headers, on_progress=None):
+      # the engine reports progress from its block workers
+      def worker(i):
+        for sent in range(100):
+          on_progress(i * 100 + sent, 400)
+          if sent == 50:
+            listed.wait(5)
+        cancelled.wait(5)
+        on_progress(400, 400)
+      workers = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+      for w in workers:
+        w.start()
+      for w in workers:
+        w.join()
+      uploaded.set()
+      return mock.Mock(status_code=201)
+
+    async def test(ws):
+      ws.request(rpc("uploadFileToUrl", {"fn": "qlog.bz2", "url": "https://blob/qlog.bz2?sig=1", "headers": {}}))
+      job_id = json.loads(await ws.outgoing.get())["result"]["item"]["id"]
+      while job_id not in queue.progress:
+        await asyncio.sleep(0.01)
+
+      for i in range(20):
+        ws.request(rpc("listUploadQueue", id=i))
+        items = json.loads(await ws.outgoing.get())["result"]
+        self.assertEqual(len(items), 1)
+        self.assertTrue(items[0]["current"])
+        self.assertTrue(0. <= items[0]["progress"] <= 1.)
+      listed.set()
+
+      # progress reported after the job is gone doesn't bring it back
+      ws.request(rpc("cancelUpload", {"upload_id": job_id}))
+      self.assertEqual(json.loads(await ws.outgoing.get())["result"], {"success": 1})
+      cancelled.set()
+      while not uploaded.is_set():
+        await asyncio.sleep(0.01)
+      ws.request(rpc("listUploadQueue"))
+      return json.loads(await ws.outgoing.get())["result"], threading.current_thread()
+
+    with mock.patch.object(athenad.upload_engine, "upload", upload), \
+         mock.patch.object(athenad, "HARDWARE"), \
+         mock.patch.object(athenad, "network_upload_rate", return_value=(True, None)), \
+         mock.patch.object(queue, "next", next):
+      items, loop_thread = self.run_connection(test)
+    self.assertEqual(items, [])
+    self.assertEqual(queue.progress, {})
+    # the database is only used off the event loop
+    self.assertTrue(queue_threads)
+    self.assertNotIn(loop_thread, queue_threads)
+
+  def test_upload_waits_for_network(self):
+    open(os.path.join(self.tmp, "qlog.bz2"), "wb").close()
+    # a hotspot without upload_on_hotspot, then cell
+    network = [(False, None), (True, 1234)]
+    upload = mock.Mock(return_value=mock.Mock(status_code=201))
+
+    async def test(ws):
+      ws.request(rpc("uploadFileToUrl", {"fn": "qlog.bz2", "url": "https://blob/qlog.bz2?sig=1", "headers": {}}))
+      await ws.outgoing.get()
+      while len(athenad.upload_queue):
+        await asyncio.sleep(0.01)
+
+    with mock.patch.object(athenad.upload_engine, "upload", upload), \
+         mock.patch.object(athenad.upload_engine, "set_rate") as set_rate, \
+         mock.patch.object(athenad, "HARDWARE"), \
+         mock.patch.object(athenad, "network_upload_rate", side_effect=lambda on_wifi: network.pop(0)), \
+         mock.patch.object(athenad, "NETWORK_RECHECK", 0.):
+      self.run_connection(test)
+    # waiting for the network doesn't count as a failed attempt
+    self.assertEqual(upload.call_count, 1)
+    set_rate.assert_called_once_with(1234)
+
+
+if __name__ == "__main__":
+  unittest.main()
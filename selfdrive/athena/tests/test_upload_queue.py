@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from selfdrive.athena import upload_queue as uq
+from selfdrive.athena.upload_queue import UploadQueue
+
+
+class TestUploadQueue(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.path = os.path.join(self.tmp, "queue.db")
+    self.queue = UploadQueue(self.path)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def test_survives_restart(self):
+    item = self.queue.add("/data/a/qlog.bz2", "https://blob/a/qlog.bz2?sig=1", {"x-ms-blob-type": "BlockBlob"})
+    restarted = UploadQueue(self.path)
+    self.assertEqual(restarted.next(), item)
+
+  def test_dedup_refreshes_url(self):
+    first = self.queue.add("/data/a/qlog.bz2", "https://blob/a/qlog.bz2?sig=1", {})
+    self.queue.add("/data/b/qlog.bz2", "https://blob/b/qlog.bz2?sig=1", {})
+    again = self.queue.add("/data/a/qlog.bz2", "https://blob/a/qlog.bz2?sig=2", {"h": "2"})
+    self.assertEqual(len(self.queue), 2)
+    self.assertEqual(again.id, first.id)
+    self.assertEqual(self.queue.next(), again)
+    self.assertEqual(again.url, "https://blob/a/qlog.bz2?sig=2")
+    self.assertEqual(again.headers, {"h": "2"})
+
+  def test_list_pages(self):
+    ids = [self.queue.add("/data/%d/qlog.bz2" % i, "https://blob/%d?sig=1" % i, {}).id for i in range(10)]
+    self.assertEqual([item['id'] for item in self.queue.list()], ids)
+    self.assertEqual([item['id'] for item in self.queue.list(3, 4)], ids[3:7])
+
+  def test_retry_backoff(self):
+    item = self.queue.add("/data/a/qlog.bz2", "https://blob/a?sig=1", {})
+    with mock.patch.object(uq.time, "time", return_value=1000.):
+      self.queue.failed(item.id)
+      self.assertIsNone(self.queue.next())
+      self.assertEqual(self.queue.next_attempt_in(), uq.RETRY_DELAY)
+    with mock.patch.object(uq.time, "time", return_value=1000. + uq.RETRY_DELAY):
+      self.assertEqual(self.queue.next().retry_count, 1)
+
+    for _ in range(uq.MAX_RETRY_COUNT - 2):
+      self.assertFalse(self.queue.failed(item.id))
+    self.assertTrue(self.queue.failed(item.id))
+    self.assertEqual(len(self.queue), 0)
+
+  def test_expiry(self):
+    self.queue.add("/data/a/qlog.bz2", "https://blob/a?sig=1", {})
+    with mock.patch.object(uq.time, "time", return_value=uq.time.time() + uq.MAX_AGE + 1):
+      self.assertIsNone(self.queue.next())
+    self.assertEqual(len(self.queue), 0)
+
+  def test_cancel_and_progress(self):
+    item = self.queue.add("/data/a/qlog.bz2", "https://blob/a?sig=1", {})
+    self.queue.start(item.id)
+    self.queue.set_progress(item.id, 50, 100)
+    listed = self.queue.list()[0]
+    self.assertTrue(listed['current'])
+    self.assertEqual(listed['progress'], 0.5)
+
+    self.assertEqual(self.queue.cancel(item.id), item)
+    self.assertIsNone(self.queue.cancel(item.id))
+    self.assertEqual(len(self.queue), 0)
+
+  def test_compact_frees_pages(self):
+    self.assertEqual(self.queue.db.execute("PRAGMA auto_vacuum").fetchone()[0], uq.AUTO_VACUUM_INCREMENTAL)
+    headers = {"h": "x" * 1000}
+    ids = [self.queue.add("/data/%d/qlog.bz2" % i, "https://blob/%d?sig=1" % i, headers).id for i in range(uq.COMPACT_EVERY)]
+    pages = self.queue.db.execute("PRAGMA page_count").fetchone()[0]
+    for job_id in ids:
+      self.queue.done(job_id)
+    self.assertEqual(self.queue.db.execute("PRAGMA freelist_count").fetchone()[0], 0)
+    self.assertLess(self.queue.db.execute("PRAGMA page_count").fetchone()[0], pages)
+
+  def test_enables_auto_vacuum_on_existing_queue(self):
+    # queues created in WAL mode before auto_vacuum was set keep their jobs
+    item = self.queue.add("/data/a/qlog.bz2", "https://blob/a?sig=1", {})
+    self.queue.db.execute("PRAGMA journal_mode = DELETE")
+    self.queue.db.execute("PRAGMA auto_vacuum = NONE")
+    self.queue.db.execute("VACUUM")
+    self.queue.db.execute("PRAGMA journal_mode = WAL")
+    self.assertEqual(self.queue.db.execute("PRAGMA auto_vacuum").fetchone()[0], 0)
+
+    reopened = UploadQueue(self.path)
+    self.assertEqual(reopened.db.execute("PRAGMA auto_vacuum").fetchone()[0], uq.AUTO_VACUUM_INCREMENTAL)
+    self.assertEqual(reopened.next(), item)
+
+
+if __name__ == "__main__":
+  unittest.main()
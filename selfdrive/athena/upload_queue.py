@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+from selfdrive.loggerd.config import get_data_dir
+from selfdrive.swaglog import cloudlog
+
+UPLOAD_QUEUE_VERSION = 1
+MAX_RETRY_COUNT = 5
+RETRY_DELAY = 10.  # seconds before the first retry, doubled for every retry after
+MAX_AGE = 24 * 60 * 60  # seconds since the last request for an upload, presigned urls don't last longer
+COMPACT_EVERY = 100  # finished jobs between compactions
+AUTO_VACUUM_INCREMENTAL = 2
+
+UploadItem = namedtuple('UploadItem', ['path', 'url', 'headers', 'created_at', 'id', 'retry_count'])
+
+
+def get_queue_path(root):
+  return os.path.join(get_data_dir(root), "athena_upload_queue.db")
+
+
+def upload_key(path, url):
+  # the blob without the signature, so a re-request with a fresh url is the same job
+  parts = urlsplit(url)
+  return hashlib.sha1(json.dumps([path, parts.netloc, parts.path]).encode()).hexdigest()
+
+
+class UploadQueue():
+  """
+    Persistent queue of athena upload jobs, in a SQLite database so it survives athenad restarts and reboots.
+    A job is keyed by its path and blob url: enqueueing the same upload again refreshes its url, headers and
+    expiry but keeps its id and place. Failed jobs are retried with exponential backoff, jobs not requested again
+    within MAX_AGE are dropped. Safe to use from several threads
+  """
+  def __init__(self, path):
+    self.path = path
+    self.lock = threading.Lock()
+    # id -> fraction sent, for jobs being uploaded. It has its own lock, so the upload workers reporting progress
+    # never wait for the database
+    self.progress_lock = threading.Lock()
+    self.progress = {}
+    self.finished = 0
+
+    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+    try:
+      self.db = self._open()
+    except sqlite3.DatabaseError:
+      cloudlog.exception("athena upload queue corrupt, rebuilding")
+      os.remove(self.path)
+      self.db = self._open()
+
+  def _open(self):
+    db = sqlite3.connect(self.path, check_same_thread=False)
+    if db.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+      # can't be switched in WAL mode, and an existing database needs a VACUUM to apply it
+      db.execute("PRAGMA journal_mode = DELETE")
+      db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+      db.execute("VACUUM")
+    db.execute("PRAGMA journal_mode = WAL")
+    if db.execute("PRAGMA user_version").fetchone()[0] != UPLOAD_QUEUE_VERSION:
+      db.executescript("""
+        DROP TABLE IF EXISTS jobs;
+        CREATE TABLE jobs (seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT UNIQUE, key TEXT UNIQUE, path TEXT, url TEXT,
+                           headers TEXT, created_at INTEGER, retry_count INTEGER, next_attempt REAL, expires_at REAL);
+        CREATE INDEX jobs_by_attempt ON jobs (next_attempt, seq);
+      """)
+      db.execute("PRAGMA user_version = %d" % UPLOAD_QUEUE_VERSION)
+      db.commit()
+    return db
+
+  def __len__(self):
+    with self.lock:
+      return self.db.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+  def _item(self, row):
+    path, url, headers, created_at, job_id, retry_count = row
+    return UploadItem(path=path, url=url, headers=json.loads(headers), created_at=created_at, id=job_id,
+                      retry_count=retry_count)
+
+  def add(self, path, url, headers):
+    """Returns the job for this upload, new or refreshed"""
+    now = time.time()
+    key = upload_key(path, url)
+    with self.lock:
+      row = self.db.execute("SELECT id FROM jobs WHERE key = ?", (key,)).fetchone()
+      if row is None:
+        created_at = int(now * 1000)
+        job_id = hashlib.sha1(json.dumps([key, created_at]).encode()).hexdigest()
+        self.db.execute("INSERT INTO jobs (id, key, path, url, headers, created_at, retry_count, next_attempt, expires_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, 0, ?, ?)", (job_id, key, path, url, json.dumps(headers), created_at, now, now + MAX_AGE))
+      else:
+        job_id = row[0]
+        self.db.execute("UPDATE jobs SET url = ?, headers = ?, expires_at = ? WHERE id = ?",
+                        (url, json.dumps(headers), now + MAX_AGE, job_id))
+      self.db.commit()
+      return self._get(job_id)
+
+  def _get(self, job_id):
+    row = self.db.execute("SELECT path, url, headers, created_at, id, retry_count FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return self._item(row) if row is not None else None
+
+  def next(self):
+    """First job in order whose retry delay has passed, None if there is none"""
+    now = time.time()
+    with self.lock:
+      expired = self.db.execute("DELETE FROM jobs WHERE expires_at <= ?", (now,)).rowcount
+      if expired:
+        cloudlog.event("athena.upload_queue.expired", count=expired)
+        self.db.commit()
+      row = self.db.execute("SELECT path, url, headers, created_at, id, retry_count FROM jobs WHERE next_attempt <= ? "
+                            "ORDER BY seq LIMIT 1", (now,)).fetchone()
+    return self._item(row) if row is not None else None
+
+  def next_attempt_in(self):
+    """Seconds until a job is due, None if the queue is empty"""
+    with self.lock:
+      row = self.db.execute("SELECT MIN(next_attempt) FROM jobs").fetchone()
+    return None if row[0] is None else max(0., row[0] - time.time())
+
+  def start(self, job_id):
+    with self.progress_lock:
+      self.progress[job_id] = 0.
+
+  def set_progress(self, job_id, sent, size):
+    with self.progress_lock:
+      if job_id in self.progress:  # not finished or cancelled meanwhile
+        self.progress[job_id] = sent / size if size else 1.
+
+  def _clear_progress(self, job_id):
+    with self.progress_lock:
+      self.progress.pop(job_id, None)
+
+  def done(self, job_id):
+    self._remove(job_id)
+
+  def failed(self, job_id):
+    """Schedules a retry, returns True if the job ran out of retries and was dropped"""
+    self._clear_progress(job_id)
+    with self.lock:
+      row = self.db.execute("SELECT retry_count FROM jobs WHERE id = ?", (job_id,)).fetchone()
+      if row is None:  # cancelled while uploading
+        return False
+      retry_count = row[0] + 1
+      if retry_count < MAX_RETRY_COUNT:
+        self.db.execute("UPDATE jobs SET retry_count = ?, next_attempt = ? WHERE id = ?",
+                        (retry_count, time.time() + RETRY_DELAY * 2 ** row[0], job_id))
+        self.db.commit()
+        return False
+
+    cloudlog.event("athena.upload_queue.dropped", id=job_id, retry_count=retry_count)
+    self._remove(job_id)
+    return True
+
+  def cancel(self, job_id):
+    """Returns the cancelled job, None if there is no such job"""
+    with self.lock:
+      item = self._get(job_id)
+    if item is not None:
+      self._remove(job_id)
+    return item
+
+  def _remove(self, job_id):
+    self._clear_progress(job_id)
+    with self.lock:
+      self.db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+      self.db.commit()
+      self.finished += 1
+      if self.finished % COMPACT_EVERY == 0:
+        self._compact()
+
+  def _compact(self):
+    # fold the write ahead log back into the database and give the freed pages back.
+    # executescript runs the vacuum to completion, a cursor stops after freeing one page
+    self.db.executescript("PRAGMA incremental_vacuum;")
+    self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+  def list(self, offset=0, limit=-1):
+    """Jobs in upload order, limit -1 for all of them"""
+    with self.lock:
+      rows = self.db.execute("SELECT path, url, headers, created_at, id, retry_count FROM jobs ORDER BY seq LIMIT ? OFFSET ?",
+                             (limit, offset)).fetchall()
+    with self.progress_lock:
+      progress = dict(self.progress)
+    items = []
+    for row in rows:
+      item = self._item(row)._asdict()
+      item['current'] = item['id'] in progress
+      item['progress'] = progress.get(item['id'], 0.)
+      items.append(item)
+    return items
@@ -1,10 +1,11 @@
 import os
 from common.params import Params
-from common.basedir import BASEDIR
 from selfdrive.version import comma_remote, tested_branch, smiskol_remote
-from selfdrive.car.fingerprints import eliminate_incompatible_cars, all_known_cars
+from selfdrive.car.fingerprints import eliminate_incompatible_cars_mask, cars_to_mask, mask_to_cars, count_cars, \
+                                       all_known_cars, ALL_CARS_MASK
+from selfdrive.car.registry import CAR_REGISTRY, CarInterfaces
 from selfdrive.car.vin import get_vin, VIN_UNKNOWN
-from selfdrive.car.fw_versions import get_fw_versions, match_fw_to_car
+from selfdrive.car.fw_versions import get_fw_versions, match_fw_to_car, match_fw_to_car_near
 from selfdrive.hardware import EON
 from selfdrive.swaglog import cloudlog
 import cereal.messaging as messaging
@@ -36,51 +37,16 @@ def get_one_can(logcan):
       return can
 
 
-def load_interfaces(brand_names):
-  ret = {}
-  for brand_name in brand_names:
-    path = ('selfdrive.car.%s' % brand_name)
-    CarInterface = __import__(path + '.interface', fromlist=['CarInterface']).CarInterface
-
-    if os.path.exists(BASEDIR + '/' + path.replace('.', '/') + '/carstate.py'):
-      CarState = __import__(path + '.carstate', fromlist=['CarState']).CarState
-    else:
-      CarState = None
-
-    if os.path.exists(BASEDIR + '/' + path.replace('.', '/') + '/carcontroller.py'):
-      CarController = __import__(path + '.carcontroller', fromlist=['CarController']).CarController
-    else:
-      CarController = None
-
-    for model_name in brand_names[brand_name]:
-      ret[model_name] = (CarInterface, CarController, CarState)
-  return ret
+# imports from directory selfdrive/car/<name>/, a brand's modules are only loaded when one of its models is looked up
+interface_names = {brand_name: brand['models'] for brand_name, brand in CAR_REGISTRY.items()}
+interfaces = CarInterfaces(CAR_REGISTRY)
 
 
-def _get_interface_names():
-  # read all the folders in selfdrive/car and return a dict where:
-  # - keys are all the car names that which we have an interface for
-  # - values are lists of spefic car models for a given car
-  brand_names = {}
-  for car_folder in [x[0] for x in os.walk(BASEDIR + '/selfdrive/car')]:
-    try:
-      brand_name = car_folder.split('/')[-1]
-      model_names = __import__('selfdrive.car.%s.values' % brand_name, fromlist=['CAR']).CAR
-      model_names = [getattr(model_names, c) for c in model_names.__dict__.keys() if not c.startswith("__")]
-      brand_names[brand_name] = model_names
-    except (ImportError, IOError):
-      pass
+TOYOTA_CARS_MASK = cars_to_mask(c for c in all_known_cars() if "TOYOTA" in c or "LEXUS" in c)
 
-  return brand_names
 
-
-# imports from directory selfdrive/car/<name>/
-interface_names = _get_interface_names()
-interfaces = load_interfaces(interface_names)
-
-
-def only_toyota_left(candidate_cars):
-  return all(("TOYOTA" in c or "LEXUS" in c) for c in candidate_cars) and len(candidate_cars) > 0
+def only_toyota_left(candidate_cars):  # takes a bitset of candidate cars
+  return candidate_cars != 0 and candidate_cars & ~TOYOTA_CARS_MASK == 0
 
 
 # **** for use live only ****
@@ -105,18 +71,26 @@ def fingerprint(logcan, sendcan, has_relay):
     else:
       cloudlog.warning("Getting VIN & FW versions")
       _, vin = get_vin(logcan, sendcan, bus)
-      car_fw = get_fw_versions(logcan, sendcan, bus)
+      # the car is most likely the same brand as last time, query it first
+      brand_hint = cached_params.carName if cached_params is not None else None
+      car_fw = get_fw_versions(logcan, sendcan, bus, brand_hint=brand_hint)
 
     fw_candidates = match_fw_to_car(car_fw)
+    # with no exact match, a car off by a single unknown ECU version can still settle a CAN fingerprint that stays ambiguous
+    fw_near_candidates = match_fw_to_car_near(car_fw) if len(fw_candidates) == 0 else set()
   else:
     vin = VIN_UNKNOWN
-    fw_candidates, car_fw = set(), []
+    fw_candidates, fw_near_candidates, car_fw = set(), set(), []
+
+  fw_near_mask = cars_to_mask(c for c in fw_near_candidates if c in all_known_cars())
+  if fw_near_mask:
+    cloudlog.warning("FW near matches %s", fw_near_candidates)
 
   cloudlog.warning("VIN %s", vin)
   Params().put("CarVin", vin)
 
   finger = gen_empty_fingerprint()
-  candidate_cars = {i: all_known_cars() for i in [0, 1]}  # attempt fingerprint on both bus 0 and 1
+  candidate_cars = {i: ALL_CARS_MASK for i in [0, 1]}  # attempt fingerprint on both bus 0 and 1, as bitsets of cars
   frame = 0
   frame_fingerprint = 10  # 0.1s
   car_fingerprint = None
@@ -131,12 +105,13 @@ def fingerprint(logcan, sendcan, has_relay):
       # and VIN query response.
       # Include bus 2 for toyotas to disambiguate cars using camera messages
       # (ideally should be done for all cars but we can't for Honda Bosch)
+      address, length = can.address, len(can.dat)
       if can.src in range(0, 4):
-        finger[can.src][can.address] = len(can.dat)
+        finger[can.src][address] = length
       for b in candidate_cars:
         if (can.src == b or (only_toyota_left(candidate_cars[b]) and can.src == 2)) and \
-           can.address < 0x800 and can.address not in [0x7df, 0x7e0, 0x7e8]:
-          candidate_cars[b] = eliminate_incompatible_cars(can, candidate_cars[b])
+           address < 0x800 and address not in [0x7df, 0x7e0, 0x7e8]:
+          candidate_cars[b] = eliminate_incompatible_cars_mask(address, length, candidate_cars[b])
 
     # if we only have one car choice and the time since we got our first
     # message has elapsed, exit
@@ -144,34 +119,48 @@ def fingerprint(logcan, sendcan, has_relay):
       # Toyota needs higher time to fingerprint, since DSU does not broadcast immediately
       if only_toyota_left(candidate_cars[b]):
         frame_fingerprint = 100  # 1s
-      if len(candidate_cars[b]) == 1 and frame > frame_fingerprint:
+      if count_cars(candidate_cars[b]) == 1 and frame > frame_fingerprint:
           # fingerprint done
-          car_fingerprint = candidate_cars[b][0]
+          car_fingerprint = mask_to_cars(candidate_cars[b])[0]
 
     # bail if no cars left or we've been waiting for more than 2s
-    failed = all(len(cc) == 0 for cc in candidate_cars.values()) or frame > 200
+    failed = all(cc == 0 for cc in candidate_cars.values()) or frame > 200
     succeeded = car_fingerprint is not None
     done = failed or succeeded
 
     frame += 1
 
   source = car.CarParams.FingerprintSource.can
+  exact_match = True
+
+  # CAN stayed ambiguous for its whole window, a car off by a single unknown ECU version can settle it.
+  # Only the candidates of buses CAN narrowed down are considered, and the result is flagged as not an exact match
+  if car_fingerprint is None and fw_near_mask:
+    near_cars = {mask_to_cars(cc & fw_near_mask)[0] for cc in candidate_cars.values()
+                 if cc != ALL_CARS_MASK and count_cars(cc & fw_near_mask) == 1}
+    if len(near_cars) == 1:
+      car_fingerprint = near_cars.pop()
+      source = car.CarParams.FingerprintSource.fw
+      exact_match = False
+      cloudlog.event("fingerprint_fw_near_match", car_fingerprint=car_fingerprint, fw_near_candidates=list(fw_near_candidates))
 
   # If FW query returns exactly 1 candidate, use it
   if len(fw_candidates) == 1:
     car_fingerprint = list(fw_candidates)[0]
     source = car.CarParams.FingerprintSource.fw
+    exact_match = True
 
   if fixed_fingerprint:
     car_fingerprint = fixed_fingerprint
     source = car.CarParams.FingerprintSource.fixed
+    exact_match = True
 
   cloudlog.warning("fingerprinted %s", car_fingerprint)
-  return car_fingerprint, finger, vin, car_fw, source
+  return car_fingerprint, finger, vin, car_fw, source, exact_match
 
 
 def get_car(logcan, sendcan, has_relay=False):
-  candidate, fingerprints, vin, car_fw, source = fingerprint(logcan, sendcan, has_relay)
+  candidate, fingerprints, vin, car_fw, source, exact_match = fingerprint(logcan, sendcan, has_relay)
 
   if candidate is None:
     cloudlog.warning("car doesn't match any fingerprints: %r", fingerprints)
@@ -182,5 +171,6 @@ def get_car(logcan, sendcan, has_relay=False):
   car_params.carVin = vin
   car_params.carFw = car_fw
   car_params.fingerprintSource = source
+  car_params.fuzzyFingerprint = not exact_match
 
   return CarInterface(car_params, CarController, CarState), car_params, candidate
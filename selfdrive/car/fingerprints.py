@@ -1,5 +1,6 @@
 import os
 from common.basedir import BASEDIR
+from selfdrive.car.registry import CAR_REGISTRY, REGISTRY_ATTRS
 
 
 def get_attr_from_cars(attr, result=dict, combine_brands=True):
@@ -8,28 +9,30 @@ def get_attr_from_cars(attr, result=dict, combine_brands=True):
   # - values are attr values from all car folders
   result = result()
 
-  for car_folder in [x[0] for x in os.walk(BASEDIR + '/selfdrive/car')]:
-    try:
-      car_name = car_folder.split('/')[-1]
-      values = __import__('selfdrive.car.%s.values' % car_name, fromlist=[attr])
-      if hasattr(values, attr):
-        attr_values = getattr(values, attr)
-      else:
-        continue
-
-      if isinstance(attr_values, dict):
-        for f, v in attr_values.items():
-          if combine_brands:
-            result[f] = v
-          else:
-            if car_name not in result:
-              result[car_name] = {}
-            result[car_name][f] = v
-      elif isinstance(attr_values, list):
-        result += attr_values
-
-    except (ImportError, IOError):
-      pass
+  if attr in REGISTRY_ATTRS:  # cached tables, avoids importing every brand
+    brand_values = [(car_name, brand[attr]) for car_name, brand in CAR_REGISTRY.items() if attr in brand]
+  else:
+    brand_values = []
+    for car_folder in [x[0] for x in os.walk(BASEDIR + '/selfdrive/car')]:
+      try:
+        car_name = car_folder.split('/')[-1]
+        values = __import__('selfdrive.car.%s.values' % car_name, fromlist=[attr])
+        if hasattr(values, attr):
+          brand_values.append((car_name, getattr(values, attr)))
+      except (ImportError, IOError):
+        pass
+
+  for car_name, attr_values in brand_values:
+    if isinstance(attr_values, dict):
+      for f, v in attr_values.items():
+        if combine_brands:
+          result[f] = v
+        else:
+          if car_name not in result:
+            result[car_name] = {}
+          result[car_name][f] = v
+    elif isinstance(attr_values, list):
+      result += attr_values
 
   return result
 
@@ -46,6 +49,52 @@ def is_valid_for_fingerprint(msg, car_fingerprint):
   return (adr in car_fingerprint and car_fingerprint[adr] == len(msg.dat)) or adr >= 0x800
 
 
+def _build_fingerprint_index():
+  # car bitsets: bit i is set for the i-th car in all_known_cars()
+  # index maps (address, length) to the bitset of cars with at least one fingerprint containing it
+  car_bits = {car_name: 1 << i for i, car_name in enumerate(_FINGERPRINTS)}
+  index = {}
+  for car_name, car_fingerprints in _FINGERPRINTS.items():
+    if car_name in IGNORED_FINGERPRINTS:
+      continue
+
+    for fingerprint in car_fingerprints:
+      for address, length in {**fingerprint, **_DEBUG_ADDRESS}.items():  # add alien debug address
+        index[(address, length)] = index.get((address, length), 0) | car_bits[car_name]
+  return car_bits, index
+
+
+_CAR_BITS, _FINGERPRINT_INDEX = _build_fingerprint_index()
+ALL_CARS_MASK = (1 << len(_CAR_BITS)) - 1
+
+
+def cars_to_mask(candidate_cars):
+  """Returns the bitset of a list of cars."""
+  mask = 0
+  for car_name in candidate_cars:
+    mask |= _CAR_BITS[car_name]
+  return mask
+
+
+def mask_to_cars(mask):
+  """Returns the list of cars in a bitset, in the same order as all_known_cars()."""
+  return [car_name for car_name, bit in _CAR_BITS.items() if mask & bit]
+
+
+_FINGERPRINTED_CARS_MASK = cars_to_mask(c for c in _CAR_BITS if c not in IGNORED_FINGERPRINTS)
+
+
+def count_cars(mask):
+  return bin(mask).count('1')
+
+
+def eliminate_incompatible_cars_mask(address, length, mask):
+  """Same as eliminate_incompatible_cars, on a bitset of candidate cars."""
+  if address >= 0x800:  # ignore addresses that are more than 11 bits
+    return mask & _FINGERPRINTED_CARS_MASK
+  return mask & _FINGERPRINT_INDEX.get((address, length), 0)
+
+
 def eliminate_incompatible_cars(msg, candidate_cars):
   """Removes cars that could not have sent msg.
 
@@ -56,22 +105,8 @@ def eliminate_incompatible_cars(msg, candidate_cars):
      Returns:
       A list containing the subset of candidate_cars that could have sent msg.
   """
-  compatible_cars = []
-
-  for car_name in candidate_cars:
-    if car_name in IGNORED_FINGERPRINTS:
-      continue
-
-    car_fingerprints = _FINGERPRINTS[car_name]
-
-    for fingerprint in car_fingerprints:
-      fingerprint.update(_DEBUG_ADDRESS)  # add alien debug address
-
-      if is_valid_for_fingerprint(msg, fingerprint):
-        compatible_cars.append(car_name)
-        break
-
-  return compatible_cars
+  mask = eliminate_incompatible_cars_mask(msg.address, len(msg.dat), cars_to_mask(candidate_cars))
+  return [car_name for car_name in candidate_cars if mask & _CAR_BITS[car_name]]
 
 
 def all_known_cars():
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import struct
 import traceback
+from collections import defaultdict
 from typing import Any
 
 from tqdm import tqdm
@@ -108,83 +109,143 @@ def chunks(l, n=128):
     yield l[i:i + n]
 
 
-def match_fw_to_car(fw_versions):
-  candidates = FW_VERSIONS
-  invalid = []
+ESSENTIAL_ECUS = [Ecu.engine, Ecu.eps, Ecu.esp, Ecu.fwdRadar, Ecu.fwdCamera, Ecu.vsa, Ecu.electricBrakeBooster]
 
-  fw_versions_dict = {}
-  for fw in fw_versions:
-    addr = fw.address
-    sub_addr = fw.subAddress if fw.subAddress != 0 else None
-    fw_versions_dict[(addr, sub_addr)] = fw.fwVersion
 
-  for candidate, fws in candidates.items():
-    for ecu, expected_versions in fws.items():
-      ecu_type = ecu[0]
-      addr = ecu[1:]
-      found_version = fw_versions_dict.get(addr, None)
-      ESSENTIAL_ECUS = [Ecu.engine, Ecu.eps, Ecu.esp, Ecu.fwdRadar, Ecu.fwdCamera, Ecu.vsa, Ecu.electricBrakeBooster]
-      if ecu_type == Ecu.esp and candidate in [TOYOTA.RAV4, TOYOTA.COROLLA, TOYOTA.HIGHLANDER] and found_version is None:
-        continue
+def missing_ecu_ok(candidate, ecu_type):
+  if ecu_type == Ecu.esp and candidate in [TOYOTA.RAV4, TOYOTA.COROLLA, TOYOTA.HIGHLANDER]:
+    return True
 
-      # TODO: on some toyota, the engine can show on two different addresses
-      if ecu_type == Ecu.engine and candidate in [TOYOTA.COROLLA_TSS2, TOYOTA.CHR, TOYOTA.LEXUS_IS, TOYOTA.AVALON] and found_version is None:
-        continue
+  # TODO: on some toyota, the engine can show on two different addresses
+  if ecu_type == Ecu.engine and candidate in [TOYOTA.COROLLA_TSS2, TOYOTA.CHR, TOYOTA.LEXUS_IS, TOYOTA.AVALON]:
+    return True
 
-      # ignore non essential ecus
-      if ecu_type not in ESSENTIAL_ECUS and found_version is None:
-        continue
+  # ignore non essential ecus
+  return ecu_type not in ESSENTIAL_ECUS
 
-      if found_version not in expected_versions:
-        invalid.append(candidate)
-        break
 
-  return set(candidates.keys()) - set(invalid)
+def build_fw_index(fw_versions_by_car):
+  """
+    Returns, for each (addr, sub_addr): the cars that have an ECU there, the cars that need it to respond,
+    and a dict from fwVersion to the cars that accept it
+  """
+  cars_with_ecu = defaultdict(set)
+  cars_requiring_ecu = defaultdict(set)
+  versions = defaultdict(lambda: defaultdict(set))
+  for candidate, fws in fw_versions_by_car.items():
+    for (ecu_type, addr, sub_addr), expected_versions in fws.items():
+      cars_with_ecu[(addr, sub_addr)].add(candidate)
+      if not missing_ecu_ok(candidate, ecu_type):
+        cars_requiring_ecu[(addr, sub_addr)].add(candidate)
+      for version in expected_versions:
+        versions[(addr, sub_addr)][version].add(candidate)
 
+  return {addr: (frozenset(cars_with_ecu[addr]), frozenset(cars_requiring_ecu[addr]),
+                 {v: frozenset(c) for v, c in versions[addr].items()}) for addr in cars_with_ecu}
 
-def get_fw_versions(logcan, sendcan, bus, extra=None, timeout=0.1, debug=False, progress=False):
-  ecu_types = {}
 
-  # Extract ECU adresses to query from fingerprints
-  # ECUs using a subadress need be queried one by one, the rest can be done in parallel
-  addrs = []
-  parallel_addrs = []
+FW_INDEX = build_fw_index(FW_VERSIONS)
 
-  versions = get_attr_from_cars('FW_VERSIONS', combine_brands=False)
-  if extra is not None:
-    versions.update(extra)
 
+def get_fw_versions_dict(fw_versions):
+  fw_versions_dict = {}
+  for fw in fw_versions:
+    addr = fw.address
+    sub_addr = fw.subAddress if fw.subAddress != 0 else None
+    fw_versions_dict[(addr, sub_addr)] = fw.fwVersion
+  return fw_versions_dict
+
+
+def match_fw_to_car(fw_versions):
+  fw_versions_dict = get_fw_versions_dict(fw_versions)
+
+  candidates = set(FW_VERSIONS.keys())
+  for addr, (cars_with_ecu, cars_requiring_ecu, versions) in FW_INDEX.items():
+    found_version = fw_versions_dict.get(addr, None)
+    if found_version is None:
+      candidates -= cars_requiring_ecu
+    else:
+      candidates -= cars_with_ecu - versions.get(found_version, frozenset())
+
+  return candidates
+
+
+def match_fw_to_car_ranked(fw_versions):
+  """
+    Scores every car by its ECUs: returns a list of (candidate, matched, mismatched), where mismatched counts
+    unknown versions and missing essential ECUs. Sorted by fewest mismatches, then most matches
+  """
+  fw_versions_dict = get_fw_versions_dict(fw_versions)
+
+  matched = defaultdict(int)
+  mismatched = defaultdict(int)
+  for addr, (cars_with_ecu, cars_requiring_ecu, versions) in FW_INDEX.items():
+    found_version = fw_versions_dict.get(addr, None)
+    if found_version is None:
+      bad = cars_requiring_ecu
+    else:
+      good = versions.get(found_version, frozenset())
+      bad = cars_with_ecu - good
+      for candidate in good:
+        matched[candidate] += 1
+    for candidate in bad:
+      mismatched[candidate] += 1
+
+  ranked = [(candidate, matched[candidate], mismatched[candidate]) for candidate in FW_VERSIONS]
+  return sorted(ranked, key=lambda r: (r[2], -r[1]))
+
+
+def match_fw_to_car_near(fw_versions, max_mismatched=1):
+  """Returns the best scoring cars if they have at most max_mismatched ECUs wrong, e.g. one unknown FW version"""
+  ranked = [r for r in match_fw_to_car_ranked(fw_versions) if r[1] > 0]
+  if not ranked or ranked[0][2] > max_mismatched:
+    return set()
+  return {candidate for candidate, matched, mismatched in ranked if (matched, mismatched) == ranked[0][1:]}
+
+
+def build_fw_query_rounds(versions, brand_hint=None, timeout=0.1):
+  """
+    Groups the FW queries into rounds sent on the bus at the same time. A round never sends two requests to the same
+    tx address and an ECU gets its requests in REQUESTS order. Requests for brand_hint go in the first rounds
+  """
+  # ECUs using a subadress need be queried one by one, the rest can be done in parallel
+  parallel_addrs = []
+  addrs = []
   for brand, brand_versions in versions.items():
     for c in brand_versions.values():
-      for ecu_type, addr, sub_addr in c.keys():
+      for _, addr, sub_addr in c.keys():
         a = (brand, addr, sub_addr)
-        if a not in ecu_types:
-          ecu_types[(addr, sub_addr)] = ecu_type
-
         if sub_addr is None:
           if a not in parallel_addrs:
             parallel_addrs.append(a)
-        else:
-          if [a] not in addrs:
-            addrs.append([a])
-
-  addrs.insert(0, parallel_addrs)
-
-  fw_versions = {}
-  for i, addr in enumerate(tqdm(addrs, disable=not progress)):
-    for addr_chunk in chunks(addr):
-      for brand, request, response in REQUESTS:
-        try:
-          addrs = [(a, s) for (b, a, s) in addr_chunk if b in (brand, 'any')]
-
-          if addrs:
-            query = IsoTpParallelQuery(sendcan, logcan, bus, addrs, request, response, debug=debug)
-            t = 2 * timeout if i == 0 else timeout
-            fw_versions.update(query.get_data(t))
-        except Exception:
-          cloudlog.warning(f"FW query exception: {traceback.format_exc()}")
-
-  # Build capnp list to put into CarParams
+        elif a not in addrs:
+          addrs.append(a)
+
+  # each job is a request to a group of ECUs: (brand, request, response, [(addr, sub_addr)], timeout)
+  jobs = []
+  for i, addr_group in enumerate([parallel_addrs] + [[a] for a in addrs]):
+    for brand, request, response in REQUESTS:
+      job_addrs = [(a, s) for (b, a, s) in addr_group if b in (brand, 'any')]
+      if job_addrs:
+        jobs.append((brand, request, response, job_addrs, 2 * timeout if i == 0 else timeout))
+
+  rounds = []
+  for phase in ([j for j in jobs if j[0] == brand_hint], [j for j in jobs if j[0] != brand_hint]):
+    phase_rounds = []
+    last_round = {}  # tx addr -> last round of this phase sending to it
+    for job in phase:
+      tx_addrs = {a for a, _ in job[3]}
+      idx = max(last_round.get(a, -1) for a in tx_addrs) + 1
+      if idx == len(phase_rounds):
+        phase_rounds.append([])
+      phase_rounds[idx].append(job)
+      for a in tx_addrs:
+        last_round[a] = idx
+    rounds += phase_rounds
+  return rounds
+
+
+def build_car_fw(fw_versions, ecu_types):
   car_fw = []
   for addr, version in fw_versions.items():
     f = car.CarParams.CarFw.new_message()
@@ -201,6 +262,48 @@ def get_fw_versions(logcan, sendcan, bus, extra=None, timeout=0.1, debug=False,
   return car_fw
 
 
+def get_fw_versions(logcan, sendcan, bus, extra=None, timeout=0.1, debug=False, progress=False, brand_hint=None):
+  ecu_types = {}
+
+  versions = get_attr_from_cars('FW_VERSIONS', combine_brands=False)
+  if extra is not None:
+    versions.update(extra)
+
+  car_brands = {}
+  for brand, brand_versions in versions.items():
+    for candidate, c in brand_versions.items():
+      car_brands[candidate] = brand
+      for ecu_type, addr, sub_addr in c.keys():
+        ecu_types[(addr, sub_addr)] = ecu_type
+
+  rounds = build_fw_query_rounds(versions, brand_hint, timeout)
+
+  fw_versions = {}
+  for i, jobs in enumerate(tqdm(rounds, disable=not progress)):
+    query_addrs = [(brand, request, response, a) for brand, request, response, job_addrs, _ in jobs for a in job_addrs]
+    t = max(job[4] for job in jobs)
+    for addr_chunk in chunks(query_addrs):
+      try:
+        query = IsoTpParallelQuery(sendcan, logcan, bus, [], None, None, debug=debug)
+        for _, request, response, a in addr_chunk:
+          query.add_addrs([a], request, response)
+        fw_versions.update(query.get_data(t))
+      except Exception:
+        cloudlog.warning(f"FW query exception: {traceback.format_exc()}")
+
+    # Stop once a single car is left and none of the remaining requests go to its brand, they can't change the match
+    if extra is None and i + 1 < len(rounds):
+      candidates = match_fw_to_car(build_car_fw(fw_versions, ecu_types))
+      if len(candidates) == 1:
+        brand = car_brands[list(candidates)[0]]
+        if not any(job[0] == brand for jobs in rounds[i + 1:] for job in jobs):
+          cloudlog.warning(f"FW query done early after {i + 1}/{len(rounds)} rounds")
+          break
+
+  # Build capnp list to put into CarParams
+  return build_car_fw(fw_versions, ecu_types)
+
+
 if __name__ == "__main__":
   import time
   import argparse
@@ -210,6 +313,7 @@ if __name__ == "__main__":
   parser = argparse.ArgumentParser(description='Get firmware version of ECUs')
   parser.add_argument('--scan', action='store_true')
   parser.add_argument('--debug', action='store_true')
+  parser.add_argument('--brand', help='brand to query first, e.g. toyota')
   args = parser.parse_args()
 
   logcan = messaging.sub_sock('can')
@@ -235,7 +339,7 @@ if __name__ == "__main__":
   print()
 
   t = time.time()
-  fw_vers = get_fw_versions(logcan, sendcan, 1, extra=extra, debug=args.debug, progress=True)
+  fw_vers = get_fw_versions(logcan, sendcan, 1, extra=extra, debug=args.debug, progress=True, brand_hint=args.brand)
   candidates = match_fw_to_car(fw_vers)
 
   print()
@@ -248,4 +352,6 @@ if __name__ == "__main__":
 
   print()
   print("Possible matches:", candidates)
+  if not candidates:
+    print("Near matches:", match_fw_to_car_near(fw_vers))
   print("Getting fw took %.3f s" % (time.time() - t))
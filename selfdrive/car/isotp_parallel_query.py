@@ -13,21 +13,22 @@ class IsoTpParallelQuery():
     self.sendcan = sendcan
     self.logcan = logcan
     self.bus = bus
-    self.request = request
-    self.response = response
     self.debug = debug
     self.functional_addr = functional_addr
 
     self.real_addrs = []
-    for a in addrs:
-      if isinstance(a, tuple):
-        self.real_addrs.append(a)
-      else:
-        self.real_addrs.append((a, None))
-
-    self.msg_addrs = {tx_addr: get_rx_addr_for_tx_addr(tx_addr[0]) for tx_addr in self.real_addrs}
+    self.msg_addrs = {}
+    self.requests = {}  # tx_addr -> (request, response), so different ECUs can be sent different queries at once
+    self.add_addrs(addrs, request, response)
     self.msg_buffer = defaultdict(list)
 
+  def add_addrs(self, addrs, request, response):
+    for a in addrs:
+      tx_addr = a if isinstance(a, tuple) else (a, None)
+      self.real_addrs.append(tx_addr)
+      self.msg_addrs[tx_addr] = get_rx_addr_for_tx_addr(tx_addr[0])
+      self.requests[tx_addr] = (request, response)
+
   def rx(self):
     """Drain can socket and sort messages into buffers based on address"""
     can_packets = messaging.drain_sock(self.logcan, wait_for_one=True)
@@ -88,7 +89,7 @@ class IsoTpParallelQuery():
       max_len = 8 if sub_addr is None else 7
 
       msg = IsoTpMessage(can_client, timeout=0, max_len=max_len, debug=self.debug)
-      msg.send(self.request[0])
+      msg.send(self.requests[tx_addr][0][0])
 
       msgs[tx_addr] = msg
       request_counter[tx_addr] = 0
@@ -108,13 +109,14 @@ class IsoTpParallelQuery():
         if not dat:
           continue
 
+        request, response = self.requests[tx_addr]
         counter = request_counter[tx_addr]
-        expected_response = self.response[counter]
+        expected_response = response[counter]
         response_valid = dat[:len(expected_response)] == expected_response
 
         if response_valid:
-          if counter + 1 < len(self.request):
-            msg.send(self.request[counter + 1])
+          if counter + 1 < len(request):
+            msg.send(request[counter + 1])
             request_counter[tx_addr] += 1
           else:
             results[tx_addr] = dat[len(expected_response):]
@@ -0,0 +1,119 @@
+import os
+import pickle
+import hashlib
+import importlib
+
+from common.basedir import BASEDIR
+from common.file_helpers import atomic_pickle_dump, mkdirs_private
+
+# Generated registry of all brands: models, module paths and the fingerprint tables from each values.py.
+# Startup loads it from a pickle keyed on the values.py hashes instead of importing every brand,
+# so loading it must not trust a directory other users can write to
+CAR_REGISTRY_VERSION = 1
+CAR_REGISTRY_CACHE_DIR = os.getenv("CAR_REGISTRY_CACHE_DIR", os.path.join(BASEDIR, "selfdrive", "car", "registry_cache"))
+REGISTRY_ATTRS = ['FW_VERSIONS', 'FINGERPRINTS', 'IGNORED_FINGERPRINTS']
+
+
+def _brand_folders():
+  # same folder order as os.walk, which sets the order of all_known_cars()
+  brands = []
+  for car_folder in [x[0] for x in os.walk(BASEDIR + '/selfdrive/car')]:
+    brand_name = car_folder.split('/')[-1]
+    if os.path.isfile(os.path.join(car_folder, 'values.py')) and brand_name not in brands:
+      brands.append(brand_name)
+  return brands
+
+
+def _source_hash(brands):
+  h = hashlib.sha1()
+  for brand_name in brands:
+    folder = os.path.join(BASEDIR, 'selfdrive/car', brand_name)
+    h.update(brand_name.encode())
+    with open(os.path.join(folder, 'values.py'), 'rb') as f:
+      h.update(f.read())
+    for module in ['interface', 'carstate', 'carcontroller']:
+      h.update(b'1' if os.path.exists(os.path.join(folder, module + '.py')) else b'0')
+  return h.hexdigest()
+
+
+def generate_registry(brands):
+  registry = {}
+  for brand_name in brands:
+    path = 'selfdrive.car.%s' % brand_name
+    try:
+      values = importlib.import_module(path + '.values')
+      model_names = values.CAR
+    except (ImportError, IOError, AttributeError):
+      continue
+
+    folder = os.path.join(BASEDIR, 'selfdrive/car', brand_name)
+    registry[brand_name] = {
+      'models': [getattr(model_names, c) for c in model_names.__dict__.keys() if not c.startswith("__")],
+      'modules': {module: ('%s.%s' % (path, module) if os.path.exists(os.path.join(folder, module + '.py')) else None)
+                  for module in ['interface', 'carstate', 'carcontroller']},
+    }
+    for attr in REGISTRY_ATTRS:
+      if hasattr(values, attr):
+        registry[brand_name][attr] = getattr(values, attr)
+  return registry
+
+
+def load_registry(use_cache=True):
+  brands = _brand_folders()
+  cache_fn = os.path.join(CAR_REGISTRY_CACHE_DIR, "registry_%s.pkl" % _source_hash(brands))
+
+  use_cache = use_cache and mkdirs_private(CAR_REGISTRY_CACHE_DIR)
+  if use_cache:
+    try:
+      with open(cache_fn, "rb") as f:
+        version, registry = pickle.load(f)
+      if version == CAR_REGISTRY_VERSION:
+        return registry
+    except Exception:
+      pass
+
+  registry = generate_registry(brands)
+  if use_cache and atomic_pickle_dump((CAR_REGISTRY_VERSION, registry), cache_fn):
+    # registries generated for older values.py files won't be loaded again
+    for entry in os.listdir(CAR_REGISTRY_CACHE_DIR):
+      if entry.startswith("registry_") and entry != os.path.basename(cache_fn):
+        try:
+          os.remove(os.path.join(CAR_REGISTRY_CACHE_DIR, entry))
+        except OSError:
+          pass
+  return registry
+
+
+CAR_REGISTRY = load_registry()
+
+
+class CarInterfaces():
+  """Mapping of model name to (CarInterface, CarController, CarState), importing a brand's modules on first access"""
+  def __init__(self, registry):
+    self.registry = registry
+    self.model_brands = {model_name: brand_name for brand_name, brand in registry.items() for model_name in brand['models']}
+    self._loaded = {}
+
+  def _load_brand(self, brand_name):
+    if brand_name not in self._loaded:
+      modules = self.registry[brand_name]['modules']
+      CarInterface = importlib.import_module(modules['interface']).CarInterface
+      CarState = importlib.import_module(modules['carstate']).CarState if modules['carstate'] is not None else None
+      CarController = importlib.import_module(modules['carcontroller']).CarController if modules['carcontroller'] is not None else None
+      self._loaded[brand_name] = (CarInterface, CarController, CarState)
+    return self._loaded[brand_name]
+
+  def __getitem__(self, model_name):
+    return self._load_brand(self.model_brands[model_name])
+
+  def __contains__(self, model_name):
+    return model_name in self.model_brands
+
+  def __iter__(self):
+    return iter(self.model_brands)
+
+  def __len__(self):
+    return len(self.model_brands)
+
+  def keys(self):
+    return self.model_brands.keys()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+import unittest
+from unittest import mock
+
+from cereal import car
+from selfdrive.car import car_helpers
+from selfdrive.car.fingerprints import cars_to_mask
+from selfdrive.car.toyota.values import CAR as TOYOTA
+
+FingerprintSource = car.CarParams.FingerprintSource
+CAN = mock.Mock(can=[mock.Mock(src=0, address=0x100, dat=b'\x00' * 8)])
+
+
+class TestFingerprint(unittest.TestCase):
+  def fingerprint(self, can_candidates, fw_candidates=set(), fw_near_candidates=set()):
+    get_one_can = mock.Mock(return_value=CAN)
+    with mock.patch.dict(car_helpers.os.environ, {}, clear=True), \
+         mock.patch.object(car_helpers, "Params", **{"return_value.get.return_value": None}), \
+         mock.patch.object(car_helpers, "get_vin", return_value=(0, "VIN")), \
+         mock.patch.object(car_helpers, "get_fw_versions", return_value=[]), \
+         mock.patch.object(car_helpers, "match_fw_to_car", return_value=set(fw_candidates)), \
+         mock.patch.object(car_helpers, "match_fw_to_car_near", return_value=set(fw_near_candidates)), \
+         mock.patch.object(car_helpers, "eliminate_incompatible_cars_mask", return_value=cars_to_mask(can_candidates)), \
+         mock.patch.object(car_helpers, "get_one_can", get_one_can):
+      candidate, _, _, _, source, exact_match = car_helpers.fingerprint(None, None, True)
+    return candidate, source, exact_match, get_one_can.call_count
+
+  def test_can(self):
+    candidate, source, exact_match, _ = self.fingerprint([TOYOTA.PRIUS], fw_near_candidates=[TOYOTA.RAV4])
+    self.assertEqual((candidate, source, exact_match), (TOYOTA.PRIUS, FingerprintSource.can, True))
+
+  def test_exact_fw(self):
+    candidate, source, exact_match, _ = self.fingerprint([TOYOTA.PRIUS, TOYOTA.RAV4], fw_candidates=[TOYOTA.RAV4])
+    self.assertEqual((candidate, source, exact_match), (TOYOTA.RAV4, FingerprintSource.fw, True))
+
+  def test_near_fw_after_can_window(self):
+    candidate, source, exact_match, frames = self.fingerprint([TOYOTA.PRIUS, TOYOTA.RAV4], fw_near_candidates=[TOYOTA.RAV4])
+    self.assertEqual((candidate, source, exact_match), (TOYOTA.RAV4, FingerprintSource.fw, False))
+    # CAN got its whole window to disambiguate first
+    self.assertGreater(frames, 200)
+
+  def test_near_fw_outside_can_candidates(self):
+    candidate, _, _, _ = self.fingerprint([TOYOTA.PRIUS, TOYOTA.RAV4], fw_near_candidates=[TOYOTA.COROLLA])
+    self.assertIsNone(candidate)
+
+  def test_ambiguous_near_fw(self):
+    candidate, _, _, _ = self.fingerprint([TOYOTA.PRIUS, TOYOTA.RAV4, TOYOTA.COROLLA],
+                                          fw_near_candidates=[TOYOTA.RAV4, TOYOTA.COROLLA])
+    self.assertIsNone(candidate)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -71,10 +71,11 @@ class Controls:
       ignore = ['driverCameraState', 'managerState'] if SIMULATION else None
       self.sm = messaging.SubMaster(['deviceState', 'pandaState', 'modelV2', 'liveCalibration',
                                      'driverMonitoringState', 'longitudinalPlan', 'lateralPlan', 'liveLocationKalman',
-                                     'roadCameraState', 'driverCameraState', 'managerState', 'liveParameters', 'radarState'], ignore_alive=ignore)
+                                     'roadCameraState', 'driverCameraState', 'managerState', 'liveParameters', 'radarState'],
+                                    ignore_alive=ignore, lazy=True)
 
     self.sm_smiskol = messaging.SubMaster(['radarState', 'dynamicFollowData', 'liveTracks', 'dynamicFollowButton',
-                                           'laneSpeed', 'dynamicCameraOffset', 'modelLongButton'])
+                                           'laneSpeed', 'dynamicCameraOffset', 'modelLongButton'], lazy=True)
 
     self.op_params = opParams()
     self.df_manager = dfManager()
@@ -121,6 +122,7 @@ class Controls:
     put_nonblocking("CarParamsCache", cp_bytes)
 
     self.CC = car.CarControl.new_message()
+    self.controls_state = messaging.ReusableMessage('controlsState')
     self.AM = AlertManager()
     self.events = Events()
 
@@ -552,37 +554,37 @@ class Controls:
     steer_angle_rad = (CS.steeringAngleDeg - self.sm['lateralPlan'].angleOffsetDeg) * CV.DEG_TO_RAD
 
     # controlsState
-    dat = messaging.new_message('controlsState')
-    dat.valid = CS.canValid
-    controlsState = dat.controlsState
-    controlsState.alertText1 = self.AM.alert_text_1
-    controlsState.alertText2 = self.AM.alert_text_2
-    controlsState.alertSize = self.AM.alert_size
-    controlsState.alertStatus = self.AM.alert_status
-    controlsState.alertBlinkingRate = self.AM.alert_rate
-    controlsState.alertType = self.AM.alert_type
-    controlsState.alertSound = self.AM.audible_alert
-    controlsState.canMonoTimes = list(CS.canMonoTimes)
-    controlsState.longitudinalPlanMonoTime = self.sm.logMonoTime['longitudinalPlan']
-    controlsState.lateralPlanMonoTime = self.sm.logMonoTime['lateralPlan']
-    controlsState.enabled = self.enabled
-    controlsState.active = self.active
-    controlsState.curvature = self.VM.calc_curvature(steer_angle_rad, CS.vEgo)
-    controlsState.state = self.state
-    controlsState.engageable = not self.events.any(ET.NO_ENTRY)
-    controlsState.longControlState = self.LoC.long_control_state
-    controlsState.vPid = float(self.LoC.v_pid)
-    controlsState.vCruise = float(self.v_cruise_kph)
-    controlsState.upAccelCmd = float(self.LoC.pid.p)
-    controlsState.uiAccelCmd = float(self.LoC.pid.id)
-    controlsState.ufAccelCmd = float(self.LoC.pid.f)
-    controlsState.steeringAngleDesiredDeg = float(self.LaC.angle_steers_des)
-    controlsState.vTargetLead = float(v_acc)
-    controlsState.aTarget = float(a_acc)
-    controlsState.cumLagMs = -self.rk.remaining * 1000.
-    controlsState.startMonoTime = int(start_time * 1e9)
-    controlsState.forceDecel = bool(force_decel)
-    controlsState.canErrorCounter = self.can_error_counter
+    controlsState = self.controls_state.start(valid=CS.canValid)
+    self.controls_state.set((
+      ('alertText1', self.AM.alert_text_1),
+      ('alertText2', self.AM.alert_text_2),
+      ('alertSize', self.AM.alert_size),
+      ('alertStatus', self.AM.alert_status),
+      ('alertBlinkingRate', self.AM.alert_rate),
+      ('alertType', self.AM.alert_type),
+      ('alertSound', self.AM.audible_alert),
+      ('canMonoTimes', list(CS.canMonoTimes)),
+      ('longitudinalPlanMonoTime', self.sm.logMonoTime['longitudinalPlan']),
+      ('lateralPlanMonoTime', self.sm.logMonoTime['lateralPlan']),
+      ('enabled', self.enabled),
+      ('active', self.active),
+      ('curvature', self.VM.calc_curvature(steer_angle_rad, CS.vEgo)),
+      ('state', self.state),
+      ('engageable', not self.events.any(ET.NO_ENTRY)),
+      ('longControlState', self.LoC.long_control_state),
+      ('vPid', float(self.LoC.v_pid)),
+      ('vCruise', float(self.v_cruise_kph)),
+      ('upAccelCmd', float(self.LoC.pid.p)),
+      ('uiAccelCmd', float(self.LoC.pid.id)),
+      ('ufAccelCmd', float(self.LoC.pid.f)),
+      ('steeringAngleDesiredDeg', float(self.LaC.angle_steers_des)),
+      ('vTargetLead', float(v_acc)),
+      ('aTarget', float(a_acc)),
+      ('cumLagMs', -self.rk.remaining * 1000.),
+      ('startMonoTime', int(start_time * 1e9)),
+      ('forceDecel', bool(force_decel)),
+      ('canErrorCounter', self.can_error_counter),
+    ))
 
     if self.CP.lateralTuning.which() == 'pid':
       controlsState.lateralControlState.pidState = lac_log
@@ -590,8 +592,9 @@ class Controls:
       controlsState.lateralControlState.lqrState = lac_log
     elif self.CP.lateralTuning.which() == 'indi':
       controlsState.lateralControlState.indiState = lac_log
-    self.pm.send('controlsState', dat)
+    self.pm.send('controlsState', self.controls_state)
 
+    # carState, carEvents and carControl take whole structs built elsewhere, a ReusableMessage would copy them all the same
     # carState
     car_events = self.events.to_msg()
     cs_send = messaging.new_message('carState')
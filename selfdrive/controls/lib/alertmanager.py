@@ -1,7 +1,9 @@
 import os
 import copy
+import heapq
 import json
-from typing import List, Optional
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
 from selfdrive.controls.lib.events import EVENTS, ET
 
 from cereal import car, log
@@ -27,10 +29,36 @@ def set_offroad_alert(alert: str, show_alert: bool, extra_text: Optional[str] =
     Params().delete(alert)
 
 
-class AlertManager:
+class ActiveAlert:
+  def __init__(self, alert: Alert, alert_type: str, event_type: Optional[str], start_time: float,
+               alert_text_1: str, alert_text_2: str, seq: int):
+    self.alert_type = alert_type
+    self.update(alert, event_type, start_time, alert_text_1, alert_text_2, seq)
+
+  def update(self, alert: Alert, event_type: Optional[str], start_time: float,
+             alert_text_1: str, alert_text_2: str, seq: int) -> None:
+    self.alert = alert
+    self.event_type = event_type
+    self.alert_text_1 = alert_text_1
+    self.alert_text_2 = alert_text_2
+    self.start_time = start_time
+    self.end_time = start_time + max(alert.duration_sound, alert.duration_hud_alert, alert.duration_text)
+    self.seq = seq
+
 
+class AlertManager:
+  """
+    Active alerts keyed by alert type. Re-adding an alert refreshes its entry in place. Each priority keeps its
+    alerts in the order they were last added, which is also start time order, and expiry comes from a heap on
+    end time. The heap is invalidated lazily, an entry in it is current only if its seq matches the alert's
+  """
   def __init__(self):
-    self.activealerts: List[Alert] = []
+    self.alerts: Dict[str, ActiveAlert] = {}
+    self.event_types: Dict[Optional[str], Set[str]] = {}
+    self.order: Dict[int, OrderedDict] = {}  # priority -> alert type -> alert, last added at the end
+    self.expiry: List[Tuple[float, int, str]] = []
+    self.seq = 0
+    self.current: Optional[ActiveAlert] = None
     self.clear_current_alert()
 
   def clear_current_alert(self) -> None:
@@ -43,16 +71,63 @@ class AlertManager:
     self.audible_alert = car.CarControl.HUDControl.AudibleAlert.none
     self.alert_rate: float = 0.
 
-  def add_many(self, frame: int, alerts: List[Alert], enabled: bool = True) -> None:
-    for alert in alerts:
-      added_alert = copy.copy(alert)
-      added_alert.start_time = frame * DT_CTRL
+  def _add(self, alert: Alert, alert_type: str, event_type: Optional[str], frame: int, enabled: bool,
+           alert_text_1: str, alert_text_2: str) -> None:
+    self.seq += 1
+    start_time = frame * DT_CTRL
 
-      # if new alert is higher priority, log it
-      if not len(self.activealerts) or added_alert.alert_priority > self.activealerts[0].alert_priority:
-        cloudlog.event('alert_add', alert_type=added_alert.alert_type, enabled=enabled)
+    # if new alert is higher priority, log it
+    if self.current is None or alert.alert_priority > self.current.alert.alert_priority:
+      cloudlog.event('alert_add', alert_type=alert_type, enabled=enabled)
+
+    entry = self.alerts.get(alert_type)
+    if entry is None:
+      entry = ActiveAlert(alert, alert_type, event_type, start_time, alert_text_1, alert_text_2, self.seq)
+      self.alerts[alert_type] = entry
+    else:
+      # still active, only its times move on and it goes behind the alerts added before it
+      del self.order[entry.alert.alert_priority][alert_type]
+      if entry.event_type != event_type:
+        self.event_types[entry.event_type].discard(alert_type)
+      entry.update(alert, event_type, start_time, alert_text_1, alert_text_2, self.seq)
+    self.event_types.setdefault(event_type, set()).add(alert_type)
+    self.order.setdefault(alert.alert_priority, OrderedDict())[alert_type] = entry
+    if self.current is None:
+      self.current = entry
+
+    heapq.heappush(self.expiry, (entry.end_time, entry.seq, alert_type))
+    if len(self.expiry) > 2 * len(self.alerts) + 64:
+      self._compact()
+
+  def _remove(self, alert_type: str) -> None:
+    entry = self.alerts.pop(alert_type)
+    self.event_types[entry.event_type].discard(alert_type)
+    del self.order[entry.alert.alert_priority][alert_type]
+
+  def _is_current(self, seq: int, alert_type: str) -> bool:
+    entry = self.alerts.get(alert_type)
+    return entry is not None and entry.seq == seq
+
+  def _compact(self) -> None:
+    # drop the stale heap entries left by re-added and removed alerts
+    self.expiry = [(e.end_time, e.seq, e.alert_type) for e in self.alerts.values()]
+    heapq.heapify(self.expiry)
+
+  def _highest(self) -> Optional[ActiveAlert]:
+    # highest priority first and then latest start_time, the first added at that time
+    for priority in sorted(self.order, reverse=True):
+      highest = None
+      for entry in reversed(self.order[priority].values()):
+        if highest is not None and entry.start_time < highest.start_time:
+          break
+        highest = entry
+      if highest is not None:
+        return highest
+    return None
 
-      self.activealerts.append(added_alert)
+  def add_many(self, frame: int, alerts: List[Alert], enabled: bool = True) -> None:
+    for alert in alerts:
+      self._add(alert, alert.alert_type, alert.event_type, frame, enabled, alert.alert_text_1, alert.alert_text_2)
 
   def SA_set_frame(self, frame):
     self.SA_frame = frame
@@ -62,46 +137,42 @@ class AlertManager:
 
   def SA_add(self, alert_name, extra_text_1='', extra_text_2=''):
     alert = EVENTS[alert_name][ET.PERMANENT]  # assume permanent (to display in all states)
-    added_alert = copy.copy(alert)
-    added_alert.start_time = self.SA_frame * DT_CTRL
-    added_alert.alert_text_1 += extra_text_1
-    added_alert.alert_text_2 += extra_text_2
-    added_alert.alert_type = f"{alert_name}/{ET.PERMANENT}"  # fixes alerts being silent
-    added_alert.event_type = ET.PERMANENT
-
-    # if new alert is higher priority, log it
-    if not len(self.activealerts) or added_alert.alert_priority > self.activealerts[0].alert_priority:
-      cloudlog.event('alert_add', alert_type=added_alert.alert_type, enabled=self.SA_enabled)
-
-    self.activealerts.append(added_alert)
+    # alert_type fixes alerts being silent
+    self._add(alert, f"{alert_name}/{ET.PERMANENT}", ET.PERMANENT, self.SA_frame, self.SA_enabled,
+              alert.alert_text_1 + extra_text_1, alert.alert_text_2 + extra_text_2)
 
   def process_alerts(self, frame: int, clear_event_type=None) -> None:
     cur_time = frame * DT_CTRL
 
     # first get rid of all the expired alerts
-    self.activealerts = [a for a in self.activealerts if a.event_type != clear_event_type and
-                         a.start_time + max(a.duration_sound, a.duration_hud_alert, a.duration_text) > cur_time]
+    if clear_event_type in self.event_types:
+      for alert_type in list(self.event_types[clear_event_type]):
+        self._remove(alert_type)
+    while len(self.expiry) and self.expiry[0][0] <= cur_time:
+      _, seq, alert_type = heapq.heappop(self.expiry)
+      if self._is_current(seq, alert_type):
+        self._remove(alert_type)
 
-    # sort by priority first and then by start_time
-    self.activealerts.sort(key=lambda k: (k.alert_priority, k.start_time), reverse=True)
+    self.current = self._highest()
 
     # start with assuming no alerts
     self.clear_current_alert()
 
-    if len(self.activealerts):
-      current_alert = self.activealerts[0]
+    if self.current is not None:
+      current_alert = self.current.alert
+      start_time = self.current.start_time
 
-      self.alert_type = current_alert.alert_type
+      self.alert_type = self.current.alert_type
 
-      if current_alert.start_time + current_alert.duration_sound > cur_time:
+      if start_time + current_alert.duration_sound > cur_time:
         self.audible_alert = current_alert.audible_alert
 
-      if current_alert.start_time + current_alert.duration_hud_alert > cur_time:
+      if start_time + current_alert.duration_hud_alert > cur_time:
         self.visual_alert = current_alert.visual_alert
 
-      if current_alert.start_time + current_alert.duration_text > cur_time:
-        self.alert_text_1 = current_alert.alert_text_1
-        self.alert_text_2 = current_alert.alert_text_2
+      if start_time + current_alert.duration_text > cur_time:
+        self.alert_text_1 = self.current.alert_text_1
+        self.alert_text_2 = self.current.alert_text_2
         self.alert_status = current_alert.alert_status
         self.alert_size = current_alert.alert_size
         self.alert_rate = current_alert.alert_rate
@@ -20,6 +20,9 @@ hclust = ffi.dlopen(cluster_fn)
 
 def cluster_points_centroid(pts, dist):
   pts = np.ascontiguousarray(pts, dtype=np.float64)
+  if len(pts) <= 1:  # hclust hangs forever with a single point
+    return [0] * len(pts)
+
   pts_ptr = ffi.cast("double *", pts.ctypes.data)
   n, m = pts.shape
 
@@ -73,6 +73,7 @@ class DynamicFollow:
     self.predict_rate = 1 / 4.
     self.skip_every = round(0.25 / mpc_rate)
     self.model_input_len = round(45 / mpc_rate)
+    self.model_features = 4
 
     # Dynamic follow variables
     self.default_TR = 1.8
@@ -91,7 +92,8 @@ class DynamicFollow:
     self.log_auto_df = self.op_params.get('log_auto_df')
     if not isinstance(self.log_auto_df, bool):
       self.log_auto_df = False
-    self.data_collector = DataCollector(file_path='/data/df_data', keys=['v_ego', 'a_ego', 'a_lead', 'v_lead', 'x_lead', 'left_lane_speeds', 'middle_lane_speeds', 'right_lane_speeds', 'left_lane_distances', 'middle_lane_distances', 'right_lane_distances', 'profile', 'time'], log_data=self.log_auto_df)
+    self.data_collector = DataCollector(file_path='/data/df_data', keys=['v_ego', 'a_ego', 'a_lead', 'v_lead', 'x_lead', 'left_lane_speeds', 'middle_lane_speeds', 'right_lane_speeds', 'left_lane_distances', 'middle_lane_distances', 'right_lane_distances', 'profile', 'time'],
+                                        column_types=['f8'] * 5 + ['list'] * 6 + ['f8'] * 2, log_data=self.log_auto_df)
 
   def _setup_changing_variables(self):
     self.TR = self.default_TR
@@ -104,17 +106,22 @@ class DynamicFollow:
     self.sng = False
     self.car_data = CarData()
     self.lead_data = LeadData()
-    self.df_data = dfData()  # dynamic follow data
+    self.df_data = dfData(self.v_ego_retention, self.v_rel_retention)  # dynamic follow data
 
     self.last_cost = 0.0
     self.last_predict_time = 0.0
-    self.auto_df_model_data = []
+    # Ring buffer of model features, each sample is written twice so the last model_input_len samples are always
+    # a contiguous slice of the buffer: auto_df_model_data[idx:idx + model_input_len]
+    self.auto_df_model_data = np.zeros((self.model_input_len * 2, self.model_features), dtype=np.float32)
+    self.auto_df_model_idx = 0
+    self.auto_df_model_samples = 0
     self._get_live_params()  # so they're defined just in case
 
-  def update(self, CS, libmpc):
+  def update(self, CS, libmpc, model_profile=None):
+    """model_profile is the profile predicted by mpc1's DynamicFollow, only mpc1 runs the model"""
     self._get_live_params()
     self._update_car(CS)
-    self._get_profiles()
+    self._get_profiles(model_profile)
 
     if self.mpc_id == 1 and self.log_auto_df:
       self._gather_data()
@@ -131,12 +138,12 @@ class DynamicFollow:
 
     return self.TR
 
-  def _get_profiles(self):
+  def _get_profiles(self, model_profile):
     """This receives profile change updates from dfManager and runs the auto-df prediction if auto mode"""
     df_out = self.df_manager.update()
     self.user_profile = df_out.user_profile
-    if df_out.is_auto:  # todo: find some way to share prediction between the two mpcs to reduce processing overhead
-      self._get_pred()  # sets self.model_profile, all other checks are inside function
+    if df_out.is_auto:
+      self._get_pred(model_profile)  # sets self.model_profile, all other checks are inside function
 
   def _gather_data(self):
     self.sm_collector.update(0)
@@ -191,36 +198,38 @@ class DynamicFollow:
     # Store custom relative accel over time
     if self.lead_data.status:
       if self.lead_data.new_lead:
-        self.df_data.v_rels = []  # reset when new lead
-      else:
-        self.df_data.v_rels = self._remove_old_entries(self.df_data.v_rels, cur_time, self.v_rel_retention)
-      self.df_data.v_rels.append({'v_ego': self.car_data.v_ego, 'v_lead': self.lead_data.v_lead, 'time': cur_time})
+        self.df_data.v_rels.reset()  # reset when new lead
+      self.df_data.v_rels.append(cur_time, self.car_data.v_ego, self.lead_data.v_lead)  # evicts old entries
 
     # Store our velocity for better sng
-    self.df_data.v_egos = self._remove_old_entries(self.df_data.v_egos, cur_time, self.v_ego_retention)
-    self.df_data.v_egos.append({'v_ego': self.car_data.v_ego, 'time': cur_time})
-
-    # Store data for auto-df model
-    self.auto_df_model_data.append([self._norm(self.car_data.v_ego, 'v_ego'),
-                                    self._norm(self.lead_data.v_lead, 'v_lead'),
-                                    self._norm(self.lead_data.a_lead, 'a_lead'),
-                                    self._norm(self.lead_data.x_lead, 'x_lead')])
-    while len(self.auto_df_model_data) > self.model_input_len:
-      del self.auto_df_model_data[0]
-
-  def _get_pred(self):
+    self.df_data.v_egos.append(cur_time, self.car_data.v_ego)
+
+    # Store data for auto-df model, only mpc1 predicts
+    if self.mpc_id == 1:
+      sample = (self._norm(self.car_data.v_ego, 'v_ego'),
+                self._norm(self.lead_data.v_lead, 'v_lead'),
+                self._norm(self.lead_data.a_lead, 'a_lead'),
+                self._norm(self.lead_data.x_lead, 'x_lead'))
+      self.auto_df_model_data[self.auto_df_model_idx] = sample
+      self.auto_df_model_data[self.auto_df_model_idx + self.model_input_len] = sample
+      self.auto_df_model_idx = (self.auto_df_model_idx + 1) % self.model_input_len
+      self.auto_df_model_samples = min(self.auto_df_model_samples + 1, self.model_input_len)
+
+  def _get_pred(self, model_profile):
+    if self.mpc_id != 1:
+      if model_profile is not None:
+        self.model_profile = model_profile
+      return
+
     cur_time = sec_since_boot()
     if self.car_data.cruise_enabled and self.lead_data.status:
       if cur_time - self.last_predict_time > self.predict_rate:
-        if len(self.auto_df_model_data) == self.model_input_len:
-          pred = predict(np.array(self.auto_df_model_data[::self.skip_every], dtype=np.float32).flatten())
+        if self.auto_df_model_samples == self.model_input_len:
+          window = self.auto_df_model_data[self.auto_df_model_idx:self.auto_df_model_idx + self.model_input_len]
+          pred = predict(window[::self.skip_every].reshape(-1))  # oldest to newest, same as the training data
           self.last_predict_time = cur_time
           self.model_profile = int(np.argmax(pred))
 
-  @staticmethod
-  def _remove_old_entries(lst, cur_time, retention):
-    return [sample for sample in lst if cur_time - sample['time'] <= retention]
-
   def _relative_accel_mod(self):
     """
     Returns relative acceleration mod calculated from list of lead and ego velocities over time (longer than 1s)
@@ -229,11 +238,12 @@ class DynamicFollow:
     a_ego = self.car_data.a_ego
     a_lead = self.lead_data.a_lead
     min_consider_time = 0.75  # minimum amount of time required to consider calculation
-    if len(self.df_data.v_rels) > 0:  # if not empty
-      elapsed_time = self.df_data.v_rels[-1]['time'] - self.df_data.v_rels[0]['time']
+    v_rels = self.df_data.v_rels
+    if len(v_rels) > 0:  # if not empty
+      elapsed_time = v_rels.last_time() - v_rels.first_time()
       if elapsed_time > min_consider_time:
-        a_ego = (self.df_data.v_rels[-1]['v_ego'] - self.df_data.v_rels[0]['v_ego']) / elapsed_time
-        a_lead = (self.df_data.v_rels[-1]['v_lead'] - self.df_data.v_rels[0]['v_lead']) / elapsed_time
+        a_ego = (v_rels.last('v_ego') - v_rels.first('v_ego')) / elapsed_time
+        a_lead = (v_rels.last('v_lead') - v_rels.first('v_lead')) / elapsed_time
 
     mods_x = [-1.5, -.75, 0]
     mods_y = [1, 1.25, 1.3]
@@ -297,7 +307,7 @@ class DynamicFollow:
     if self.car_data.v_ego > self.sng_speed:  # keep sng distance until we're above sng speed again
       self.sng = False
 
-    if (self.car_data.v_ego >= self.sng_speed or self.df_data.v_egos[0]['v_ego'] >= self.car_data.v_ego) and not self.sng:
+    if (self.car_data.v_ego >= self.sng_speed or self.df_data.v_egos.first('v_ego') >= self.car_data.v_ego) and not self.sng:
       # if above 15 mph OR we're decelerating to a stop, keep shorter TR. when we reaccelerate, use sng_TR and slowly decrease
       TR = interp(self.car_data.v_ego, x_vel, y_dist)
     else:  # this allows us to get closer to the lead car when stopping, while being able to have smooth stop and go when reaccelerating
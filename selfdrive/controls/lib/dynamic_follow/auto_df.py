@@ -2,10 +2,15 @@
   Generated using Konverter: https://github.com/ShaneSmiskol/Konverter
 """
 
+import os
 import numpy as np
 
-wb = np.load('/data/openpilot/selfdrive/controls/lib/dynamic_follow/auto_df_weights.npz', allow_pickle=True)
+wb = np.load(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'auto_df_weights.npz'), allow_pickle=True)
 w, b = wb['wb']
+w = [np.ascontiguousarray(wi, dtype=np.float32) for wi in w]
+b = [np.asarray(bi, dtype=np.float32) for bi in b]
+
+_batch_buffers = []  # preallocated layer outputs for the largest batch so far, smaller batches use a slice
 
 def softmax(x):
   return np.exp(x) / np.sum(np.exp(x), axis=0)
@@ -18,3 +23,31 @@ def predict(x):
   l2 = np.dot(l1, w[2]) + b[2]
   l2 = softmax(l2)
   return l2
+
+def _get_batch_buffers(n):
+  global _batch_buffers
+  if not _batch_buffers or len(_batch_buffers[0]) < n:
+    _batch_buffers = [np.empty((n, wi.shape[1]), dtype=np.float32) for wi in w] + [np.empty((n, 1), dtype=np.float32)]
+  return [buf[:n] for buf in _batch_buffers]  # leading rows of a C-contiguous array are contiguous, so out= accepts them
+
+def predict_batch(x):
+  """
+    Predicts an (N, 720) float32 batch, returns (N, 3) probabilities
+    The output is a view of a preallocated buffer reused by the next call, copy it to keep it
+  """
+  x = np.asarray(x, dtype=np.float32)
+  l0, l1, l2, l2_sum = _get_batch_buffers(len(x))
+  np.dot(x, w[0], out=l0)
+  l0 += b[0]
+  np.maximum(l0, 0, out=l0)
+  np.dot(l0, w[1], out=l1)
+  l1 += b[1]
+  np.maximum(l1, 0, out=l1)
+  np.dot(l1, w[2], out=l2)
+  l2 += b[2]
+  np.max(l2, axis=1, keepdims=True, out=l2_sum)
+  l2 -= l2_sum  # softmax is shift invariant, this avoids overflow in exp
+  np.exp(l2, out=l2)
+  np.sum(l2, axis=1, keepdims=True, out=l2_sum)
+  l2 /= l2_sum
+  return l2
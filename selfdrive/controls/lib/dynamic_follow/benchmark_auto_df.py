@@ -1,14 +1,58 @@
-from selfdrive.controls.lib.dynamic_follow.auto_df import predict
+#!/usr/bin/env python3
+import argparse
 import time
+import tracemalloc
 import numpy as np
 
-samples = np.random.rand(2000, 720).astype(np.float32)
+from selfdrive.controls.lib.dynamic_follow.auto_df import predict, predict_batch
 
-t = time.time()
-for sample in samples:
-  predict(sample)
+MODEL_INPUT_SIZE = 720
 
-print('Total time: {} s'.format(time.time() - t))
-print('Seconds per prediction: {} s'.format((time.time() - t) / len(samples)))
-print('Rate: {} Hz'.format(len(samples) / (time.time() - t)))
-print(predict(samples[0]).dtype)
+
+def alloc_peak(fn, *args):
+  """Peak bytes allocated while calling fn, numpy reports its buffers to tracemalloc"""
+  fn(*args)  # warm up, so preallocated buffers aren't counted
+  tracemalloc.start()
+  fn(*args)
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+  return peak
+
+
+def time_calls(fn, inputs):
+  latencies = np.empty(len(inputs))
+  for i, x in enumerate(inputs):
+    t = time.perf_counter()
+    fn(x)
+    latencies[i] = time.perf_counter() - t
+  return latencies
+
+
+def report(name, latencies, samples_per_call, peak_bytes):
+  total = latencies.sum()
+  print('{}:'.format(name))
+  print('  p50: {:.1f} us, p99: {:.1f} us per call'.format(np.percentile(latencies, 50) * 1e6, np.percentile(latencies, 99) * 1e6))
+  print('  throughput: {:.0f} samples/s'.format(len(latencies) * samples_per_call / total))
+  print('  allocated: {:.1f} KiB peak per call'.format(peak_bytes / 1024))
+
+
+def benchmark(samples, batch_size):
+  report('predict', time_calls(predict, samples), 1, alloc_peak(predict, samples[0]))
+
+  n_batches = len(samples) // batch_size
+  batches = samples[:n_batches * batch_size].reshape(n_batches, batch_size, MODEL_INPUT_SIZE)
+  report('predict_batch (N={})'.format(batch_size), time_calls(predict_batch, batches), batch_size, alloc_peak(predict_batch, batches[0]))
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Benchmark the auto-df model')
+  parser.add_argument('--data', help='.npy file of (N, 720) model inputs, like those replayed from a logged drive. Random if not set')
+  parser.add_argument('--samples', type=int, default=2000, help='number of random samples')
+  parser.add_argument('--batch-size', type=int, default=100)
+  args = parser.parse_args()
+
+  if args.data is not None:
+    data = np.load(args.data).astype(np.float32).reshape(-1, MODEL_INPUT_SIZE)
+  else:
+    data = np.random.rand(args.samples, MODEL_INPUT_SIZE).astype(np.float32)
+  benchmark(data, min(args.batch_size, len(data)))
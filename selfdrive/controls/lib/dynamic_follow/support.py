@@ -1,3 +1,6 @@
+from common.time_series import TimeSeries
+
+
 class LeadData:
   v_lead = None
   x_lead = None
@@ -16,8 +19,10 @@ class CarData:
 
 
 class dfData:
-  v_egos = []
-  v_rels = []
+  def __init__(self, v_ego_retention, v_rel_retention, rate=20.):
+    margin = 2  # timing jitter can fit an extra sample within the retention window
+    self.v_egos = TimeSeries(['v_ego'], v_ego_retention, round(v_ego_retention * rate) + margin)
+    self.v_rels = TimeSeries(['v_ego', 'v_lead'], v_rel_retention, round(v_rel_retention * rate) + margin)
 
 
 class dfProfiles:
@@ -1,3 +1,4 @@
+from array import array
 from enum import IntEnum
 from typing import Dict, Union, Callable, Any
 
@@ -35,13 +36,22 @@ class ET:
 
 # get event name from enum
 EVENT_NAME = {v: k for k, v in EventName.schema.enumerants.items()}
+EVENT_NAME_COUNT = max(EVENT_NAME) + 1
 
 
 class Events:
+  """
+    Active events of a frame. Besides the ordered list of names, the active events are kept as a bitset of their
+    enum values, so checking for an event type is a single AND against that type's mask
+  """
   def __init__(self):
     self.events = []
     self.static_events = []
-    self.events_prev = dict.fromkeys(EVENTS.keys(), 0)
+    self.mask = 0
+    self.static_mask = 0
+    # number of consecutive frames each event was active for, indexed by enum value
+    self.events_prev = array('Q', bytes(8 * EVENT_NAME_COUNT))
+    self.counted = set()
 
   @property
   def names(self):
@@ -53,23 +63,33 @@ class Events:
   def add(self, event_name, static=False):
     if static:
       self.static_events.append(event_name)
+      self.static_mask |= 1 << event_name
     self.events.append(event_name)
+    self.mask |= 1 << event_name
 
   def clear(self):
-    self.events_prev = {k: (v+1 if k in self.events else 0) for k, v in self.events_prev.items()}
+    # only events active last frame can have a count to reset
+    for e in self.counted:
+      if not self.mask >> e & 1:
+        self.events_prev[e] = 0
+    self.counted = set(self.events)
+    for e in self.counted:
+      self.events_prev[e] += 1
+
     self.events = self.static_events.copy()
+    self.mask = self.static_mask
 
   def any(self, event_type):
-    for e in self.events:
-      if event_type in EVENTS.get(e, {}).keys():
-        return True
-    return False
+    return self.mask & EVENT_TYPE_MASKS.get(event_type, 0) != 0
 
   def create_alerts(self, event_types, callback_args=None):
     if callback_args is None:
       callback_args = []
 
     ret = []
+    if not any(self.mask & EVENT_TYPE_MASKS.get(et, 0) for et in event_types):
+      return ret
+
     for e in self.events:
       types = EVENTS[e].keys()
       for et in event_types:
@@ -86,17 +106,10 @@ class Events:
 
   def add_from_msg(self, events):
     for e in events:
-      self.events.append(e.name.raw)
+      self.add(e.name.raw)
 
   def to_msg(self):
-    ret = []
-    for event_name in self.events:
-      event = car.CarEvent.new_message()
-      event.name = event_name
-      for event_type in EVENTS.get(event_name, {}).keys():
-        setattr(event, event_type , True)
-      ret.append(event)
-    return ret
+    return [get_car_event(event_name) for event_name in self.events]
 
 class Alert:
   def __init__(self,
@@ -815,3 +828,24 @@ EVENTS: Dict[int, Dict[str, Union[Alert, Callable[[Any, messaging.SubMaster, boo
   },
 
 }
+
+# bitmask of the events that have each event type, the custom alerts keyed by name are only raised through AlertManager
+EVENT_TYPE_MASKS: Dict[str, int] = {}
+for _event_name, _event_types in EVENTS.items():
+  if isinstance(_event_name, int):
+    for _event_type in _event_types:
+      EVENT_TYPE_MASKS[_event_type] = EVENT_TYPE_MASKS.get(_event_type, 0) | 1 << _event_name
+
+# a CarEvent only depends on its name, so each one is built once and shared as a reader
+CAR_EVENTS: Dict[int, Any] = {}
+
+
+def get_car_event(event_name):
+  event = CAR_EVENTS.get(event_name)
+  if event is None:
+    builder = car.CarEvent.new_message()
+    builder.name = event_name
+    for event_type in EVENTS.get(event_name, {}).keys():
+      setattr(builder, event_type, True)
+    event = CAR_EVENTS[event_name] = builder.as_reader()
+  return event
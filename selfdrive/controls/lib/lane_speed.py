@@ -1,7 +1,6 @@
 from common.op_params import opParams
 from common.realtime import set_core_affinity
 from selfdrive.config import Conversions as CV
-from selfdrive.controls.lib.lane_planner import eval_poly
 from common.numpy_fast import interp
 import numpy as np
 import time
@@ -41,8 +40,9 @@ class Lane:
     self.name = name
     self.pos = pos
     self.bounds = []
-    self.tracks = []
-    self.oncoming_tracks = []
+    self.speeds = np.empty(0)  # absolute speeds of ongoing tracks in this lane
+    self.distances = np.empty(0)
+    self.n_oncoming = 0
 
     self.avg_speed = None
     self.fastest_count = 0
@@ -53,6 +53,7 @@ class Lane:
 
 
 LANE_SPEED_RATE = 1 / 5.
+LANE_IDXS = {'right': 1, 'middle': 2, 'left': 3}  # np.digitize bins of the lane bounds
 
 class LaneSpeed:
   def __init__(self):
@@ -103,7 +104,7 @@ class LaneSpeed:
       self.v_ego = self.sm['carState'].vEgo
       self.steer_angle = self.sm['carState'].steeringAngle
       self.d_poly = np.array(list(self.sm['pathPlan'].dPoly))
-      self.live_tracks = self.sm['liveTracks']
+      self.live_tracks = np.array([(trk.dRel, trk.yRel, trk.vRel) for trk in self.sm['liveTracks']]).reshape(-1, 3)
 
       self.update_lane_bounds()
       self.update()
@@ -154,35 +155,28 @@ class LaneSpeed:
 
   def group_tracks(self):
     """Groups tracks based on lateral position, dPoly offset, and lane width"""
-    offset_y_rels = [trk.yRel - eval_poly(self.d_poly, trk.dRel) for trk in self.live_tracks]  # eval_poly: 4109.0476 Hz vs np.polyval's 2483.2956 Hz
-    for track, offset_y_rel in zip(self.live_tracks, offset_y_rels):
-      # it's not pretty, but this code is the fastest. even when looping through tracks and then lanes for each track
-      # (and breaking when a lane has been found for the track)
-      # this is also faster than having the speed if check first
-      track_vel = track.vRel + self.v_ego
-      if self.lanes['left'].bounds[0] >= offset_y_rel >= self.lanes['left'].bounds[1]:
-        if track_vel >= self._min_track_speed:  # ongoing track
-          self.lanes['left'].tracks.append(track)
-        elif track_vel <= -self._min_track_speed:  # oncoming track
-          self.lanes['left'].oncoming_tracks.append(track)
-
-      elif self.lanes['middle'].bounds[0] >= offset_y_rel >= self.lanes['middle'].bounds[1]:
-        if track_vel >= self._min_track_speed:
-          self.lanes['middle'].tracks.append(track)
-        elif track_vel <= -self._min_track_speed:
-          self.lanes['middle'].oncoming_tracks.append(track)
-
-      elif self.lanes['right'].bounds[0] >= offset_y_rel >= self.lanes['right'].bounds[1]:
-        if track_vel >= self._min_track_speed:
-          self.lanes['right'].tracks.append(track)
-        elif track_vel <= -self._min_track_speed:
-          self.lanes['right'].oncoming_tracks.append(track)
+    d_rels, y_rels, v_rels = self.live_tracks.T
+    offset_y_rels = y_rels - np.polyval(self.d_poly, d_rels)
+    track_vels = v_rels + self.v_ego
+
+    # bins are right, middle and left lane (0 and 4 are outside). a track on a bound between two lanes goes to the left one
+    edges = [self.lanes['right'].bounds[1], self.lanes['middle'].bounds[1], self.lanes['middle'].bounds[0], self.lanes['left'].bounds[0]]
+    lane_idxs = np.digitize(offset_y_rels, edges)
+    lane_idxs[offset_y_rels == edges[-1]] = LANE_IDXS['left']
+
+    ongoing = track_vels >= self._min_track_speed
+    oncoming = track_vels <= -self._min_track_speed
+    for name, lane in self.lanes.items():
+      in_lane = lane_idxs == LANE_IDXS[name]
+      lane.speeds = track_vels[in_lane & ongoing]
+      lane.distances = d_rels[in_lane & ongoing]
+      lane.n_oncoming = int(np.count_nonzero(in_lane & oncoming))
 
   def find_oncoming_lanes(self):
     """If number of oncoming tracks is greater than tracks going our direction, set lane to oncoming"""
     for lane in self.oncoming_lanes:
       self.oncoming_lanes[lane] = False
-      if len(self.lanes[lane].oncoming_tracks) > len(self.lanes[lane].tracks):  # 0 can't be > 0 so 0 oncoming tracks will be handled correctly
+      if self.lanes[lane].n_oncoming > len(self.lanes[lane].speeds):  # 0 can't be > 0 so 0 oncoming tracks will be handled correctly
         self.oncoming_lanes[lane] = True
 
   def lanes_with_avg_speeds(self):
@@ -195,13 +189,10 @@ class LaneSpeed:
       return
 
     v_cruise_setpoint = self.sm['controlsState'].vCruise * CV.KPH_TO_MS
-    for lane_name in self.lanes:
-      lane = self.lanes[lane_name]
-      track_speeds = [track.vRel + self.v_ego for track in lane.tracks]
-      track_speeds = [speed for speed in track_speeds if self.v_ego * self._track_speed_margin < speed <= v_cruise_setpoint]
+    for lane in self.lanes.values():
+      track_speeds = lane.speeds[(lane.speeds > self.v_ego * self._track_speed_margin) & (lane.speeds <= v_cruise_setpoint)]
       if len(track_speeds):  # filters out very slow tracks
-        # np.mean was much slower than sum() / len()
-        lane.avg_speed = sum(track_speeds) / len(track_speeds)  # todo: something with std?
+        lane.avg_speed = float(track_speeds.mean())  # todo: something with std?
 
     lanes_with_avg_speeds = self.lanes_with_avg_speeds()
     if 'middle' not in lanes_with_avg_speeds or len(lanes_with_avg_speeds) < 2:
@@ -223,7 +214,7 @@ class LaneSpeed:
 
     _f_time_x = [1, 4, 12]  # change the minimum time for fastest based on how many tracks are in fastest lane
     _f_time_y = [1.5, 1, 0.5]  # this is multiplied by base fastest time todo: probably need to tune this
-    min_fastest_time = interp(len(fastest_lane.tracks), _f_time_x, _f_time_y)  # get multiplier
+    min_fastest_time = interp(len(fastest_lane.speeds), _f_time_x, _f_time_y)  # get multiplier
     min_fastest_time = int(min_fastest_time * self._min_fastest_time)  # now get final min_fastest_time
 
     if fastest_lane.fastest_count < min_fastest_time:
@@ -261,13 +252,13 @@ class LaneSpeed:
     ls_send.laneSpeed.fastestLane = fastest_lane
     ls_send.laneSpeed.new = new_fastest  # only send audible alert once when a lane becomes fastest, then continue to show silent alert
 
-    ls_send.laneSpeed.leftLaneSpeeds = [trk.vRel + self.v_ego for trk in self.lanes['left'].tracks]
-    ls_send.laneSpeed.middleLaneSpeeds = [trk.vRel + self.v_ego for trk in self.lanes['middle'].tracks]
-    ls_send.laneSpeed.rightLaneSpeeds = [trk.vRel + self.v_ego for trk in self.lanes['right'].tracks]
+    ls_send.laneSpeed.leftLaneSpeeds = self.lanes['left'].speeds.tolist()
+    ls_send.laneSpeed.middleLaneSpeeds = self.lanes['middle'].speeds.tolist()
+    ls_send.laneSpeed.rightLaneSpeeds = self.lanes['right'].speeds.tolist()
 
-    ls_send.laneSpeed.leftLaneDistances = [trk.dRel for trk in self.lanes['left'].tracks]
-    ls_send.laneSpeed.middleLaneDistances = [trk.dRel for trk in self.lanes['middle'].tracks]
-    ls_send.laneSpeed.rightLaneDistances = [trk.dRel for trk in self.lanes['right'].tracks]
+    ls_send.laneSpeed.leftLaneDistances = self.lanes['left'].distances.tolist()
+    ls_send.laneSpeed.middleLaneDistances = self.lanes['middle'].distances.tolist()
+    ls_send.laneSpeed.rightLaneDistances = self.lanes['right'].distances.tolist()
 
     ls_send.laneSpeed.leftLaneOncoming = self.oncoming_lanes['left']
     ls_send.laneSpeed.rightLaneOncoming = self.oncoming_lanes['right']
@@ -293,8 +284,9 @@ class LaneSpeed:
   def reset(self, reset_tracks=False, reset_fastest=False, reset_avg_speed=False):
     for lane in self.lanes:
       if reset_tracks:
-        self.lanes[lane].tracks = []
-        self.lanes[lane].oncoming_tracks = []
+        self.lanes[lane].speeds = np.empty(0)
+        self.lanes[lane].distances = np.empty(0)
+        self.lanes[lane].n_oncoming = 0
 
       if reset_avg_speed:
         self.lanes[lane].avg_speed = None
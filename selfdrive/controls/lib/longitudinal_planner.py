@@ -231,7 +231,7 @@ class Planner():
     self.mpc_model.set_cur_state(self.v_acc_start, self.a_acc_start)
 
     self.mpc1.update(sm['carState'], lead_1)
-    self.mpc2.update(sm['carState'], lead_2)
+    self.mpc2.update(sm['carState'], lead_2, model_profile=self.mpc1.dynamic_follow.model_profile)  # only mpc1 predicts
 
     distances, speeds, accelerations = self.model_mpc_helper.convert_data(sm)
     self.mpc_model.update(sm['carState'].vEgo, sm['carState'].aEgo,
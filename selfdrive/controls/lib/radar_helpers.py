@@ -1,5 +1,4 @@
-from common.numpy_fast import mean
-from common.kalman.simple_kalman import KF1D
+import numpy as np
 from selfdrive.config import RADAR_TO_CAMERA
 
 
@@ -7,113 +6,140 @@ from selfdrive.config import RADAR_TO_CAMERA
 # TODO is this a good default?
 _LEAD_ACCEL_TAU = 1.5
 
-# radar tracks
-SPEED, ACCEL = 0, 1   # Kalman filter states enum
-
 # stationary qualification parameters
 v_ego_stationary = 4.   # no stationary object flag below this speed
 
 
-class Track():
-  def __init__(self, v_lead, kalman_params):
-    self.cnt = 0
-    self.aLeadTau = _LEAD_ACCEL_TAU
-    self.K_A = kalman_params.A
-    self.K_C = kalman_params.C
-    self.K_K = kalman_params.K
-    self.kf = KF1D([[v_lead], [0.0]], self.K_A, self.K_C, self.K_K)
-
-  def update(self, d_rel, y_rel, v_rel, v_lead, measured):
-    # relative values, copy
-    self.dRel = d_rel   # LONG_DIST
-    self.yRel = y_rel   # -LAT_DIST
-    self.vRel = v_rel   # REL_SPEED
-    self.vLead = v_lead
-    self.measured = measured   # measured or estimate
-
-    # computed velocity and accelerations
-    if self.cnt > 0:
-      self.kf.update(self.vLead)
-
-    self.vLeadK = float(self.kf.x[SPEED][0])
-    self.aLeadK = float(self.kf.x[ACCEL][0])
+class Tracks():
+  """Radar tracks as a struct of arrays sorted by trackId, the lead Kalman filters of all tracks are updated at once"""
+  def __init__(self, kalman_params):
+    A, C, K = kalman_params.A, kalman_params.C, kalman_params.K
+    # same constant gain filter as KF1D: x = (A - K C) x + K meas
+    self.A_K = [[A[0][0] - K[0][0] * C[0], A[0][1] - K[0][0] * C[1]],
+                [A[1][0] - K[1][0] * C[0], A[1][1] - K[1][0] * C[1]]]
+    self.K = [K[0][0], K[1][0]]
+
+    self.ids = np.zeros(0, dtype=np.int64)
+    self.dRel = np.zeros(0)   # LONG_DIST
+    self.yRel = np.zeros(0)   # -LAT_DIST
+    self.vRel = np.zeros(0)   # REL_SPEED
+    self.vLead = np.zeros(0)
+    self.measured = np.zeros(0, dtype=bool)   # measured or estimate
+    self.vLeadK = np.zeros(0)   # Kalman filter state
+    self.aLeadK = np.zeros(0)
+    self.aLeadTau = np.zeros(0)
+    self.cnt = np.zeros(0, dtype=np.int64)
+
+  def __len__(self):
+    return len(self.ids)
+
+  def update(self, ids, d_rel, y_rel, v_rel, v_lead, measured):
+    # ids must be sorted and unique, tracks not in ids are dropped
+    prev = np.searchsorted(self.ids, ids)
+    prev = np.minimum(prev, len(self.ids) - 1)
+    existing = self.ids[prev] == ids if len(self.ids) else np.zeros(len(ids), dtype=bool)
+    prev = prev[existing]
+
+    self.ids = ids
+    self.dRel, self.yRel, self.vRel, self.vLead, self.measured = d_rel, y_rel, v_rel, v_lead, measured
+
+    x0, x1 = v_lead.copy(), np.zeros(len(ids))  # new tracks start at the measured speed
+    x0[existing] = self.A_K[0][0] * self.vLeadK[prev] + self.A_K[0][1] * self.aLeadK[prev] + self.K[0] * v_lead[existing]
+    x1[existing] = self.A_K[1][0] * self.vLeadK[prev] + self.A_K[1][1] * self.aLeadK[prev] + self.K[1] * v_lead[existing]
+    self.vLeadK, self.aLeadK = x0, x1
+
+    a_lead_tau = np.full(len(ids), _LEAD_ACCEL_TAU)
+    a_lead_tau[existing] = self.aLeadTau[prev]
+    cnt = np.zeros(len(ids), dtype=np.int64)
+    cnt[existing] = self.cnt[prev]
 
     # Learn if constant acceleration
-    if abs(self.aLeadK) < 0.5:
-      self.aLeadTau = _LEAD_ACCEL_TAU
-    else:
-      self.aLeadTau *= 0.9
+    self.aLeadTau = np.where(np.abs(self.aLeadK) < 0.5, _LEAD_ACCEL_TAU, a_lead_tau * 0.9)
+    self.cnt = cnt + 1
 
-    self.cnt += 1
-
-  def get_key_for_cluster(self):
+  def get_keys_for_cluster(self):
     # Weigh y higher since radar is inaccurate in this dimension
-    return [self.dRel, self.yRel*2, self.vRel]
-
-  def reset_a_lead(self, aLeadK, aLeadTau):
-    self.kf = KF1D([[self.vLead], [aLeadK]], self.K_A, self.K_C, self.K_K)
-    self.aLeadK = aLeadK
-    self.aLeadTau = aLeadTau
+    return np.column_stack([self.dRel, self.yRel*2, self.vRel])
+
+  def reset_a_lead(self, mask, aLeadK, aLeadTau):
+    self.vLeadK[mask] = self.vLead[mask]
+    self.aLeadK[mask] = aLeadK
+    self.aLeadTau[mask] = aLeadTau
+
+
+class Clusters():
+  """Per cluster means of the tracks, computed once per radar update"""
+  def __init__(self, tracks, labels, n):
+    self.labels = labels
+    counts = np.bincount(labels, minlength=n)
+    for name in ['dRel', 'yRel', 'vRel', 'vLead', 'vLeadK']:
+      setattr(self, name, np.bincount(labels, weights=getattr(tracks, name), minlength=n) / counts)
+
+    # new tracks don't have an acceleration estimate yet
+    old = tracks.cnt > 1
+    n_old = np.bincount(labels, weights=old, minlength=n)
+    has_old = n_old > 0
+    n_old[~has_old] = 1.
+    self.aLeadK = np.where(has_old, np.bincount(labels, weights=np.where(old, tracks.aLeadK, 0.), minlength=n) / n_old, 0.)
+    self.aLeadTau = np.where(has_old, np.bincount(labels, weights=np.where(old, tracks.aLeadTau, 0.), minlength=n) / n_old, _LEAD_ACCEL_TAU)
+    self.measured = np.bincount(labels, weights=tracks.measured, minlength=n) > 0
+
+  def __len__(self):
+    return len(self.dRel)
+
+  def __getitem__(self, i):
+    if not -len(self) <= i < len(self):
+      raise IndexError(i)
+    return Cluster(self, i % len(self))
+
+  def __iter__(self):
+    return (Cluster(self, i) for i in range(len(self)))
+
+  def closest_low_speed_lead(self, v_ego):
+    # index of the closest cluster that is a potential_low_speed_lead, -1 if none
+    if not v_ego < v_ego_stationary:
+      return -1
+    idxs = np.flatnonzero((np.abs(self.yRel) < 1.5) & (self.dRel < 25))
+    return idxs[np.argmin(self.dRel[idxs])] if len(idxs) else -1
 
 
 class Cluster():
-  def __init__(self):
-    self.tracks = set()
-
-  def add(self, t):
-    # add the first track
-    self.tracks.add(t)
+  """One cluster of a Clusters table"""
+  def __init__(self, clusters=None, idx=0):
+    self.clusters = clusters
+    self.idx = idx
 
-  # TODO: make generic
   @property
   def dRel(self):
-    return mean([t.dRel for t in self.tracks])
+    return self.clusters.dRel[self.idx]
 
   @property
   def yRel(self):
-    return mean([t.yRel for t in self.tracks])
+    return self.clusters.yRel[self.idx]
 
   @property
   def vRel(self):
-    return mean([t.vRel for t in self.tracks])
-
-  @property
-  def aRel(self):
-    return mean([t.aRel for t in self.tracks])
+    return self.clusters.vRel[self.idx]
 
   @property
   def vLead(self):
-    return mean([t.vLead for t in self.tracks])
-
-  @property
-  def dPath(self):
-    return mean([t.dPath for t in self.tracks])
-
-  @property
-  def vLat(self):
-    return mean([t.vLat for t in self.tracks])
+    return self.clusters.vLead[self.idx]
 
   @property
   def vLeadK(self):
-    return mean([t.vLeadK for t in self.tracks])
+    return self.clusters.vLeadK[self.idx]
 
   @property
   def aLeadK(self):
-    if all(t.cnt <= 1 for t in self.tracks):
-      return 0.
-    else:
-      return mean([t.aLeadK for t in self.tracks if t.cnt > 1])
+    return self.clusters.aLeadK[self.idx]
 
   @property
   def aLeadTau(self):
-    if all(t.cnt <= 1 for t in self.tracks):
-      return _LEAD_ACCEL_TAU
-    else:
-      return mean([t.aLeadTau for t in self.tracks if t.cnt > 1])
+    return self.clusters.aLeadTau[self.idx]
 
   @property
   def measured(self):
-    return any(t.measured for t in self.tracks)
+    return bool(self.clusters.measured[self.idx])
 
   def get_RadarState(self, model_prob=0.0):
     return {
@@ -24,7 +24,7 @@ def plannerd_thread(sm=None, pm=None):
 
   if sm is None:
     sm = messaging.SubMaster(['carState', 'controlsState', 'radarState', 'modelV2', 'liveParameters', 'modelLongButton'],
-                             poll=['radarState', 'modelV2'])
+                             poll=['radarState', 'modelV2'], lazy=True)
 
   if pm is None:
     pm = messaging.PubMaster(['longitudinalPlan', 'liveLongitudinalMpc', 'lateralPlan', 'liveMpc'])
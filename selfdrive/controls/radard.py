@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 import importlib
-import math
-from collections import defaultdict, deque
+from collections import deque
+
+import numpy as np
 
 import cereal.messaging as messaging
 from cereal import car
@@ -10,7 +11,7 @@ from common.params import Params
 from common.realtime import Ratekeeper, Priority, config_realtime_process
 from selfdrive.config import RADAR_TO_CAMERA
 from selfdrive.controls.lib.cluster.fastcluster_py import cluster_points_centroid
-from selfdrive.controls.lib.radar_helpers import Cluster, Track
+from selfdrive.controls.lib.radar_helpers import Cluster, Clusters, Tracks
 from selfdrive.swaglog import cloudlog
 
 
@@ -31,65 +32,68 @@ class KalmanParams():
 
 
 def laplacian_cdf(x, mu, b):
-  b = max(b, 1e-4)
-  return math.exp(-abs(x-mu)/b)
-
-
-def match_vision_to_cluster(v_ego, lead, clusters):
-  # match vision point to best statistical cluster match
-  offset_vision_dist = lead.xyva[0] - RADAR_TO_CAMERA
+  b = np.maximum(b, 1e-4)
+  return np.exp(-np.abs(x-mu)/b)
 
-  def prob(c):
-    prob_d = laplacian_cdf(c.dRel, offset_vision_dist, lead.xyvaStd[0])
-    prob_y = laplacian_cdf(c.yRel, -lead.xyva[1], lead.xyvaStd[1])
-    prob_v = laplacian_cdf(c.vRel, lead.xyva[2], lead.xyvaStd[2])
 
-    # This is isn't exactly right, but good heuristic
-    return prob_d * prob_y * prob_v
+def match_vision_to_clusters(v_ego, leads, clusters):
+  # match each vision lead to its best statistical cluster match, returns cluster indexes
+  xyva = np.array([[lead.xyva[0], lead.xyva[1], lead.xyva[2]] for lead in leads]).reshape(-1, 3)
+  xyva_std = np.array([[lead.xyvaStd[0], lead.xyvaStd[1], lead.xyvaStd[2]] for lead in leads]).reshape(-1, 3)
+  offset_vision_dist = xyva[:, 0] - RADAR_TO_CAMERA
 
-  cluster = max(clusters, key=prob)
+  # (leads, clusters) probabilities, this is isn't exactly right, but good heuristic
+  prob_d = laplacian_cdf(clusters.dRel, offset_vision_dist[:, None], xyva_std[:, 0:1])
+  prob_y = laplacian_cdf(clusters.yRel, -xyva[:, 1:2], xyva_std[:, 1:2])
+  prob_v = laplacian_cdf(clusters.vRel, xyva[:, 2:3], xyva_std[:, 2:3])
+  idxs = np.argmax(prob_d * prob_y * prob_v, axis=1)
 
   # if no 'sane' match is found return -1
   # stationary radar points can be false positives
-  dist_sane = abs(cluster.dRel - offset_vision_dist) < max([(offset_vision_dist)*.25, 5.0])
-  vel_sane = (abs(cluster.vRel - lead.xyva[2]) < 10) or (v_ego + cluster.vRel > 3)
-  if dist_sane and vel_sane:
-    return cluster
-  else:
-    return None
+  d_rel, v_rel = clusters.dRel[idxs], clusters.vRel[idxs]
+  dist_sane = np.abs(d_rel - offset_vision_dist) < np.maximum(offset_vision_dist*.25, 5.0)
+  vel_sane = (np.abs(v_rel - xyva[:, 2]) < 10) | (v_ego + v_rel > 3)
+  return np.where(dist_sane & vel_sane, idxs, -1)
 
 
-def get_lead(v_ego, ready, clusters, lead_msg, low_speed_override=True):
+def get_lead(v_ego, ready, clusters, lead_msg, cluster_idx, low_speed_idx=-1):
   # Determine leads, this is where the essential logic happens
-  if len(clusters) > 0 and ready and lead_msg.prob > .5:
-    cluster = match_vision_to_cluster(v_ego, lead_msg, clusters)
-  else:
-    cluster = None
-
   lead_dict = {'status': False}
-  if cluster is not None:
-    lead_dict = cluster.get_RadarState(lead_msg.prob)
-  elif (cluster is None) and ready and (lead_msg.prob > .5):
+  if cluster_idx >= 0:
+    lead_dict = clusters[cluster_idx].get_RadarState(lead_msg.prob)
+  elif ready and (lead_msg.prob > .5):
     lead_dict = Cluster().get_RadarState_from_vision(lead_msg, v_ego)
 
-  if low_speed_override:
-    low_speed_clusters = [c for c in clusters if c.potential_low_speed_lead(v_ego)]
-    if len(low_speed_clusters) > 0:
-      closest_cluster = min(low_speed_clusters, key=lambda c: c.dRel)
+  if low_speed_idx >= 0:
+    closest_cluster = clusters[low_speed_idx]
 
-      # Only choose new cluster if it is actually closer than the previous one
-      if (not lead_dict['status']) or (closest_cluster.dRel < lead_dict['dRel']):
-        lead_dict = closest_cluster.get_RadarState()
+    # Only choose new cluster if it is actually closer than the previous one
+    if (not lead_dict['status']) or (closest_cluster.dRel < lead_dict['dRel']):
+      lead_dict = closest_cluster.get_RadarState()
 
   return lead_dict
 
 
+def get_leads(v_ego, ready, clusters, lead_msgs):
+  # scores the clusters against all model leads at once, the low speed override only applies to the first lead
+  cluster_idxs = [-1] * len(lead_msgs)
+  if len(clusters) > 0 and ready:
+    matched = [i for i, lead_msg in enumerate(lead_msgs) if lead_msg.prob > .5]
+    if len(matched):
+      for i, idx in zip(matched, match_vision_to_clusters(v_ego, [lead_msgs[i] for i in matched], clusters)):
+        cluster_idxs[i] = idx
+
+  low_speed_idx = clusters.closest_low_speed_lead(v_ego)
+  return [get_lead(v_ego, ready, clusters, lead_msg, cluster_idxs[i], low_speed_idx if i == 0 else -1)
+          for i, lead_msg in enumerate(lead_msgs)]
+
+
 class RadarD():
   def __init__(self, radar_ts, delay=0):
     self.current_time = 0
 
-    self.tracks = defaultdict(dict)
     self.kalman_params = KalmanParams(radar_ts)
+    self.tracks = Tracks(self.kalman_params)
 
     # v_ego
     self.v_ego = 0.
@@ -106,54 +110,28 @@ class RadarD():
     if sm.updated['modelV2']:
       self.ready = True
 
-    ar_pts = {}
-    for pt in rr.points:
-      ar_pts[pt.trackId] = [pt.dRel, pt.yRel, pt.vRel, pt.measured]
-
-    # *** remove missing points from meta data ***
-    for ids in list(self.tracks.keys()):
-      if ids not in ar_pts:
-        self.tracks.pop(ids, None)
+    pts = rr.points
+    ids = np.array([pt.trackId for pt in pts], dtype=np.int64)
+    # sorted by trackId, the last point wins if a trackId repeats
+    ids, idxs = np.unique(ids[::-1], return_index=True)
+    idxs = len(pts) - 1 - idxs
+    d_rel = np.array([pts[i].dRel for i in idxs], dtype=np.float64)
+    y_rel = np.array([pts[i].yRel for i in idxs], dtype=np.float64)
+    v_rel = np.array([pts[i].vRel for i in idxs], dtype=np.float64)
+    measured = np.array([pts[i].measured for i in idxs], dtype=bool)
 
     # *** compute the tracks ***
-    for ids in ar_pts:
-      rpt = ar_pts[ids]
-
-      # align v_ego by a fixed time to align it with the radar measurement
-      v_lead = rpt[2] + self.v_ego_hist[0]
-
-      # create the track if it doesn't exist or it's a new track
-      if ids not in self.tracks:
-        self.tracks[ids] = Track(v_lead, self.kalman_params)
-      self.tracks[ids].update(rpt[0], rpt[1], rpt[2], v_lead, rpt[3])
-
-    idens = list(sorted(self.tracks.keys()))
-    track_pts = list([self.tracks[iden].get_key_for_cluster() for iden in idens])
-
-    # If we have multiple points, cluster them
-    if len(track_pts) > 1:
-      cluster_idxs = cluster_points_centroid(track_pts, 2.5)
-      clusters = [None] * (max(cluster_idxs) + 1)
-
-      for idx in range(len(track_pts)):
-        cluster_i = cluster_idxs[idx]
-        if clusters[cluster_i] is None:
-          clusters[cluster_i] = Cluster()
-        clusters[cluster_i].add(self.tracks[idens[idx]])
-    elif len(track_pts) == 1:
-      # FIXME: cluster_point_centroid hangs forever if len(track_pts) == 1
-      cluster_idxs = [0]
-      clusters = [Cluster()]
-      clusters[0].add(self.tracks[idens[0]])
-    else:
-      clusters = []
+    # align v_ego by a fixed time to align it with the radar measurement
+    v_lead = v_rel + self.v_ego_hist[0]
+    self.tracks.update(ids, d_rel, y_rel, v_rel, v_lead, measured)
+
+    cluster_idxs = np.array(cluster_points_centroid(self.tracks.get_keys_for_cluster(), 2.5), dtype=np.int64)
+    clusters = Clusters(self.tracks, cluster_idxs, cluster_idxs.max() + 1 if len(cluster_idxs) else 0)
 
     # if a new point, reset accel to the rest of the cluster
-    for idx in range(len(track_pts)):
-      if self.tracks[idens[idx]].cnt <= 1:
-        aLeadK = clusters[cluster_idxs[idx]].aLeadK
-        aLeadTau = clusters[cluster_idxs[idx]].aLeadTau
-        self.tracks[idens[idx]].reset_a_lead(aLeadK, aLeadTau)
+    new = self.tracks.cnt <= 1
+    if new.any():
+      self.tracks.reset_a_lead(new, clusters.aLeadK[cluster_idxs[new]], clusters.aLeadTau[cluster_idxs[new]])
 
     # *** publish radarState ***
     dat = messaging.new_message('radarState')
@@ -166,8 +144,8 @@ class RadarD():
 
     if enable_lead:
       if len(sm['modelV2'].leads) > 1:
-        radarState.leadOne = get_lead(self.v_ego, self.ready, clusters, sm['modelV2'].leads[0], low_speed_override=True)
-        radarState.leadTwo = get_lead(self.v_ego, self.ready, clusters, sm['modelV2'].leads[1], low_speed_override=False)
+        leads = sm['modelV2'].leads
+        radarState.leadOne, radarState.leadTwo = get_leads(self.v_ego, self.ready, clusters, [leads[0], leads[1]])
     return dat
 
 
@@ -218,12 +196,12 @@ def radard_thread(sm=None, pm=None, can_sock=None):
     tracks = RD.tracks
     dat = messaging.new_message('liveTracks', len(tracks))
 
-    for cnt, ids in enumerate(sorted(tracks.keys())):
+    for cnt in range(len(tracks)):
       dat.liveTracks[cnt] = {
-        "trackId": ids,
-        "dRel": float(tracks[ids].dRel),
-        "yRel": float(tracks[ids].yRel),
-        "vRel": float(tracks[ids].vRel),
+        "trackId": int(tracks.ids[cnt]),
+        "dRel": float(tracks.dRel[cnt]),
+        "yRel": float(tracks.yRel[cnt]),
+        "vRel": float(tracks.vRel[cnt]),
       }
     pm.send('liveTracks', dat)
 
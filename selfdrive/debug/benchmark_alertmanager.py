@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+import argparse
+import copy
+import random
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from cereal import car
+from common.realtime import DT_CTRL
+from selfdrive.controls.lib.alertmanager import AlertManager
+from selfdrive.controls.lib.events import ET, Events
+from selfdrive.swaglog import cloudlog
+
+EventName = car.CarEvent.EventName
+
+ENABLED_TYPES = [ET.PERMANENT, ET.USER_DISABLE, ET.IMMEDIATE_DISABLE, ET.SOFT_DISABLE, ET.WARNING]
+DISABLED_TYPES = [ET.PERMANENT, ET.PRE_ENABLE, ET.ENABLE, ET.NO_ENTRY]
+
+
+class ListAlertManager(AlertManager):
+  """The previous AlertManager, a list of alert copies filtered and sorted every frame"""
+  def __init__(self):
+    super().__init__()
+    self.activealerts = []
+
+  def add_many(self, frame, alerts, enabled=True):
+    for alert in alerts:
+      added_alert = copy.copy(alert)
+      added_alert.start_time = frame * DT_CTRL
+      if not len(self.activealerts) or added_alert.alert_priority > self.activealerts[0].alert_priority:
+        cloudlog.event('alert_add', alert_type=added_alert.alert_type, enabled=enabled)
+      self.activealerts.append(added_alert)
+
+  def SA_add(self, alert_name, extra_text_1='', extra_text_2=''):
+    from selfdrive.controls.lib.events import EVENTS
+    added_alert = copy.copy(EVENTS[alert_name][ET.PERMANENT])
+    added_alert.start_time = self.SA_frame * DT_CTRL
+    added_alert.alert_text_1 += extra_text_1
+    added_alert.alert_text_2 += extra_text_2
+    added_alert.alert_type = f"{alert_name}/{ET.PERMANENT}"
+    added_alert.event_type = ET.PERMANENT
+    if not len(self.activealerts) or added_alert.alert_priority > self.activealerts[0].alert_priority:
+      cloudlog.event('alert_add', alert_type=added_alert.alert_type, enabled=self.SA_enabled)
+    self.activealerts.append(added_alert)
+
+  def process_alerts(self, frame, clear_event_type=None):
+    cur_time = frame * DT_CTRL
+    self.activealerts = [a for a in self.activealerts if a.event_type != clear_event_type and
+                         a.start_time + max(a.duration_sound, a.duration_hud_alert, a.duration_text) > cur_time]
+    self.activealerts.sort(key=lambda k: (k.alert_priority, k.start_time), reverse=True)
+    self.clear_current_alert()
+
+    if len(self.activealerts):
+      current_alert = self.activealerts[0]
+      self.alert_type = current_alert.alert_type
+      if current_alert.start_time + current_alert.duration_sound > cur_time:
+        self.audible_alert = current_alert.audible_alert
+      if current_alert.start_time + current_alert.duration_hud_alert > cur_time:
+        self.visual_alert = current_alert.visual_alert
+      if current_alert.start_time + current_alert.duration_text > cur_time:
+        self.alert_text_1 = current_alert.alert_text_1
+        self.alert_text_2 = current_alert.alert_text_2
+        self.alert_status = current_alert.alert_status
+        self.alert_size = current_alert.alert_size
+        self.alert_rate = current_alert.alert_rate
+
+
+def distracted_ramp(n_frames):
+  # engaged drive where the driver looks away, gets warned up to driverDistracted, then looks back
+  frames = []
+  for frame in range(n_frames):
+    t = frame % 3000
+    names = [EventName.steerSaturated] if t % 400 < 30 else []
+    if 500 <= t < 900:
+      names.append(EventName.preDriverDistracted)
+    elif 900 <= t < 1100:
+      names.append(EventName.promptDriverDistracted)
+    elif 1100 <= t < 1500:
+      names.append(EventName.driverDistracted)
+    frames.append((names, True, []))
+  return frames
+
+
+def mixed_drive(n_frames, seed=0):
+  # engagements and disengagements with the usual warnings and button alerts in between
+  rnd = random.Random(seed)
+  frames = []
+  enabled = False
+  for _ in range(n_frames):
+    names, sa = [], []
+    if rnd.random() < 0.002:
+      enabled = not enabled
+      names.append(EventName.buttonEnable if enabled else EventName.buttonCancel)
+    if enabled:
+      for name, p in [(EventName.steerSaturated, 0.05), (EventName.ldw, 0.01), (EventName.preLaneChangeLeft, 0.02),
+                      (EventName.laneChange, 0.02), (EventName.fcw, 0.001)]:
+        if rnd.random() < p:
+          names.append(name)
+    elif rnd.random() < 0.1:
+      names.append(EventName.doorOpen)
+    if rnd.random() < 0.01:
+      sa.append(('laneSpeedKeeping', 'LEFT', 'Oncoming traffic in right lane'))
+    if rnd.random() < 0.005:
+      sa.append(('dfButtonAlert', 'relaxed', 'Dynamic follow: relaxed profile active'))
+    frames.append((names, enabled, sa))
+  return frames
+
+
+def run(frames, AM):
+  CP = SimpleNamespace(minSteerSpeed=10., carName='toyota')
+  sm = {'liveCalibration': SimpleNamespace(calPerc=50), 'pandaState': SimpleNamespace(pandaType=0)}
+  events = Events()
+  latencies = np.empty(len(frames))
+  outputs = []
+  for frame, (names, enabled, sa) in enumerate(frames):
+    events.clear()
+    for name in names:
+      events.add(name)
+    current_alert_types = ENABLED_TYPES if enabled else DISABLED_TYPES
+    alerts = events.create_alerts(current_alert_types, [CP, sm, False])
+    clear_event = ET.WARNING if ET.WARNING not in current_alert_types else None
+
+    t = time.perf_counter()
+    AM.SA_set_frame(frame)
+    AM.SA_set_enabled(enabled)
+    for alert_name, extra_text_1, extra_text_2 in sa:
+      AM.SA_add(alert_name, extra_text_1=extra_text_1, extra_text_2=extra_text_2)
+    AM.add_many(frame, alerts, enabled)
+    AM.process_alerts(frame, clear_event)
+    latencies[frame] = time.perf_counter() - t
+
+    outputs.append((AM.alert_type, AM.alert_text_1, AM.alert_text_2, AM.alert_status, AM.alert_size,
+                    AM.visual_alert, AM.audible_alert, AM.alert_rate))
+  return latencies, outputs
+
+
+def benchmark(name, frames):
+  list_latencies, list_outputs = run(frames, ListAlertManager())
+  heap_latencies, heap_outputs = run(frames, AlertManager())
+
+  print('{} ({} frames):'.format(name, len(frames)))
+  for impl, latencies in [('list', list_latencies), ('heap', heap_latencies)]:
+    print('  {}: p50: {:.1f} us, p99: {:.1f} us, mean: {:.1f} us per frame'.format(impl, np.percentile(latencies, 50) * 1e6,
+                                                                               np.percentile(latencies, 99) * 1e6,
+                                                                               latencies.mean() * 1e6))
+  same = sum(a == b for a, b in zip(list_outputs, heap_outputs))
+  print('  same alert as the list implementation in {:.2f}% of frames'.format(100. * same / len(frames)))
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Benchmark the heap based AlertManager against the previous list based one')
+  parser.add_argument('--frames', type=int, default=30000, help='number of 100 Hz frames per stream')
+  args = parser.parse_args()
+
+  benchmark('driver distracted ramp', distracted_ramp(args.frames))
+  benchmark('mixed drive', mixed_drive(args.frames))
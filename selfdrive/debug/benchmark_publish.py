@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+import argparse
+import random
+import time
+
+import numpy as np
+
+import cereal.messaging as messaging
+from cereal import log
+
+ALERTS = [("", ""), ("TAKE CONTROL", "Steer Unavailable Below 30 mph"), ("KEEP EYES ON ROAD", "Driver Appears Distracted")]
+
+
+def controls_state_frames(n_frames, seed=0):
+  # values like controlsd publishes them, alerts change every few seconds and the rest every frame
+  rnd = random.Random(seed)
+  frames = []
+  alert = ALERTS[0]
+  for frame in range(n_frames):
+    if frame % 300 == 0:
+      alert = rnd.choice(ALERTS)
+    pid_state = log.ControlsState.LateralPIDState.new_message()
+    pid_state.active = True
+    pid_state.steeringAngleDeg = rnd.uniform(-10, 10)
+    pid_state.output = rnd.uniform(-1, 1)
+    values = (
+      ('alertText1', alert[0]),
+      ('alertText2', alert[1]),
+      ('alertSize', 2 if alert[0] else 0),
+      ('alertStatus', 0),
+      ('alertBlinkingRate', 0.),
+      ('alertType', alert[0] and "driverDistracted/warning"),
+      ('alertSound', 0),
+      ('canMonoTimes', [frame * 10000000 + i for i in range(2 if rnd.random() < 0.05 else 1)]),
+      ('longitudinalPlanMonoTime', frame * 50000000),
+      ('lateralPlanMonoTime', frame * 50000000),
+      ('enabled', True),
+      ('active', True),
+      ('curvature', rnd.uniform(-0.01, 0.01)),
+      ('state', 1),
+      ('engageable', True),
+      ('longControlState', 1),
+      ('vPid', rnd.uniform(0, 30)),
+      ('vCruise', 40.),
+      ('upAccelCmd', rnd.uniform(-1, 1)),
+      ('uiAccelCmd', rnd.uniform(-1, 1)),
+      ('ufAccelCmd', rnd.uniform(-1, 1)),
+      ('steeringAngleDesiredDeg', rnd.uniform(-10, 10)),
+      ('vTargetLead', rnd.uniform(0, 30)),
+      ('aTarget', rnd.uniform(-2, 2)),
+      ('cumLagMs', rnd.uniform(-5, 5)),
+      ('startMonoTime', frame * 10000000),
+      ('forceDecel', False),
+      ('canErrorCounter', 0),
+    )
+    frames.append((values, pid_state))
+  return frames
+
+
+def new_message_publish(frames):
+  latencies = np.empty(len(frames))
+  out = []
+  for i, (values, pid_state) in enumerate(frames):
+    t = time.perf_counter()
+    dat = messaging.new_message('controlsState')
+    dat.valid = True
+    controlsState = dat.controlsState
+    for name, value in values:
+      setattr(controlsState, name, value)
+    controlsState.lateralControlState.pidState = pid_state
+    out.append(dat.to_bytes())
+    latencies[i] = time.perf_counter() - t
+  return latencies, out, len(frames)
+
+
+def reusable_publish(frames, max_growth):
+  msg = messaging.ReusableMessage('controlsState', max_growth=max_growth)
+  latencies = np.empty(len(frames))
+  out = []
+  for i, (values, pid_state) in enumerate(frames):
+    t = time.perf_counter()
+    controlsState = msg.start(valid=True)
+    msg.set(values)
+    controlsState.lateralControlState.pidState = pid_state
+    out.append(msg.to_bytes())
+    latencies[i] = time.perf_counter() - t
+  return latencies, out, msg.rebuilds + 1
+
+
+def report(name, latencies, out, builders):
+  print('{}:'.format(name))
+  print('  p50: {:.1f} us, p99: {:.1f} us, mean: {:.1f} us per message'.format(np.percentile(latencies, 50) * 1e6,
+                                                                            np.percentile(latencies, 99) * 1e6,
+                                                                            latencies.mean() * 1e6))
+  print('  {:.3f} message builders allocated per message, {:.0f} bytes serialized per message'.format(builders / len(out),
+                                                                                                 np.mean([len(d) for d in out])))
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Benchmark publishing controlsState with a new message per frame and with a ReusableMessage')
+  parser.add_argument('--frames', type=int, default=10000)
+  parser.add_argument('--max-growth', type=float, default=1.25, help='ReusableMessage rebuild threshold')
+  args = parser.parse_args()
+
+  frames = controls_state_frames(args.frames)
+  results = [('new_message per frame', new_message_publish(frames)), ('ReusableMessage', reusable_publish(frames, args.max_growth))]
+  for name, result in results:
+    report(name, *result)
+
+  # the reused builder carries dead space from replaced lists and structs, the decoded messages must still match
+  same = sum(log.Event.from_bytes(a).controlsState.to_dict() == log.Event.from_bytes(b).controlsState.to_dict()
+             for a, b in zip(results[0][1][1], results[1][1][1]))
+  print('same decoded controlsState in {:.2f}% of messages'.format(100. * same / len(frames)))
@@ -7,7 +7,7 @@ import os
 import traceback
 from tqdm import tqdm
 from tools.lib.logreader import LogReader
-from selfdrive.car.fw_versions import match_fw_to_car
+from selfdrive.car.fw_versions import match_fw_to_car, match_fw_to_car_ranked
 from selfdrive.car.toyota.values import FW_VERSIONS as TOYOTA_FW_VERSIONS
 from selfdrive.car.honda.values import FW_VERSIONS as HONDA_FW_VERSIONS
 from selfdrive.car.hyundai.values import FW_VERSIONS as HYUNDAI_FW_VERSIONS
@@ -76,6 +76,7 @@ if __name__ == "__main__":
           print(f"{dongle_id}|{time}")
           print("Old style:", live_fingerprint, "Vin", msg.carParams.carVin)
           print("New style:", candidates)
+          print("Closest:", [f"{c} ({matched} ok, {mismatched} wrong)" for c, matched, mismatched in match_fw_to_car_ranked(car_fw)[:3]])
 
           for version in car_fw:
             subaddr = None if version.subAddress == 0 else hex(version.subAddress)
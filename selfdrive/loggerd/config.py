@@ -14,6 +14,11 @@ CAMERA_FPS = 20
 SEGMENT_LENGTH = 60
 
 
+def get_data_dir(root=ROOT):
+  # for the uploaders' own files, next to the log root and not in it, everything in root is a segment directory
+  return os.path.dirname(os.path.normpath(root))
+
+
 def get_available_percent(default=None):
   try:
     statvfs = os.statvfs(ROOT)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from selfdrive.loggerd import upload_engine
+from selfdrive.loggerd.upload_engine import ChunkReader, TokenBucket, UploadEngine, UploadProgress
+
+CHUNK_SIZE = 64 * 1024
+BLOCK_BLOB = {'x-ms-blob-type': 'BlockBlob'}
+
+
+class BlobHandler(BaseHTTPRequestHandler):
+  """Stand-in for the blob storage, keeps blocks and committed blobs per path"""
+  protocol_version = 'HTTP/1.1'
+
+  def log_message(self, *args):
+    pass
+
+  def do_PUT(self):
+    server = self.server
+    body = self.rfile.read(int(self.headers['Content-Length']))
+    url = urlsplit(self.path)
+    comp = parse_qs(url.query).get('comp', [None])[0]
+
+    with server.lock:
+      server.puts.append((url.path, comp))
+      fail = server.fail is not None and server.fail(url.path, comp, len(server.puts))
+      if fail:
+        code = 500
+      elif comp == 'block':
+        server.blocks.setdefault(url.path, {})[parse_qs(url.query)['blockid'][0]] = body
+        code = 201
+      elif comp == 'blocklist':
+        ids = re.findall(r'<Latest>(.*?)</Latest>', body.decode())
+        blocks = server.blocks.get(url.path, {})
+        code = 201 if all(i in blocks for i in ids) else 400
+        if code == 201:
+          server.blobs[url.path] = b''.join(blocks[i] for i in ids)
+      else:
+        server.blobs[url.path] = body
+        code = 201
+    self.send_response(code)
+    self.send_header('Content-Length', '0')
+    self.end_headers()
+
+
+class TestUploadEngine(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.progress_dir = os.path.join(self.tmp, 'upload_progress')
+    self.fn = os.path.join(self.tmp, 'fcamera.hevc')
+    self.data = os.urandom(10 * CHUNK_SIZE + 123)
+    with open(self.fn, 'wb') as f:
+      f.write(self.data)
+
+    self.server = ThreadingHTTPServer(('127.0.0.1', 0), BlobHandler)
+    self.server.lock = threading.Lock()
+    self.server.puts, self.server.blocks, self.server.blobs = [], {}, {}
+    self.server.fail = None
+    threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    self.url = 'http://127.0.0.1:%d' % self.server.server_port
+
+    self.engine = UploadEngine(workers=4, chunk_size=CHUNK_SIZE, progress_dir=self.progress_dir)
+
+  def tearDown(self):
+    self.engine.executor.shutdown()
+    self.server.shutdown()
+    self.server.server_close()
+    shutil.rmtree(self.tmp)
+
+  def block_puts(self, path):
+    return sum(p == (path, 'block') for p in self.server.puts)
+
+  def test_single_put(self):
+    progress = []
+    resp = self.engine.upload(self.fn, self.url + '/plain', {}, lambda sent, size: progress.append((sent, size)))
+    self.assertEqual(resp.status_code, 201)
+    self.assertEqual(self.server.blobs['/plain'], self.data)
+    self.assertEqual(self.server.puts, [('/plain', None)])
+    self.assertEqual(progress[-1], (len(self.data), len(self.data)))
+
+  def test_blocks(self):
+    progress = []
+    resp = self.engine.upload(self.fn, self.url + '/blob?sig=1', BLOCK_BLOB, lambda sent, size: progress.append(sent))
+    self.assertEqual(resp.status_code, 201)
+    self.assertEqual(self.server.blobs['/blob'], self.data)
+    self.assertEqual(self.block_puts('/blob'), 11)
+    self.assertEqual(progress, sorted(progress))
+    self.assertEqual(progress[-1], len(self.data))
+    self.assertEqual(os.listdir(self.progress_dir), [])  # done, nothing left to resume
+
+  def test_resume_after_failure(self):
+    self.server.fail = lambda path, comp, n: comp == 'block' and n == 4
+    progress = []
+    resp = self.engine.upload(self.fn, self.url + '/blob?sig=1', BLOCK_BLOB, lambda sent, size: progress.append(sent))
+    self.assertEqual(resp.status_code, 500)
+    self.assertNotIn('/blob', self.server.blobs)
+    sent = len(self.server.blocks['/blob'])
+    self.assertLess(sent, 11)
+    # only the blocks the server has count, not the one that failed
+    self.assertEqual(progress[-1], sum(map(len, self.server.blocks['/blob'].values())))
+    progress.clear()
+
+    # retried with a new signature, only the missing blocks are sent again
+    self.server.fail = None
+    self.server.puts.clear()
+    resp = self.engine.upload(self.fn, self.url + '/blob?sig=2', BLOCK_BLOB, lambda sent, size: progress.append(sent))
+    self.assertEqual(resp.status_code, 201)
+    self.assertEqual(self.server.blobs['/blob'], self.data)
+    self.assertEqual(self.block_puts('/blob'), 11 - sent)
+
+    self.assertEqual(progress, sorted(progress))
+    self.assertEqual(progress[-1], len(self.data))
+
+  def test_expired_blocks(self):
+    self.server.fail = lambda path, comp, n: comp == 'block' and n == 4
+    self.engine.upload(self.fn, self.url + '/blob?sig=1', BLOCK_BLOB)
+    self.server.fail = None
+    self.server.blocks.clear()  # uncommitted blocks expired on the server
+
+    resp = self.engine.upload(self.fn, self.url + '/blob?sig=2', BLOCK_BLOB)
+    self.assertEqual(resp.status_code, 400)
+    resp = self.engine.upload(self.fn, self.url + '/blob?sig=3', BLOCK_BLOB)
+    self.assertEqual(resp.status_code, 201)
+    self.assertEqual(self.server.blobs['/blob'], self.data)
+
+  def test_exception_waits_for_workers(self):
+    put = self.engine._put
+    started = []
+
+    def failing_put(url, *args):
+      started.append(url)
+      if len(started) == 2:
+        raise ConnectionError
+      time.sleep(0.1)
+      return put(url, *args)
+
+    self.engine._put = failing_put
+    with self.assertRaises(ConnectionError):
+      self.engine.upload(self.fn, self.url + '/blob?sig=1', BLOCK_BLOB)
+    puts = len(self.server.puts)
+    self.assertLess(len(started), 11)  # blocks not started yet are skipped
+    time.sleep(0.3)
+    self.assertEqual(len(self.server.puts), puts)  # nothing keeps sending in the background
+
+  def test_rate_limit(self):
+    self.engine.set_rate(256 * 1024)
+    t = time.monotonic()
+    self.engine.upload(self.fn, self.url + '/blob?sig=1', BLOCK_BLOB)
+    # the burst goes out right away, the rest at the rate
+    expected = (len(self.data) - self.engine.bucket.burst) / (256 * 1024)
+    self.assertGreater(time.monotonic() - t, expected * 0.9)
+
+    self.engine.set_rate(None)
+    t = time.monotonic()
+    self.engine.upload(self.fn, self.url + '/blob2?sig=1', BLOCK_BLOB)
+    self.assertLess(time.monotonic() - t, expected)
+
+  def test_prune_and_discard(self):
+    self.server.fail = lambda path, comp, n: comp == 'blocklist'
+    self.engine.upload(self.fn, self.url + '/blob?sig=1', BLOCK_BLOB)
+    self.assertEqual(len(os.listdir(self.progress_dir)), 1)
+
+    upload_engine.prune_progress(self.progress_dir)  # still resumable
+    self.assertEqual(len(os.listdir(self.progress_dir)), 1)
+    upload_engine.prune_progress(self.progress_dir, max_age=0)
+    self.assertEqual(os.listdir(self.progress_dir), [])
+
+    self.engine.upload(self.fn, self.url + '/blob?sig=2', BLOCK_BLOB)
+    self.engine.discard(self.fn, self.url + '/blob?sig=3')
+    self.assertEqual(os.listdir(self.progress_dir), [])
+
+    self.engine.upload(self.fn, self.url + '/blob?sig=4', BLOCK_BLOB)
+    with open(self.fn, 'ab') as f:  # changed since, the blocks don't match anymore
+      f.write(b'\0')
+    upload_engine.prune_progress(self.progress_dir)
+    self.assertEqual(os.listdir(self.progress_dir), [])
+
+  def test_progress_identity(self):
+    progress = UploadProgress(self.progress_dir, self.url + '/blob', self.fn)
+    progress.add('block-0')
+    self.assertEqual(UploadProgress(self.progress_dir, self.url + '/blob', self.fn).blocks, {'block-0'})
+    self.assertEqual(UploadProgress(self.progress_dir, self.url + '/other', self.fn).blocks, set())
+
+
+class TestTokenBucket(unittest.TestCase):
+  def test_rate(self):
+    bucket = TokenBucket(rate=100 * 1024, burst=10 * 1024)
+    t = time.monotonic()
+    for _ in range(50):
+      bucket.consume(1024)
+    self.assertAlmostEqual(time.monotonic() - t, 0.4, delta=0.15)
+
+  def test_bigger_than_burst(self):
+    bucket = TokenBucket(rate=100 * 1024, burst=10 * 1024)
+    t = time.monotonic()
+    bucket.consume(30 * 1024)  # let through, the debt delays the next read
+    bucket.consume(1024)
+    self.assertAlmostEqual(time.monotonic() - t, 0.21, delta=0.1)
+
+  def test_unlimited(self):
+    bucket = TokenBucket()
+    t = time.monotonic()
+    bucket.consume(1 << 30)
+    self.assertLess(time.monotonic() - t, 0.1)
+
+
+class TestChunkReader(unittest.TestCase):
+  def test_reads_range(self):
+    with tempfile.NamedTemporaryFile() as f:
+      f.write(bytes(range(256)))
+      f.flush()
+      reads = []
+      reader = ChunkReader(f.name, 10, 100, TokenBucket(), reads.append)
+      self.assertEqual(len(reader), 100)
+      self.assertEqual(reader.read(30) + reader.read(), bytes(range(10, 110)))
+      self.assertEqual(reader.read(), b'')
+      self.assertEqual(reads, [30, 70, 0])
+      reader.close()
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from selfdrive.loggerd import upload_index
+from selfdrive.loggerd.upload_index import UploadIndex, TIER_OTHER
+
+
+class TestUploadIndex(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.mkdtemp()
+    self.root = os.path.join(self.tmp, "realdata")
+    os.makedirs(self.root)
+
+  def tearDown(self):
+    shutil.rmtree(self.tmp)
+
+  def make_index(self):
+    index = UploadIndex(self.root, os.path.join(self.tmp, "upload_index.db"),
+                        lambda name, fn: None if name.endswith(".lock") else TIER_OTHER,
+                        lambda name: 0, lambda segment: segment.split("--"), "user.upload")
+    self.addCleanup(index.db.close)
+    return index
+
+  def touch(self, *path):
+    os.makedirs(os.path.join(self.root, *path[:-1]), exist_ok=True)
+    open(os.path.join(self.root, *path), "w").close()
+
+  def keys(self, index):
+    return [r[0] for r in index.db.execute("SELECT key FROM files ORDER BY key")]
+
+  def test_watched_changes(self):
+    self.touch("a--0", "rlog.bz2")
+    self.touch("a--1", "rlog.bz2")
+    self.touch("a--1", "rlog.bz2.lock")
+    index = self.make_index()
+    self.assertIsNotNone(index.watcher)
+    index.refresh()
+    self.assertEqual(self.keys(index), ["a--0/rlog.bz2"])
+
+    # only the changed segments are listed from now on
+    with mock.patch.object(index, "_full_scan", side_effect=AssertionError):
+      os.remove(os.path.join(self.root, "a--1", "rlog.bz2.lock"))
+      self.touch("a--2", "qlog.bz2")
+      index.refresh()
+      self.assertEqual(self.keys(index), ["a--0/rlog.bz2", "a--1/rlog.bz2", "a--2/qlog.bz2"])
+
+      self.touch("a--0", "crash")  # added after the lock was gone
+      shutil.rmtree(os.path.join(self.root, "a--2"))
+      index.refresh()
+      self.assertEqual(self.keys(index), ["a--0/crash", "a--0/rlog.bz2", "a--1/rlog.bz2"])
+
+      with mock.patch.object(index, "_update_segment", side_effect=AssertionError):
+        index.refresh()  # nothing changed
+
+  def test_lost_events_scan(self):
+    index = self.make_index()
+    index.refresh()
+    self.touch("a--0", "rlog.bz2")
+    with mock.patch.object(index.watcher, "changed", return_value=None):
+      index.refresh()
+    self.assertEqual(self.keys(index), ["a--0/rlog.bz2"])
+
+  def test_periodic_scan(self):
+    index = self.make_index()
+    index.refresh()
+    self.touch("a--0", "rlog.bz2")
+    index.watcher.changed()  # pretend the event got lost, the periodic scan still finds it
+    index.refresh()
+    self.assertEqual(self.keys(index), [])
+
+    index.last_full_scan -= upload_index.FULL_SCAN_INTERVAL
+    index.refresh()
+    self.assertEqual(self.keys(index), ["a--0/rlog.bz2"])
+
+  def test_without_inotify(self):
+    self.touch("a--0", "rlog.bz2")
+    self.touch("a--0", "rlog.bz2.lock")
+    with mock.patch.object(upload_index, "_SegmentWatcher", side_effect=OSError):
+      index = self.make_index()
+    self.assertIsNone(index.watcher)
+    index.refresh()
+    self.assertEqual(self.keys(index), [])
+
+    os.remove(os.path.join(self.root, "a--0", "rlog.bz2.lock"))
+    index.refresh()
+    self.assertEqual(self.keys(index), ["a--0/rlog.bz2"])
+
+  def test_out_of_watches(self):
+    index = self.make_index()
+    index.refresh()
+    with mock.patch.object(index.watcher, "watch", side_effect=OSError(28, "No space left on device")):
+      self.touch("a--0", "rlog.bz2")
+      index.refresh()
+    self.assertIsNone(index.watcher)
+    self.assertEqual(self.keys(index), ["a--0/rlog.bz2"])
+
+
+if __name__ == "__main__":
+  unittest.main()
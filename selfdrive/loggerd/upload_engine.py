@@ -0,0 +1,250 @@
+import base64
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from selfdrive.loggerd.config import get_data_dir
+from selfdrive.swaglog import cloudlog
+
+CHUNK_SIZE = 4 * 1024 * 1024
+# persisted, so a reboot doesn't lose the blocks already sent
+UPLOAD_PROGRESS_DIR = os.getenv("UPLOAD_PROGRESS_DIR", os.path.join(get_data_dir(), "upload_progress"))
+PROGRESS_MAX_AGE = 7 * 24 * 60 * 60  # seconds, uncommitted blocks are discarded by the server after a week
+PRUNE_INTERVAL = 60 * 60  # seconds between sweeps of the progress dir
+
+
+class TokenBucket():
+  """Limits the bytes per second shared by all the upload workers, a rate of None is unlimited"""
+  def __init__(self, rate=None, burst=256 * 1024):
+    self.lock = threading.Lock()
+    self.burst = burst
+    self.tokens = burst
+    self.last = time.monotonic()
+    self.rate = rate
+
+  def set_rate(self, rate):
+    with self.lock:
+      self.rate = rate
+
+  def consume(self, n):
+    while True:
+      with self.lock:
+        if self.rate is None:
+          return
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+        # reads bigger than the burst are let through once the bucket is full, leaving it in debt
+        if self.tokens >= min(n, self.burst):
+          self.tokens -= n
+          return
+        wait = (min(n, self.burst) - self.tokens) / self.rate
+      time.sleep(wait)
+
+
+class ChunkReader():
+  """File-like view of length bytes of a file from offset, reads go through the token bucket"""
+  def __init__(self, fn, offset, length, bucket, on_read=None):
+    self.f = open(fn, "rb")
+    self.f.seek(offset)
+    self.remaining = length
+    self.length = length
+    self.bucket = bucket
+    self.on_read = on_read
+
+  def __len__(self):
+    return self.length
+
+  def read(self, size=-1):
+    if size is None or size < 0 or size > self.remaining:
+      size = self.remaining
+    dat = self.f.read(size)
+    self.remaining -= len(dat)
+    self.bucket.consume(len(dat))
+    if self.on_read is not None:
+      self.on_read(len(dat))
+    return dat
+
+  def close(self):
+    self.f.close()
+
+
+def is_block_blob(url, headers):
+  return headers.get('x-ms-blob-type') == 'BlockBlob' and urlsplit(url).query != ''
+
+
+def add_query(url, query):
+  parts = urlsplit(url)
+  return urlunsplit(parts._replace(query=parts.query + '&' + query if parts.query else query))
+
+
+class UploadProgress():
+  """Block ids already sent for a file, kept on disk so a failed upload resumes where it stopped"""
+  def __init__(self, progress_dir, blob_url, fn):
+    st = os.stat(fn)
+    self.fn = fn
+    self.identity = [blob_url, st.st_size, st.st_mtime_ns]
+    self.path = os.path.join(progress_dir, hashlib.sha1(json.dumps(self.identity).encode()).hexdigest() + ".json")
+    self.lock = threading.Lock()
+    self.blocks = set()
+    try:
+      with open(self.path) as f:
+        saved = json.load(f)
+      if saved['identity'] == self.identity:
+        self.blocks = set(saved['blocks'])
+    except (OSError, ValueError, KeyError):
+      pass
+
+  def add(self, block_id):
+    with self.lock:
+      self.blocks.add(block_id)
+      try:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(self.path), delete=False) as f:
+          json.dump({'identity': self.identity, 'fn': self.fn, 'blocks': sorted(self.blocks)}, f)
+        os.replace(f.name, self.path)
+      except OSError:
+        pass  # only costs resending the block
+
+  def clear(self):
+    try:
+      os.remove(self.path)
+    except OSError:
+      pass
+
+
+def prune_progress(progress_dir, max_age=PROGRESS_MAX_AGE):
+  """Removes the progress of uploads that were abandoned: too old to resume, or their file was deleted or changed"""
+  try:
+    names = os.listdir(progress_dir)
+  except OSError:
+    return
+
+  now = time.time()
+  for name in names:
+    path = os.path.join(progress_dir, name)
+    try:
+      if now - os.path.getmtime(path) < max_age:
+        with open(path) as f:
+          saved = json.load(f)
+        st = os.stat(saved['fn'])
+        if saved['identity'][1:] == [st.st_size, st.st_mtime_ns]:
+          continue
+    except (OSError, ValueError, KeyError, TypeError):
+      pass  # source gone or unreadable progress
+    try:
+      os.remove(path)
+    except OSError:
+      pass
+
+
+class UploadEngine():
+  """
+    Uploads files to presigned urls over a pooled session. Block blob urls are sent in chunks by parallel workers
+    with their progress persisted, other urls get a single PUT. All reads share one bandwidth limit
+  """
+  def __init__(self, workers=4, chunk_size=CHUNK_SIZE, rate=None, progress_dir=UPLOAD_PROGRESS_DIR, timeout=10, session=None):
+    self.chunk_size = chunk_size
+    self.progress_dir = progress_dir
+    self.timeout = timeout
+    self.bucket = TokenBucket(rate)
+    self.executor = ThreadPoolExecutor(max_workers=workers)
+    self.last_prune = None
+
+    if session is None:
+      session = requests.Session()
+      adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+      session.mount('http://', adapter)
+      session.mount('https://', adapter)
+    self.session = session
+
+  def set_rate(self, rate):
+    self.bucket.set_rate(rate)
+
+  def discard(self, fn, url):
+    """Forgets the blocks sent for an upload that won't be resumed"""
+    try:
+      UploadProgress(self.progress_dir, url.split('?')[0], fn).clear()
+    except OSError:
+      pass  # file is gone, prune_progress cleans up after it
+
+  def upload(self, fn, url, headers, on_progress=None):
+    """Blocks until fn is uploaded, returns the last response. on_progress(bytes_sent, size) is called from workers"""
+    if self.last_prune is None or time.monotonic() - self.last_prune > PRUNE_INTERVAL:
+      self.last_prune = time.monotonic()
+      prune_progress(self.progress_dir)
+
+    size = os.path.getsize(fn)
+    sent = [0]
+    sent_lock = threading.Lock()
+
+    def on_sent(n):
+      with sent_lock:
+        sent[0] += n
+        if on_progress is not None:
+          on_progress(sent[0], size)
+
+    if size <= self.chunk_size or not is_block_blob(url, headers):
+      return self._put(url, fn, 0, size, headers, on_sent)  # a single pass over the file, reads add up to size
+
+    progress = UploadProgress(self.progress_dir, url.split('?')[0], fn)  # the blob, not the expiring signature
+    n_blocks = (size + self.chunk_size - 1) // self.chunk_size
+    block_ids = [base64.b64encode(b"block-%08d" % i).decode() for i in range(n_blocks)]
+    block_headers = {k: v for k, v in headers.items() if k.lower() != 'x-ms-blob-type'}
+    abort = threading.Event()
+
+    def put_block(i):
+      # a block counts as sent once the server has it, a block sent again after a failure isn't counted twice
+      offset = i * self.chunk_size
+      length = min(self.chunk_size, size - offset)
+      if block_ids[i] in progress.blocks:
+        on_sent(length)
+        return None
+      if abort.is_set():  # another block failed, the upload is retried later
+        return None
+      try:
+        resp = self._put(add_query(url, "comp=block&blockid=" + requests.utils.quote(block_ids[i], safe='')),
+                         fn, offset, length, block_headers)
+      except Exception:
+        abort.set()
+        raise
+      if resp.status_code not in (200, 201):
+        abort.set()
+        return resp
+      progress.add(block_ids[i])
+      on_sent(length)
+      return None
+
+    # wait for every block before returning or raising, so a failed upload doesn't keep sending in the background.
+    # blocks not started yet are skipped once one fails
+    futures = [self.executor.submit(put_block, i) for i in range(n_blocks)]
+    wait(futures)
+    failed = [resp for resp in (future.result() for future in futures) if resp is not None]
+    if failed:
+      return failed[0]
+
+    block_list = "<?xml version=\"1.0\" encoding=\"utf-8\"?><BlockList>%s</BlockList>" % \
+      "".join("<Latest>%s</Latest>" % b for b in block_ids)
+    resp = self.session.put(add_query(url, "comp=blocklist"), data=block_list.encode(), headers=block_headers, timeout=self.timeout)
+    if resp.status_code in (200, 201):
+      progress.clear()
+    elif resp.status_code == 400:  # uncommitted blocks expire on the server, start over next time
+      cloudlog.event("upload_blocklist_failed", url=url.split('?')[0], fn=fn, status=resp.status_code)
+      progress.clear()
+    return resp
+
+  def _put(self, url, fn, offset, length, headers, on_read=None):
+    reader = ChunkReader(fn, offset, length, self.bucket, on_read)
+    try:
+      return self.session.put(url, data=reader, headers={**headers, 'Content-Length': str(length)}, timeout=self.timeout)
+    finally:
+      reader.close()
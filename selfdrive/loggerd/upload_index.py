@@ -0,0 +1,269 @@
+import ctypes
+import errno
+import os
+import sqlite3
+import struct
+import time
+
+from selfdrive.loggerd.config import get_data_dir
+from selfdrive.loggerd.xattr_cache import getxattr
+from selfdrive.swaglog import cloudlog
+
+UPLOAD_INDEX_VERSION = 2
+RECENT_MTIME = 2.  # seconds, a directory modified this recently could still change within the same mtime
+FULL_SCAN_INTERVAL = 600.  # seconds, scan all segments even when inotify reported nothing
+
+# upload tiers, lower goes first
+TIER_IMMEDIATE = 0
+TIER_HIGH = 1
+TIER_OTHER = 2
+
+
+def get_index_path(root):
+  return os.path.join(get_data_dir(root), "upload_index.db")
+
+
+class _SegmentWatcher():
+  """Collects the segment directories that had files created, removed or renamed since the last call to changed,
+     with a non-blocking inotify watch on root and on every segment directory in it"""
+  IN_MOVED_FROM = 0x40
+  IN_MOVED_TO = 0x80
+  IN_CREATE = 0x100
+  IN_DELETE = 0x200
+  IN_Q_OVERFLOW = 0x4000
+  IN_IGNORED = 0x8000
+  IN_ONLYDIR = 0x1000000
+  IN_ISDIR = 0x40000000
+  MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+  EVENT = struct.Struct('iIII')  # wd, mask, cookie, len
+
+  def __init__(self, root):
+    self.root = root
+    self.libc = ctypes.CDLL(None, use_errno=True)
+    self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if self.fd < 0:
+      raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+    self.segments = {}  # wd -> segment
+    try:
+      self.root_wd = self._add_watch(self.root)
+    except OSError:
+      os.close(self.fd)
+      raise
+
+  def _add_watch(self, path):
+    wd = self.libc.inotify_add_watch(self.fd, path.encode(), self.MASK)
+    if wd < 0:
+      err = ctypes.get_errno()
+      raise OSError(err, os.strerror(err), path)
+    return wd
+
+  def watch(self, segment):
+    # returns False if the segment is gone, raises if it can't be watched, e.g. out of watches
+    try:
+      self.segments[self._add_watch(os.path.join(self.root, segment))] = segment
+    except OSError as e:
+      if e.errno in (errno.ENOENT, errno.ENOTDIR):
+        return False
+      raise
+    return True
+
+  def changed(self):
+    # set of changed segments, None if events were lost and everything has to be scanned
+    changed = set()
+    while True:
+      try:
+        buf = os.read(self.fd, 64 * 1024)
+      except BlockingIOError:
+        return changed
+      i = 0
+      while i < len(buf):
+        wd, mask, _, name_len = self.EVENT.unpack_from(buf, i)
+        name = buf[i + self.EVENT.size:i + self.EVENT.size + name_len].rstrip(b'\0')
+        i += self.EVENT.size + name_len
+        if mask & self.IN_Q_OVERFLOW:
+          return None
+        if mask & self.IN_IGNORED:  # segment directory deleted
+          self.segments.pop(wd, None)
+        elif wd == self.root_wd:
+          if mask & self.IN_ISDIR:
+            changed.add(os.fsdecode(name))
+        elif wd in self.segments:
+          changed.add(self.segments[wd])
+
+  def close(self):
+    os.close(self.fd)
+
+
+class UploadIndex():
+  """
+    Persistent index of the files left to upload. A segment directory is listed again only when its mtime changed
+    since it was indexed, or while it's still locked or was modified too recently to trust its mtime. Files added
+    after the lock is gone, like boot and crash logs or late files from loggerd, are picked up the same way.
+    With inotify only the segments that changed are listed, removing a lock makes its segment change. A full scan
+    still runs every FULL_SCAN_INTERVAL, and on every refresh when inotify is unavailable or dropped events
+  """
+  def __init__(self, root, path, tier_fn, sort_fn, segment_sort_fn, attr_name):
+    self.root = root
+    self.path = path
+    self.tier_fn = tier_fn  # (name, fn) -> tier or None to never upload
+    self.sort_fn = sort_fn  # name -> priority within a segment
+    self.segment_sort_fn = segment_sort_fn  # segment name -> sortable list of strings
+    self.attr_name = attr_name
+
+    os.makedirs(os.path.dirname(self.path), exist_ok=True)
+    try:
+      self.db = self._open()
+    except sqlite3.DatabaseError:
+      cloudlog.exception("upload index corrupt, rebuilding")
+      os.remove(self.path)
+      self.db = self._open()
+    self.segments = dict(self.db.execute("SELECT name, mtime FROM segments"))  # segment -> indexed mtime, None to list again
+
+    try:
+      self.watcher = _SegmentWatcher(self.root)
+    except (AttributeError, OSError):
+      cloudlog.exception("upload index can't watch the log root, scanning it on every refresh")
+      self.watcher = None
+    self.last_full_scan = None
+
+  def _open(self):
+    db = sqlite3.connect(self.path)
+    if db.execute("PRAGMA user_version").fetchone()[0] != UPLOAD_INDEX_VERSION:
+      db.executescript("""
+        DROP TABLE IF EXISTS segments;
+        DROP TABLE IF EXISTS files;
+        CREATE TABLE segments (name TEXT PRIMARY KEY, mtime INTEGER);
+        CREATE TABLE files (key TEXT PRIMARY KEY, segment TEXT, name TEXT, tier INTEGER, segment_sort TEXT, priority INTEGER);
+        CREATE INDEX files_by_tier ON files (tier, segment_sort, priority, name);
+        CREATE INDEX files_by_segment ON files (segment);
+      """)
+      db.execute("PRAGMA user_version = %d" % UPLOAD_INDEX_VERSION)
+      db.commit()
+    return db
+
+  def __len__(self):
+    return self.db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+  def _segment_sort(self, segment):
+    # lists of strings compare like their \x01 joined strings
+    return "\x01".join(self.segment_sort_fn(segment))
+
+  def _add_segment(self, segment, names, mtime):
+    rows = []
+    path = os.path.join(self.root, segment)
+    for name in names:
+      fn = os.path.join(path, name)
+      tier = self.tier_fn(name, fn)
+      if tier is None:
+        continue
+      try:
+        if getxattr(fn, self.attr_name):
+          continue
+      except OSError:
+        continue  # deleter could have deleted
+      rows.append((os.path.join(segment, name), segment, name, tier, self._segment_sort(segment), self.sort_fn(name)))
+
+    self.db.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)", rows)
+    self._set_mtime(segment, mtime)
+
+  def _set_mtime(self, segment, mtime):
+    if self.segments.get(segment, -1) != mtime:
+      self.db.execute("INSERT OR REPLACE INTO segments VALUES (?, ?)", (segment, mtime))
+      self.segments[segment] = mtime
+
+  def _remove_segments(self, segments):
+    for segment in segments:
+      self.db.execute("DELETE FROM files WHERE segment = ?", (segment,))
+      self.db.execute("DELETE FROM segments WHERE name = ?", (segment,))
+      del self.segments[segment]
+
+  def _stop_watching(self):
+    cloudlog.exception("upload index stopped watching the log root, scanning it on every refresh")
+    self.watcher.close()
+    self.watcher = None
+
+  def _update_segment(self, segment, mtime, recent):
+    try:
+      names = os.listdir(os.path.join(self.root, segment))
+    except OSError:
+      return
+    if mtime > recent:  # a file created right after listing could leave mtime unchanged
+      mtime = None
+    if any(name.endswith(".lock") for name in names):
+      # still being written, even files indexed before the lock appeared are added again once it's gone
+      self.db.execute("DELETE FROM files WHERE segment = ?", (segment,))
+      self._set_mtime(segment, None)
+      return
+    self._add_segment(segment, names, mtime)
+
+  def refresh(self):
+    changed = None
+    if self.watcher is not None and self.last_full_scan is not None and \
+       time.monotonic() - self.last_full_scan < FULL_SCAN_INTERVAL:
+      changed = self.watcher.changed()
+
+    if changed is None:
+      self._full_scan()
+    else:
+      self._refresh_changed(changed)
+    self.db.commit()
+
+  def _refresh_changed(self, changed):
+    recent = time.time_ns() - int(RECENT_MTIME * 1e9)
+    for segment in changed:
+      try:
+        # watched before listing, anything added after the listing shows up on the next refresh
+        watched = self.watcher.watch(segment)
+      except OSError:
+        self._stop_watching()
+        self._full_scan()
+        return
+      try:
+        mtime = os.stat(os.path.join(self.root, segment)).st_mtime_ns if watched else None
+      except OSError:
+        mtime = None
+      if mtime is None:  # deleted
+        if segment in self.segments:
+          self._remove_segments([segment])
+        continue
+      self._update_segment(segment, mtime, recent)
+
+  def _full_scan(self):
+    if self.watcher is not None:
+      self.watcher.changed()  # everything is listed below, events from before don't matter
+    present = {}
+    try:
+      with os.scandir(self.root) as it:
+        for entry in it:
+          if self.watcher is not None and entry.is_dir():
+            try:
+              self.watcher.watch(entry.name)
+            except OSError:
+              self._stop_watching()
+          try:
+            present[entry.name] = entry.stat().st_mtime_ns
+          except OSError:
+            continue  # deleter could have deleted
+    except OSError:
+      pass
+    self.last_full_scan = time.monotonic()
+
+    self._remove_segments(self.segments.keys() - present.keys())
+
+    recent = time.time_ns() - int(RECENT_MTIME * 1e9)
+    for segment, mtime in present.items():
+      if segment in self.segments and self.segments[segment] == mtime:
+        continue
+      self._update_segment(segment, mtime, recent)
+
+  def next(self, max_tier):
+    # (key, fn) of the first file in upload order up to max_tier
+    row = self.db.execute("SELECT key FROM files WHERE tier <= ? ORDER BY tier, segment_sort, priority, name LIMIT 1",
+                          (max_tier,)).fetchone()
+    if row is None:
+      return None
+    return row[0], os.path.join(self.root, row[0])
+
+  def remove(self, key):
+    self.db.execute("DELETE FROM files WHERE key = ?", (key,))
+    self.db.commit()
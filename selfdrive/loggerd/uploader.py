@@ -2,7 +2,6 @@
 import json
 import os
 import random
-import requests
 import threading
 import time
 import traceback
@@ -15,6 +14,8 @@ from common.api import Api
 from common.params import Params
 from selfdrive.loggerd.xattr_cache import getxattr, setxattr
 from selfdrive.loggerd.config import ROOT
+from selfdrive.loggerd.upload_engine import UploadEngine
+from selfdrive.loggerd.upload_index import UploadIndex, get_index_path, TIER_IMMEDIATE, TIER_HIGH, TIER_OTHER
 from selfdrive.swaglog import cloudlog
 from common.op_params import opParams
 
@@ -27,6 +28,11 @@ force_wifi = os.getenv("FORCEWIFI") is not None
 fake_upload = os.getenv("FAKEUPLOAD") is not None
 op_params = opParams()
 
+# upload bandwidth limits in bytes/s, None is unlimited
+UPLOAD_RATE_WIFI = None
+UPLOAD_RATE_HOTSPOT = 512 * 1024
+UPLOAD_RATE_CELL = 256 * 1024
+
 
 def get_directory_sort(d):
   return list(map(lambda s: s.rjust(10, '0'), d.rsplit('--', 1)))
@@ -63,6 +69,14 @@ def is_on_hotspot():
     return False
 
 
+def network_upload_rate(on_wifi):
+  """Returns whether uploading is allowed on the current network, and the bandwidth limit to upload with"""
+  on_hotspot = is_on_hotspot()
+  if on_hotspot and not op_params.get('upload_on_hotspot'):
+    return False, None
+  return True, UPLOAD_RATE_HOTSPOT if on_hotspot else UPLOAD_RATE_WIFI if on_wifi else UPLOAD_RATE_CELL
+
+
 class Uploader():
   def __init__(self, dongle_id, root):
     self.dongle_id = dongle_id
@@ -70,6 +84,7 @@ class Uploader():
     self.root = root
 
     self.upload_thread = None
+    self.engine = UploadEngine()
 
     self.last_resp = None
     self.last_exc = None
@@ -78,6 +93,9 @@ class Uploader():
     self.immediate_priority = {"qlog.bz2": 0, "qcamera.ts": 1}
     self.high_priority = {"rlog.bz2": 0, "fcamera.hevc": 1, "dcamera.hevc": 2, "ecamera.hevc": 3}
 
+    self.index = UploadIndex(root, get_index_path(root), self.get_upload_tier, self.get_upload_sort,
+                             get_directory_sort, UPLOAD_ATTR_NAME)
+
   def get_upload_sort(self, name):
     if name in self.immediate_priority:
       return self.immediate_priority[name]
@@ -85,51 +103,33 @@ class Uploader():
       return self.high_priority[name] + 100
     return 1000
 
-  def gen_upload_files(self):
-    if not os.path.isdir(self.root):
-      return
-    for logname in listdir_by_creation(self.root):
-      path = os.path.join(self.root, logname)
-      try:
-        names = os.listdir(path)
-      except OSError:
-        continue
-      if any(name.endswith(".lock") for name in names):
-        continue
-
-      for name in sorted(names, key=self.get_upload_sort):
-        key = os.path.join(logname, name)
-        fn = os.path.join(path, name)
-        # skip files already uploaded
-        try:
-          is_uploaded = getxattr(fn, UPLOAD_ATTR_NAME)
-        except OSError:
-          cloudlog.event("uploader_getxattr_failed", exc=self.last_exc, key=key, fn=fn)
-          is_uploaded = True  # deleter could have deleted
-        if is_uploaded:
-          continue
-        yield (name, key, fn)
+  def get_upload_tier(self, name, fn):
+    # qlog files first, then the full log files, rear and front camera files, then other files
+    if name in self.immediate_priority or any(f in fn for f in self.immediate_folders):
+      return TIER_IMMEDIATE
+    if name in self.high_priority:
+      return TIER_HIGH
+    if not name.endswith('.lock') and not name.endswith(".tmp"):
+      return TIER_OTHER
+    return None
 
   def next_file_to_upload(self, with_raw):
-    upload_files = list(self.gen_upload_files())
-
-    # try to upload qlog files first
-    for name, key, fn in upload_files:
-      if name in self.immediate_priority or any(f in fn for f in self.immediate_folders):
-        return (key, fn)
-
-    if with_raw:
-      # then upload the full log files, rear and front camera files
-      for name, key, fn in upload_files:
-        if name in self.high_priority:
-          return (key, fn)
+    self.index.refresh()
 
-      # then upload other files
-      for name, key, fn in upload_files:
-        if not name.endswith('.lock') and not name.endswith(".tmp"):
-          return (key, fn)
+    while True:
+      d = self.index.next(TIER_OTHER if with_raw else TIER_IMMEDIATE)
+      if d is None:
+        return None
 
-    return None
+      # the index only drops files tagged by this uploader, make sure it wasn't tagged or deleted since
+      key, fn = d
+      try:
+        is_uploaded = getxattr(fn, UPLOAD_ATTR_NAME)
+      except OSError:
+        is_uploaded = True
+      if not is_uploaded:
+        return d
+      self.index.remove(key)
 
   def do_upload(self, key, fn):
     try:
@@ -152,8 +152,7 @@ class Uploader():
 
         self.last_resp = FakeResponse()
       else:
-        with open(fn, "rb") as f:
-          self.last_resp = requests.put(url, data=f, headers=headers, timeout=10)
+        self.last_resp = self.engine.upload(fn, url, headers)
     except Exception as e:
       self.last_exc = (e, traceback.format_exc())
       raise
@@ -202,6 +201,8 @@ class Uploader():
         cloudlog.event("upload_failed", stat=stat, exc=self.last_exc, key=key, fn=fn, sz=sz)
         success = False
 
+    if success:
+      self.index.remove(key)
     return success
 
 def uploader_fn(exit_event):
@@ -225,8 +226,9 @@ def uploader_fn(exit_event):
     allow_raw_upload = params.get("IsUploadRawEnabled") != b"0"
 
     d = None
-    on_hotspot = is_on_hotspot()
-    if (on_hotspot and op_params.get('upload_on_hotspot')) or not on_hotspot:
+    allowed, rate = network_upload_rate(on_wifi)
+    if allowed:
+      uploader.engine.set_rate(rate)
       d = uploader.next_file_to_upload(with_raw=allow_raw_upload and on_wifi and offroad)
 
     if d is None:  # Nothing to upload